@@ -0,0 +1,56 @@
+"""
+Compares the stored size and encode/decode time of a synthetic gallery tree
+under each gallery data encoding (the original pretty JSON as the baseline).
+
+Usage:
+    python -m benchmarks.bench_codec --images 100000
+"""
+import argparse
+import json
+import time
+from gallery_generator.services import codec
+from benchmarks.synthetic import generate_gallery
+
+
+def best_of(fn, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=100000)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    gallery_data = generate_gallery(args.images, depth=args.depth)
+    candidates = [('pretty json (legacy)', lambda: json.dumps(gallery_data, ensure_ascii=False, indent=4).encode('utf-8'))]
+    for fmt in codec.FORMATS:
+        if fmt == 'msgpack' and codec.msgpack is None:
+            continue
+        for compression in codec.COMPRESSIONS:
+            if compression == 'zstd' and codec.zstandard is None:
+                continue
+            candidates.append((f"{fmt}+{compression}", lambda f=fmt, c=compression: codec.encode(gallery_data, f, c)))
+
+    print(f"orjson: {'yes' if codec.orjson else 'no'}, msgpack: {'yes' if codec.msgpack else 'no'}, "
+          f"zstandard: {'yes' if codec.zstandard else 'no'}")
+    baseline = None
+    for name, encode in candidates:
+        raw = encode()
+        encode_time = best_of(encode, args.repeat)
+        decode_time = best_of(lambda: codec.decode(raw), args.repeat)
+        if baseline is None:
+            baseline = (len(raw), encode_time, decode_time)
+        print(f"{name:<22} {len(raw) / 1e6:8.2f} MB ({baseline[0] / len(raw):4.1f}x)  "
+              f"encode {encode_time * 1000:8.1f} ms ({baseline[1] / encode_time:4.1f}x)  "
+              f"decode {decode_time * 1000:8.1f} ms ({baseline[2] / decode_time:4.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Measures ingest throughput (images per second) of UploadService.process_zip_file
+against the number of process-pool workers used for the CPU stage.
+
+Usage:
+    python -m benchmarks.bench_ingest --images 2000 --workers 0 1 2 4 8 16
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from gallery_generator.config_manager import config_manager
+from gallery_generator.services.upload_service import UploadService
+from benchmarks.fake_storage import NullStorage
+from benchmarks.synthetic import generate_zip
+
+
+def run(zip_path: str, workers: int) -> float:
+    config_manager.config['INGEST_PROCESS_WORKERS'] = workers
+    service = UploadService(NullStorage())
+    with open(zip_path, 'rb') as stream:
+        # Warm up the pool so worker start-up is not part of the measurement
+        service.process_zip_file(stream, 'warmup')
+    start = time.perf_counter()
+    with open(zip_path, 'rb') as stream:
+        gallery_data = service.process_zip_file(stream, 'bench')
+    elapsed = time.perf_counter() - start
+    assert gallery_data is not None
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=1000)
+    parser.add_argument('--width', type=int, default=1600)
+    parser.add_argument('--height', type=int, default=1200)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4, 8, 16])
+    parser.add_argument('--output', help='Write results as JSON to this file.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        zip_path = os.path.join(tmp, 'bench.zip')
+        generate_zip(zip_path, args.images, width=args.width, height=args.height)
+        results = []
+        for workers in args.workers:
+            elapsed = run(zip_path, workers)
+            results.append({'workers': workers, 'seconds': elapsed, 'images_per_second': args.images / elapsed})
+            print(f"workers={workers:>2}  {args.images / elapsed:10.1f} images/s  ({elapsed:.2f}s)")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'images': args.images, 'width': args.width, 'height': args.height,
+                       'cpu_count': os.cpu_count(), 'results': results}, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Measures cold start of a worker: importing gallery_generator.app and creating
+the app, each in a fresh interpreter, plus the heaviest imports.
+
+Use --max-import-ms / --max-create-ms in CI to fail when startup regresses.
+
+Usage:
+    python -m benchmarks.bench_startup --runs 10
+    python -m benchmarks.bench_startup --max-import-ms 400 --max-create-ms 150
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter; prints import and create_app time in milliseconds
+_PROBE = """
+import json, time
+start = time.perf_counter()
+import gallery_generator.app as app_module
+imported = time.perf_counter()
+app_module.get_application()
+created = time.perf_counter()
+print(json.dumps({'import_ms': (imported - start) * 1000, 'create_ms': (created - imported) * 1000}))
+"""
+
+
+def _write_config(tmp_dir: str) -> str:
+    config_path = os.path.join(tmp_dir, 'config.json')
+    with open(config_path, 'w') as f:
+        json.dump({
+            'storage_type': 'local',
+            'GALLERY_ROOT': os.path.join(tmp_dir, 'gallery_data'),
+            'JOB_DB_PATH': os.path.join(tmp_dir, 'jobs.sqlite3'),
+            'JOB_SPOOL_DIR': os.path.join(tmp_dir, 'spool')
+        }, f)
+    return config_path
+
+
+def _run(args: list[str], config_path: str) -> subprocess.CompletedProcess:
+    env = dict(os.environ, GALLERY_CONFIG=config_path)
+    return subprocess.run([sys.executable, *args], cwd=PROJECT_DIR, env=env, capture_output=True, text=True, check=True)
+
+
+def heaviest_imports(config_path: str, top: int) -> list[tuple[int, str]]:
+    """Direct imports of gallery_generator.app with the largest cumulative import time (microseconds)."""
+    stderr = _run(['-X', 'importtime', '-c', 'import gallery_generator.app'], config_path).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nesting is shown by indentation: one extra level below the module imported by -c
+        if len(name) - len(name.lstrip()) == 3:
+            rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--top', type=int, default=10, help='Number of heaviest imports to list.')
+    parser.add_argument('--max-import-ms', type=float, help='Fail if the median import time exceeds this.')
+    parser.add_argument('--max-create-ms', type=float, help='Fail if the median create_app time exceeds this.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config_path = _write_config(tmp_dir)
+        _run(['-c', 'import gallery_generator.app'], config_path) # Warm the bytecode and OS file caches
+        samples = [json.loads(_run(['-c', _PROBE], config_path).stdout.strip().splitlines()[-1])
+                   for _ in range(args.runs)]
+        imports = heaviest_imports(config_path, args.top)
+
+    import_ms = statistics.median(sample['import_ms'] for sample in samples)
+    create_ms = statistics.median(sample['create_ms'] for sample in samples)
+    print(f"import gallery_generator.app: {import_ms:7.1f} ms (median of {args.runs})")
+    print(f"create_app():                 {create_ms:7.1f} ms")
+    print("\nHeaviest imports of gallery_generator.app:")
+    for cumulative, name in imports:
+        print(f"  {cumulative / 1000:7.1f} ms  {name}")
+
+    failed = False
+    if args.max_import_ms is not None and import_ms > args.max_import_ms:
+        print(f"\nFAIL: import time {import_ms:.1f} ms exceeds {args.max_import_ms} ms")
+        failed = True
+    if args.max_create_ms is not None and create_ms > args.max_create_ms:
+        print(f"\nFAIL: create_app time {create_ms:.1f} ms exceeds {args.max_create_ms} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
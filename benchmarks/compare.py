@@ -0,0 +1,46 @@
+"""
+Compares two result files written by benchmarks/run_benchmarks.py and flags
+cases whose median time grew by more than the threshold.
+
+Usage:
+    python -m benchmarks.compare baseline.json candidate.json --threshold 0.2
+"""
+import argparse
+import json
+import sys
+
+
+def load_results(path: str) -> tuple[dict, str | None]:
+    with open(path) as f:
+        report = json.load(f)
+    return {(r['case'], r['storage'], r['size']): r for r in report['results']}, report.get('git_revision')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Relative slowdown of the median that counts as a regression.')
+    args = parser.parse_args()
+
+    baseline, baseline_rev = load_results(args.baseline)
+    candidate, candidate_rev = load_results(args.candidate)
+    print(f"baseline {baseline_rev or args.baseline}  ->  candidate {candidate_rev or args.candidate}")
+
+    regressions = 0
+    for key in sorted(baseline.keys() & candidate.keys()):
+        before, after = baseline[key]['median'], candidate[key]['median']
+        change = (after - before) / before if before else 0
+        flag = ''
+        if change > args.threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        case, storage, size = key
+        print(f"{case:<20} {storage:<6} {size:>7}  {before * 1000:10.1f} ms -> {after * 1000:10.1f} ms  {change:+7.1%}{flag}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Storage backends used only by the benchmarks."""
+import threading
+import time
+from gallery_generator.storage.storage import Storage
+
+
+class NullStorage(Storage):
+    """Discards writes, so a benchmark measures the code under test rather than I/O."""
+
+    def save(self, file_path: str, data: bytes):
+        pass
+
+    def load(self, file_path: str) -> bytes:
+        raise FileNotFoundError(file_path)
+
+    def delete(self, file_path: str):
+        pass
+
+    def list_files(self, directory_path: str) -> list[str]:
+        return []
+
+    def exists(self, file_path: str) -> bool:
+        return False
+
+
+class FakeRemoteStorage(Storage):
+    """
+    An in-memory storage that sleeps `latency` seconds on every call (plus a
+    transfer time of `seconds_per_mb` per megabyte), to approximate a remote
+    backend such as DatabricksStorage without the network.
+    """
+
+    def __init__(self, latency: float = 0.02, seconds_per_mb: float = 0.0):
+        self.latency = latency
+        self.seconds_per_mb = seconds_per_mb
+        self.files = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def _wait(self, operation: str, nbytes: int = 0):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        time.sleep(self.latency + self.seconds_per_mb * nbytes / (1024 * 1024))
+
+    @staticmethod
+    def _normalize(path: str) -> str:
+        return path.replace('\\', '/').strip('/')
+
+    def save(self, file_path: str, data: bytes):
+        self._wait('save', len(data))
+        self.files[self._normalize(file_path)] = bytes(data)
+
+    def load(self, file_path: str) -> bytes:
+        path = self._normalize(file_path)
+        if path not in self.files:
+            self._wait('load')
+            raise FileNotFoundError(file_path)
+        data = self.files[path]
+        self._wait('load', len(data))
+        return data
+
+    def delete(self, file_path: str):
+        self._wait('delete')
+        self.files.pop(self._normalize(file_path), None)
+
+    def list_files(self, directory_path: str) -> list[str]:
+        self._wait('list_files')
+        prefix = self._normalize(directory_path) + '/'
+        return [path[len(prefix):] for path in self.files
+                if path.startswith(prefix) and '/' not in path[len(prefix):]]
+
+    def exists(self, file_path: str) -> bool:
+        self._wait('exists')
+        path = self._normalize(file_path)
+        # Directories exist if any file lives below them, as on Databricks Volumes
+        return path in self.files or any(p.startswith(path + '/') for p in self.files)
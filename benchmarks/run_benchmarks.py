@@ -0,0 +1,245 @@
+"""
+Benchmark suite for the gallery services, run against synthetic galleries.
+
+Each case is timed against LocalStorage (in a temporary directory) and against
+FakeRemoteStorage with injected per-call latency. Results are written as JSON
+so runs from different commits can be compared with benchmarks/compare.py.
+
+Usage:
+    python -m benchmarks.run_benchmarks --sizes 1000 10000 --output results.json
+    python -m benchmarks.run_benchmarks --sizes 100000 --storages local --cases load_gallery_data save_gallery_data
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from gallery_generator.config_manager import ConfigManager
+from gallery_generator.storage.local_storage import LocalStorage
+from gallery_generator.services.data_manager import DataManager
+from gallery_generator.services.delete_service import DeleteService
+from gallery_generator.services.report_service import ReportService
+from gallery_generator.services.upload_service import UploadService
+from benchmarks.fake_storage import FakeRemoteStorage
+from benchmarks.synthetic import generate_gallery, generate_zip, iter_images
+
+GALLERY = 'bench'
+
+
+class BenchContext:
+    """Storage, DataManager and a Flask app wired together for one benchmark run."""
+
+    def __init__(self, storage_kind: str, tmp_dir: str, latency: float):
+        if storage_kind == 'remote':
+            self.storage = FakeRemoteStorage(latency=latency)
+        else:
+            self.storage = LocalStorage(os.path.join(tmp_dir, 'gallery_data'))
+        self.data_manager = DataManager('', None, self.storage)
+        self.tmp_dir = tmp_dir
+        self._app = None
+
+    @property
+    def app(self):
+        if self._app is None:
+            from gallery_generator.app import create_app
+            ConfigManager._reset_instance()
+            config = ConfigManager()
+            config.config['storage_type'] = 'local'
+            config.config['GALLERY_ROOT'] = os.path.join(self.tmp_dir, 'gallery_data')
+            config.config['JOB_DB_PATH'] = os.path.join(self.tmp_dir, 'jobs.sqlite3')
+            config.config['JOB_SPOOL_DIR'] = os.path.join(self.tmp_dir, 'spool')
+            self._app = create_app(config_manager_instance=config)
+            self._app.storage = self.storage
+            self._app.data_manager = self.data_manager
+        return self._app
+
+
+def timed(fn, repeat: int, setup=None) -> dict:
+    """Runs `fn` `repeat` times (calling `setup` untimed before each run)."""
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return {
+        'min': min(samples),
+        'median': statistics.median(samples),
+        'max': max(samples),
+        'repeat': repeat
+    }
+
+
+def bench_process_zip_file(ctx: BenchContext, size: int, args) -> dict:
+    images = min(size, args.zip_images)
+    zip_path = os.path.join(ctx.tmp_dir, f"synthetic_{images}.zip")
+    if not os.path.exists(zip_path):
+        generate_zip(zip_path, images, depth=args.depth)
+    service = UploadService(ctx.storage)
+
+    def run():
+        with open(zip_path, 'rb') as stream:
+            assert service.process_zip_file(stream, GALLERY) is not None
+
+    result = timed(run, args.repeat)
+    result['images'] = images
+    result['images_per_second'] = images / result['median']
+    return result
+
+
+def bench_load_gallery_data(ctx: BenchContext, size: int, args) -> dict:
+    ctx.data_manager.save_gallery_data(generate_gallery(size, depth=args.depth), GALLERY)
+    return timed(lambda: ctx.data_manager.load_gallery_data(GALLERY), args.repeat)
+
+
+def bench_save_gallery_data(ctx: BenchContext, size: int, args) -> dict:
+    gallery_data = generate_gallery(size, depth=args.depth)
+    ctx.data_manager.save_gallery_data(gallery_data, GALLERY)
+    runs = itertools.count()
+
+    def save():
+        # A changed comment each run, since saving an unchanged tree is a no-op
+        gallery_data['comment'] = f"run {next(runs)}"
+        ctx.data_manager.save_gallery_data(gallery_data, GALLERY)
+    return timed(save, args.repeat)
+
+
+def bench_save_unchanged_gallery_data(ctx: BenchContext, size: int, args) -> dict:
+    gallery_data = generate_gallery(size, depth=args.depth)
+    ctx.data_manager.save_gallery_data(gallery_data, GALLERY)
+    return timed(lambda: ctx.data_manager.save_gallery_data(gallery_data, GALLERY), args.repeat)
+
+
+def _bulk_selection(gallery_data: dict, fraction: float, seed: int = 0) -> list[str]:
+    filenames = [image['filename'] for _, image in iter_images(gallery_data)]
+    return random.Random(seed).sample(filenames, max(1, int(len(filenames) * fraction)))
+
+
+def bench_update_image_status(ctx: BenchContext, size: int, args) -> dict:
+    gallery_data = generate_gallery(size, depth=args.depth)
+    ctx.data_manager.save_gallery_data(gallery_data, GALLERY)
+    selection = _bulk_selection(gallery_data, args.selection_fraction)
+    # Alternating statuses, so every run changes the tree and goes through the save
+    statuses = itertools.cycle(['good', 'bad'])
+    result = timed(lambda: ctx.data_manager.update_image_status(selection, next(statuses), GALLERY), args.repeat)
+    result['selected'] = len(selection)
+    return result
+
+
+def bench_delete_items(ctx: BenchContext, size: int, args) -> dict:
+    gallery_data = generate_gallery(size, depth=args.depth)
+    selection = _bulk_selection(gallery_data, args.selection_fraction)
+    service = DeleteService(ctx.storage, ctx.data_manager)
+    result = timed(lambda: service.delete_items(selection, GALLERY), args.repeat,
+                   setup=lambda: ctx.data_manager.save_gallery_data(gallery_data, GALLERY))
+    result['selected'] = len(selection)
+    return result
+
+
+def _bench_report(ctx: BenchContext, size: int, args, report_format: str) -> dict:
+    gallery_data = generate_gallery(size, depth=args.depth)
+    service = ReportService(ctx.storage)
+    generate = service.generate_html_report if report_format == 'html' else service.generate_markdown_report
+    with ctx.app.app_context():
+        return timed(lambda: generate(gallery_data, GALLERY, 'http://localhost', 'good_and_neutral'), args.repeat)
+
+
+def bench_html_report(ctx: BenchContext, size: int, args) -> dict:
+    return _bench_report(ctx, size, args, 'html')
+
+
+def bench_markdown_report(ctx: BenchContext, size: int, args) -> dict:
+    return _bench_report(ctx, size, args, 'markdown')
+
+
+def bench_serve_image(ctx: BenchContext, size: int, args) -> dict:
+    # serve_image cost does not depend on the gallery size; a fixed sample of images is fetched
+    filenames = [f"IMG_{i:07d}.jpg" for i in range(args.serve_images)]
+    payload = os.urandom(args.image_bytes)
+    for filename in filenames:
+        ctx.storage.save(f"{GALLERY}/{filename}", payload)
+    client = ctx.app.test_client()
+
+    def run():
+        for filename in filenames:
+            response = client.get(f"/images/{GALLERY}/{filename}")
+            assert response.status_code == 200
+            response.close()
+
+    result = timed(run, args.repeat)
+    result['requests'] = len(filenames)
+    result['requests_per_second'] = len(filenames) / result['median']
+    return result
+
+
+CASES = {
+    'process_zip_file': bench_process_zip_file,
+    'load_gallery_data': bench_load_gallery_data,
+    'save_gallery_data': bench_save_gallery_data,
+    'save_unchanged_gallery_data': bench_save_unchanged_gallery_data,
+    'update_image_status': bench_update_image_status,
+    'delete_items': bench_delete_items,
+    'html_report': bench_html_report,
+    'markdown_report': bench_markdown_report,
+    'serve_image': bench_serve_image,
+}
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Gallery sizes (number of images).')
+    parser.add_argument('--depth', type=int, default=3, help='Maximum folder depth of the synthetic trees.')
+    parser.add_argument('--storages', nargs='+', choices=['local', 'remote'], default=['local', 'remote'])
+    parser.add_argument('--latency-ms', type=float, default=20, help='Per-call latency of the fake remote storage.')
+    parser.add_argument('--cases', nargs='+', choices=sorted(CASES), default=list(CASES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--zip-images', type=int, default=1000,
+                        help='Upper bound on images in the synthetic zip for process_zip_file.')
+    parser.add_argument('--selection-fraction', type=float, default=0.1,
+                        help='Fraction of images selected for bulk status updates and deletes.')
+    parser.add_argument('--serve-images', type=int, default=100)
+    parser.add_argument('--image-bytes', type=int, default=500_000)
+    parser.add_argument('--output', help='Write results as JSON to this file.')
+    args = parser.parse_args()
+
+    results = []
+    for storage_kind in args.storages:
+        for size in args.sizes:
+            for case in args.cases:
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    ctx = BenchContext(storage_kind, tmp_dir, args.latency_ms / 1000)
+                    result = CASES[case](ctx, size, args)
+                result.update({'case': case, 'storage': storage_kind, 'size': size})
+                results.append(result)
+                print(f"{case:<20} {storage_kind:<6} {size:>7}  median {result['median'] * 1000:10.1f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'git_revision': _git_revision(),
+                'python': platform.python_version(),
+                'cpu_count': os.cpu_count(),
+                'args': vars(args),
+                'results': results
+            }, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
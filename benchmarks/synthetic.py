@@ -0,0 +1,97 @@
+"""Generators for synthetic galleries and zip archives used by the benchmarks."""
+import hashlib
+import io
+import random
+import zipfile
+from PIL import Image
+
+STATUSES = ['neutral', 'good', 'bad']
+
+
+def make_jpeg(width: int, height: int, seed: int) -> bytes:
+    """Encodes a small random JPEG; the noise makes every image unique."""
+    rng = random.Random(seed)
+    image = Image.new('RGB', (width, height), tuple(rng.randrange(256) for _ in range(3)))
+    for _ in range(64):
+        x, y = rng.randrange(width), rng.randrange(height)
+        image.putpixel((x, y), tuple(rng.randrange(256) for _ in range(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def folder_paths(folders: int, depth: int, seed: int = 0) -> list[str]:
+    """
+    Returns `folders` distinct folder paths of 1 to `depth` levels, shaped like
+    a photo archive (years, events, days).
+    """
+    rng = random.Random(seed)
+    paths = []
+    seen = set()
+    while len(paths) < folders:
+        levels = rng.randint(1, depth)
+        parts = [f"level{level}_{rng.randrange(max(2, int(folders ** (1 / depth)) + 1)):03d}" for level in range(levels)]
+        path = '/'.join(parts)
+        if path not in seen:
+            seen.add(path)
+            paths.append(path)
+    return paths
+
+
+def generate_gallery(images: int, depth: int = 3, images_per_folder: int = 50, seed: int = 0) -> dict:
+    """
+    Builds a gallery tree in the shape UploadService produces, with `images`
+    images spread over folders up to `depth` levels deep.
+    """
+    rng = random.Random(seed)
+    root = {"name": "root", "images": [], "comment": "", "children": []}
+    folders = folder_paths(max(1, images // images_per_folder), depth, seed)
+    nodes = {}
+
+    def get_node(path):
+        if path in nodes:
+            return nodes[path]
+        parent = root
+        parts = path.split('/')
+        for i in range(len(parts)):
+            sub_path = '/'.join(parts[:i + 1])
+            node = nodes.get(sub_path)
+            if node is None:
+                node = {"name": parts[i], "full_path": sub_path, "images": [], "comment": "", "children": []}
+                parent['children'].append(node)
+                nodes[sub_path] = node
+            parent = node
+        return parent
+
+    for i in range(images):
+        node = get_node(folders[i % len(folders)])
+        date = f"2024-{1 + i % 12:02d}-{1 + i % 28:02d}"
+        digest = hashlib.md5(f"IMG_{i:07d}.jpg-{date}".encode('utf-8')).hexdigest()
+        node['images'].append({
+            "filename": f"IMG_{i:07d}_{digest}.jpg",
+            "modification_date": date,
+            "status": rng.choice(STATUSES),
+            "size": rng.randint(200_000, 6_000_000),
+            "width": 4000,
+            "height": 3000,
+            "phash": f"{rng.getrandbits(64):016x}"
+        })
+    return root
+
+
+def iter_images(node):
+    """Yields (node, image) for every image of a tree."""
+    for image in node.get('images', []):
+        yield node, image
+    for child in node.get('children', []):
+        yield from iter_images(child)
+
+
+def generate_zip(path: str, images: int, depth: int = 3, width: int = 320, height: int = 240, seed: int = 0):
+    """Writes a zip archive with `images` JPEGs laid out in nested folders."""
+    folders = folder_paths(max(1, images // 50), depth, seed)
+    with zipfile.ZipFile(path, 'w') as zf:
+        for i in range(images):
+            name = f"Archive/{folders[i % len(folders)]}/IMG_{i:07d}.jpg"
+            zf.writestr(zipfile.ZipInfo(name, date_time=(2024, 1, 1 + i % 28, 12, 0, 0)),
+                        make_jpeg(width, height, seed + i))
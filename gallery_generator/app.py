@@ -1,36 +1,74 @@
 import os
+import threading
 from flask import Flask
 from flask_socketio import SocketIO
-from gallery_generator.config_manager import config_manager
+from gallery_generator.config_manager import config_manager as default_config_manager
 from gallery_generator.logger_config import setup_logging
-from gallery_generator.storage.local_storage import LocalStorage
-from gallery_generator.storage.databricks_storage import DatabricksStorage
-from gallery_generator.services.data_manager import DataManager
+from gallery_generator.socket_events import register_socket_events
+from gallery_generator import tracing, profiling
+from gallery_generator.http_cache import CompressedBodyCache
+from gallery_generator.backends import create_storage, create_data_manager
+from gallery_generator.services.job_queue import JobQueue
+from gallery_generator.services.job_service import JobService
 
 socketio = SocketIO(async_mode='threading') # Define socketio globally
 
-def create_app(environ=None, start_response=None):
+def create_app(config_manager_instance=None):
     app = Flask(__name__)
 
     # Setup logging
     setup_logging()
 
-    # Load configuration
+    # Load configuration; tests and benchmarks pass their own ConfigManager
+    config_manager = config_manager_instance or default_config_manager
     app.config['CONFIG'] = config_manager
+    tracing.init_app(app)
+
+    # Initialize storage based on config; only the selected backend is imported
+    project_dir = os.path.dirname(app.root_path)
+    storage, data_manager_base_dir, storage_type = create_storage(config_manager, os.path.join(project_dir, 'gallery_data'))
+
+    # Storage metrics are opt-in; when disabled the backend is used unwrapped
+    app.config['STORAGE_METRICS_ENABLED'] = config_manager.get('STORAGE_METRICS_ENABLED', False)
+    if app.config['STORAGE_METRICS_ENABLED']:
+        from gallery_generator.storage.instrumented_storage import InstrumentedStorage
+        storage = InstrumentedStorage(storage, storage_type,
+                                      per_gallery=config_manager.get('STORAGE_METRICS_PER_GALLERY', True))
+
+    # Read-through cache in front of (slow) backends; outside the metrics wrapper, so the
+    # metrics count only the calls that actually reach the backend
+    if config_manager.get('STORAGE_CACHE_ENABLED', False):
+        from gallery_generator.storage.caching_storage import CachingStorage
+        storage = CachingStorage(
+            storage,
+            config_manager.get('STORAGE_CACHE_DIR', os.path.join(project_dir, 'cache_data', 'storage')),
+            disk_max_bytes=config_manager.get('STORAGE_CACHE_DISK_MAX_BYTES', 1024 ** 3),
+            memory_max_bytes=config_manager.get('STORAGE_CACHE_MEMORY_MAX_BYTES', 32 * 1024 * 1024),
+            memory_ttl=config_manager.get('STORAGE_CACHE_MEMORY_TTL', 0)
+        )
 
-    # Initialize storage based on config
-    storage_type = config_manager.get('storage_type')
-    if storage_type == 'databricks':
-        storage = DatabricksStorage()
-        data_manager_base_dir = '' # Empty string for Databricks, as volume_path already includes the base
-    else: # Default to local
-        local_gallery_data_path = os.path.join(os.path.dirname(app.root_path), 'gallery_data')
-        storage = LocalStorage(local_gallery_data_path)
-        data_manager_base_dir = '' # LocalStorage handles the absolute path
-    
     # Make storage and data_manager accessible
     app.storage = storage
-    app.data_manager = DataManager(data_manager_base_dir, config_manager, app.storage)
+    # Gallery metadata lives in one JSON document per gallery ('json'), in one shard per
+    # top-level folder plus a manifest ('sharded'), or in a local SQLite database ('sqlite')
+    app.data_manager = create_data_manager(config_manager, app.storage, data_manager_base_dir, project_dir)
+    # Encoded API response bodies, keyed by gallery data version
+    app.response_cache = CompressedBodyCache(config_manager.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+    # Persistent job queue shared by all web workers and the job worker processes
+    job_data_dir = os.path.join(project_dir, 'job_data')
+    app.job_queue = JobQueue(
+        config_manager.get('JOB_DB_PATH', os.path.join(job_data_dir, 'jobs.sqlite3')),
+        max_concurrent=config_manager.get('JOB_MAX_CONCURRENT', 4),
+        max_per_gallery=config_manager.get('JOB_MAX_PER_GALLERY', 1),
+        lease_seconds=config_manager.get('JOB_LEASE_SECONDS', 60),
+        max_attempts=config_manager.get('JOB_MAX_ATTEMPTS', 3)
+    )
+    app.config['JOB_SPOOL_DIR'] = config_manager.get('JOB_SPOOL_DIR', os.path.join(job_data_dir, 'spool'))
+    os.makedirs(app.config['JOB_SPOOL_DIR'], exist_ok=True)
+    # 'inline' runs jobs in a background task of the web worker that accepted them,
+    # 'worker' leaves them to `python -m gallery_generator.worker`.
+    app.config['JOB_EXECUTION'] = config_manager.get('JOB_EXECUTION', 'inline')
 
     # Set a secret key for session management
     app.config['SECRET_KEY'] = 'a_very_secret_key_that_should_be_in_env_or_config' # Replace with a strong, random key in production
@@ -41,15 +79,53 @@ def create_app(environ=None, start_response=None):
     # Initialize SocketIO
     socketio.init_app(app)
     app.socketio = socketio # Make socketio accessible via app.socketio
+    register_socket_events(socketio)
+    app.job_service = JobService(app.job_queue, app.storage, app.data_manager, socketio=socketio,
+                                 progress_interval=config_manager.get('JOB_PROGRESS_INTERVAL', 1.0),
+                                 history_seconds=config_manager.get('JOB_HISTORY_SECONDS', 24 * 3600))
 
     # Import and register blueprints or routes here later
     from gallery_generator.routes import main as main_blueprint
     app.register_blueprint(main_blueprint)
+    profiling.init_app(app)
 
     return app # This return statement must be inside the function
 
-if __name__ == '__main__':
-    app = create_app()
-    socketio.run(app, debug=True)
+_application = None
+_application_lock = threading.Lock()
+
+
+def start_job_sweeper(app):
+    """
+    In 'inline' mode, drains the job queue in a background task at startup and
+    every JOB_SWEEP_INTERVAL seconds (default JOB_LEASE_SECONDS), so jobs left
+    behind by a restarted or crashed web worker are resumed. Not started by
+    create_app itself, so tests and CLI tools that build an app run no jobs.
+    """
+    config_manager = app.config['CONFIG']
+    interval = config_manager.get('JOB_SWEEP_INTERVAL', app.job_queue.lease_seconds)
+    if app.config['JOB_EXECUTION'] == 'inline' and interval:
+        app.socketio.start_background_task(app.job_service.sweep, interval)
 
-application = create_app()
+
+def get_application():
+    """The app for the default configuration, created on first use and shared afterwards."""
+    global _application
+    if _application is None:
+        with _application_lock:
+            if _application is None:
+                _application = create_app()
+                start_job_sweeper(_application)
+    return _application
+
+
+def __getattr__(name):
+    # `gallery_generator.app:application` (e.g. for gunicorn) builds the app on first access,
+    # so importing this module (tests, CLI tools, job workers) does not
+    if name == 'application':
+        return get_application()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+if __name__ == '__main__':
+    socketio.run(get_application(), debug=True)
@@ -0,0 +1,95 @@
+"""
+Registry of storage and metadata backends.
+
+Backends are named by "module:Class" strings and only imported when a
+configuration selects them, so e.g. a local deployment never imports the
+Databricks client (and its HTTP and .env dependencies), and a web worker
+using the JSON backend never imports SQLite or sharding code.
+"""
+import importlib
+import logging
+import os
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# storage_type -> Storage implementation
+STORAGE_BACKENDS = {
+    'local': 'gallery_generator.storage.local_storage:LocalStorage',
+    'databricks': 'gallery_generator.storage.databricks_storage:DatabricksStorage',
+}
+
+# METADATA_BACKEND -> DataManager implementation
+METADATA_BACKENDS = {
+    'json': 'gallery_generator.services.data_manager:DataManager',
+    'sqlite': 'gallery_generator.services.sqlite_data_manager:SqliteDataManager',
+    'sharded': 'gallery_generator.services.sharded_data_manager:ShardedDataManager',
+}
+
+
+def register_storage_backend(name: str, target: str):
+    """Makes `storage_type: name` use the Storage class at `target` ("module:Class")."""
+    STORAGE_BACKENDS[name] = target
+
+
+def register_metadata_backend(name: str, target: str):
+    """Makes `METADATA_BACKEND: name` use the DataManager class at `target` ("module:Class")."""
+    METADATA_BACKENDS[name] = target
+
+
+def load_class(target: str) -> type:
+    module_name, _, class_name = target.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def create_storage(config_manager: Any, default_root: str) -> tuple[Any, str, str]:
+    """
+    Builds the configured storage backend.
+
+    Args:
+        config_manager: The ConfigManager.
+        default_root (str): Gallery directory of the local backend if GALLERY_ROOT is not set.
+
+    Returns:
+        tuple: The storage, the base directory the DataManager uses inside it,
+        and the name of the backend.
+    """
+    storage_type = config_manager.get('storage_type') or 'local'
+    if storage_type not in STORAGE_BACKENDS:
+        # Unknown names have always meant local storage
+        logger.warning(f"Unknown storage_type {storage_type!r}; using local storage.")
+        storage_type = 'local'
+    storage_class = load_class(STORAGE_BACKENDS[storage_type])
+    if storage_type == 'local':
+        storage = storage_class(config_manager.get('GALLERY_ROOT', default_root))
+    else:
+        storage = storage_class()
+    # Empty for both built-in backends: LocalStorage resolves paths against its root,
+    # and the Databricks volume path already includes the base
+    return storage, '', storage_type
+
+
+def create_data_manager(config_manager: Any, storage: Any, base_dir: str, project_dir: str) -> Any:
+    """
+    Builds the configured metadata backend (METADATA_BACKEND, default 'json').
+
+    Args:
+        config_manager: The ConfigManager.
+        storage: The storage backend.
+        base_dir (str): Base directory of the gallery files in storage.
+        project_dir (str): Directory the default SQLite database path is relative to.
+    """
+    metadata_backend = config_manager.get('METADATA_BACKEND', 'json')
+    if metadata_backend not in METADATA_BACKENDS:
+        raise ValueError(f"Unknown METADATA_BACKEND: {metadata_backend}")
+    data_manager_class = load_class(METADATA_BACKENDS[metadata_backend])
+    if metadata_backend == 'sharded':
+        return data_manager_class(base_dir, config_manager, storage,
+                                  cache_size=config_manager.get('SHARD_CACHE_SIZE', 256))
+    if metadata_backend == 'sqlite':
+        return data_manager_class(
+            base_dir, config_manager, storage,
+            config_manager.get('METADATA_DB_PATH', os.path.join(project_dir, 'metadata_data', 'metadata.sqlite3')),
+            backup_interval=config_manager.get('METADATA_BACKUP_INTERVAL', 60)
+        )
+    return data_manager_class(base_dir, config_manager, storage)
@@ -1,20 +1,44 @@
 import json
+import os
+
+# Used when neither an explicit path nor GALLERY_CONFIG is given; resolved
+# against the project directory, so it does not depend on the working directory.
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config', 'config.json')
+
+
+def resolve_config_path(config_path: str | None = None) -> str:
+    """The configuration file to use: `config_path`, else $GALLERY_CONFIG, else config/config.json."""
+    return config_path or os.getenv('GALLERY_CONFIG') or DEFAULT_CONFIG_PATH
+
 
 class ConfigManager:
     _instance = None
 
     def __new__(cls, *args, **kwargs):
         if not cls._instance:
-            cls._instance = super(ConfigManager, cls).__new__(cls, *args, **kwargs)
+            cls._instance = super(ConfigManager, cls).__new__(cls)
         return cls._instance
 
-    def __init__(self, config_path='config/config.json'):
-        if not hasattr(self, 'config'):  # Avoid re-initialization
-            with open(config_path, 'r') as f:
-                self.config = json.load(f)
+    def __init__(self, config_path: str | None = None):
+        if not hasattr(self, 'config_path'):  # Avoid re-initialization
+            self.config_path = resolve_config_path(config_path)
+            self._config = None
+
+    @property
+    def config(self) -> dict:
+        # Read on first use rather than on import, so importing modules has no file I/O
+        if self._config is None:
+            with open(self.config_path, 'r') as f:
+                self._config = json.load(f)
+        return self._config
 
     def get(self, key, default=None):
         return self.config.get(key, default)
 
+    @classmethod
+    def _reset_instance(cls):
+        """Forgets the singleton so the next ConfigManager() re-reads the file (used by tests and benchmarks)."""
+        cls._instance = None
+
 # Initialize a singleton instance for global access
-config_manager = ConfigManager()
\ No newline at end of file
+config_manager = ConfigManager()
@@ -0,0 +1,137 @@
+"""
+Conditional GET and content encoding for the JSON API.
+
+Responses are identified by an ETag derived from the stored data version, so
+a matching If-None-Match is answered with 304 before anything is loaded. Bodies
+are kept per (key, encoding) in a bounded LRU, so repeated requests for the
+same version are served pre-compressed.
+"""
+import gzip
+import threading
+from collections import OrderedDict
+from flask import request, make_response
+
+try:
+    import brotli
+except ImportError: # Optional; without it only gzip is offered
+    brotli = None
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+
+class CompressedBodyCache:
+    """A thread-safe LRU of encoded response bodies, bounded by total size."""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def put(self, key, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = body
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+
+def _etag_variants(etag: str) -> list[str]:
+    # Each content encoding is a different representation, so it gets its own strong ETag
+    return [etag, f"{etag}-gzip", f"{etag}-br"]
+
+
+def matching_etag(etag: str) -> str | None:
+    """The encoding of `etag` that the request's If-None-Match covers, if any."""
+    if_none_match = request.if_none_match
+    if not if_none_match:
+        return None
+    return next((variant for variant in _etag_variants(etag) if if_none_match.contains(variant)), None)
+
+
+def not_modified(etag: str, cache_control: str):
+    """A 304 for the validator the client presented, `etag` being one of its encodings."""
+    response = make_response('', 304)
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def _negotiate_encoding(size: int) -> str:
+    if size < MIN_COMPRESS_SIZE:
+        return 'identity'
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return 'identity'
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+def cached_response(cache: CompressedBodyCache, key: tuple, body_factory, etag: str, cache_control: str,
+                    mimetype: str = 'application/json'):
+    """
+    Builds a response for the version identified by `etag`, encoded as the
+    client accepts.
+
+    Args:
+        cache (CompressedBodyCache): Where encoded bodies are kept.
+        key (tuple): Identifies the body; must change whenever `etag` does.
+        body_factory (callable): Returns the identity-encoded body, or None if there is none.
+        etag (str): Strong validator of the body (without quotes).
+        cache_control (str): Cache-Control header value.
+        mimetype (str): Content type of the body.
+
+    Returns:
+        Response | None: The response, or None if `body_factory` returned None.
+    """
+    matched = matching_etag(etag)
+    if matched is not None:
+        return not_modified(matched, cache_control)
+
+    body = cache.get((key, 'identity'))
+    if body is None:
+        body = body_factory()
+        if body is None:
+            return None
+        cache.put((key, 'identity'), body)
+
+    encoding = _negotiate_encoding(len(body))
+    if encoding != 'identity':
+        encoded = cache.get((key, encoding))
+        if encoded is None:
+            encoded = _compress(body, encoding)
+            cache.put((key, encoding), encoded)
+        body = encoded
+
+    response = make_response(body)
+    response.mimetype = mimetype
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+        response.set_etag(f"{etag}-{encoding}")
+    else:
+        response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = cache_control
+    return response
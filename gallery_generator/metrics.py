@@ -0,0 +1,99 @@
+"""
+A minimal in-process metrics registry rendered in the Prometheus text format.
+
+Metrics are kept per process; under gunicorn each worker reports its own
+values and Prometheus aggregates them across scrape targets.
+"""
+import bisect
+import threading
+
+# Latency buckets in seconds, from local-disk to slow remote calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for key, value in labels)
+    return '{' + ','.join(escaped) + '}'
+
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms keyed by metric name and label set."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {} # name -> {labels: value}
+        self._histograms = {} # name -> {labels: [bucket_counts, sum, count]}
+        self._buckets = {} # name -> bucket bounds
+
+    def describe(self, name: str, kind: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS):
+        """Declares a metric so it is rendered with HELP/TYPE lines."""
+        with self._lock:
+            self._help[name] = (kind, help_text)
+            if kind == 'histogram':
+                self._buckets[name] = buckets
+                self._histograms.setdefault(name, {})
+            else:
+                self._counters.setdefault(name, {})
+
+    def inc(self, name: str, labels: dict | None = None, value: float = 1):
+        """Increments a counter."""
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: dict | None = None):
+        """Records one observation in a histogram."""
+        key = tuple(sorted((labels or {}).items()))
+        buckets = self._buckets.get(name, DEFAULT_BUCKETS)
+        index = bisect.bisect_left(buckets, value)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            entry = series.get(key)
+            if entry is None:
+                entry = series[key] = [[0] * len(buckets), 0.0, 0]
+            if index < len(buckets):
+                entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render_prometheus(self) -> str:
+        """Returns all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                kind, help_text = self._help.get(name, ('counter', ''))
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                buckets = self._buckets.get(name, DEFAULT_BUCKETS)
+                _, help_text = self._help.get(name, ('histogram', ''))
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, (bucket_counts, total, count) in sorted(series.items()):
+                    cumulative = 0
+                    for bound, bucket_count in zip(buckets, bucket_counts):
+                        cumulative += bucket_count
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        """Clears all recorded values (declarations are kept)."""
+        with self._lock:
+            for series in self._counters.values():
+                series.clear()
+            for series in self._histograms.values():
+                series.clear()
+
+
+# Process-wide registry used by the instrumented components and the /metrics endpoint
+registry = MetricsRegistry()
@@ -0,0 +1,59 @@
+"""
+Rewrites stored gallery data in the encoding configured by GALLERY_DATA_FORMAT
+and GALLERY_DATA_COMPRESSION (or given on the command line).
+
+Usage:
+    python -m gallery_generator.migrate_data MyGallery OtherGallery --compression gzip
+"""
+import argparse
+from gallery_generator.config_manager import config_manager
+from gallery_generator.services.codec import FORMATS, COMPRESSIONS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('galleries', nargs='+', help='Names of the galleries to migrate.')
+    parser.add_argument('--format', choices=FORMATS, help='Overrides GALLERY_DATA_FORMAT.')
+    parser.add_argument('--compression', choices=COMPRESSIONS, help='Overrides GALLERY_DATA_COMPRESSION.')
+    parser.add_argument('--skip-backups', action='store_true', help='Only rewrite the live gallery_data.json.')
+    parser.add_argument('--collect-garbage', action='store_true',
+                        help='With the sharded backend, delete shards no manifest or backup refers to.')
+    parser.add_argument('--refresh-catalog', action='store_true',
+                        help='Record the galleries in the gallery list (for galleries saved before it existed).')
+    parser.add_argument('--export-json', action='store_true',
+                        help='With the SQLite backend, write the galleries to gallery_data.json '
+                             '(e.g. before switching back to the JSON backend).')
+    parser.add_argument('--backfill-placeholders', action='store_true',
+                        help='Add dimensions and grid placeholders to images uploaded before ingest computed them.')
+    args = parser.parse_args()
+
+    if args.format:
+        config_manager.config['GALLERY_DATA_FORMAT'] = args.format
+    if args.compression:
+        config_manager.config['GALLERY_DATA_COMPRESSION'] = args.compression
+
+    from gallery_generator.app import create_app
+    data_manager = create_app().data_manager
+    codec = data_manager.codec
+    print(f"Encoding: {codec.fmt}, compression: {codec.compression}")
+    for gallery_name in args.galleries:
+        summary = data_manager.migrate_encoding(gallery_name, include_backups=not args.skip_backups)
+        ratio = summary['bytes_before'] / summary['bytes_after'] if summary['bytes_after'] else 0
+        print(f"{gallery_name}: {summary['files']} files rewritten, "
+              f"{summary['bytes_before']:,} -> {summary['bytes_after']:,} bytes ({ratio:.1f}x smaller)")
+        if args.collect_garbage and hasattr(data_manager, 'collect_garbage'):
+            print(f"{gallery_name}: {data_manager.collect_garbage(gallery_name)} unreferenced shards deleted")
+        if args.export_json and hasattr(data_manager, 'export_json'):
+            if data_manager.export_json(gallery_name):
+                print(f"{gallery_name}: exported to gallery_data.json")
+            else:
+                print(f"{gallery_name}: export failed")
+        if args.refresh_catalog and data_manager.refresh_catalog(gallery_name):
+            print(f"{gallery_name}: catalog entry updated")
+        if args.backfill_placeholders:
+            from gallery_generator.services.image_analysis import analyze_image_bytes
+            print(f"{gallery_name}: {data_manager.backfill_image_metadata(gallery_name, analyze_image_bytes)} images updated")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+"""
+Admin-only, on-demand profiling of a live web worker.
+
+The blueprint and its request hook are only registered when PROFILING_ENABLED
+is set, so a default deployment has no profiling routes and pays nothing.
+Every endpoint requires the ADMIN_TOKEN (config key, or the GALLERY_ADMIN_TOKEN
+environment variable) in an `X-Admin-Token` header.
+
+    GET  /admin/profile/sample?seconds=10         collapsed stacks of all threads (for flamegraph.pl / speedscope)
+    GET  /admin/profile/memory?seconds=10&top=25   tracemalloc top allocators over the window
+    POST /admin/profile/requests                  {"rule": "/images/<gallery_name>/<path:image_path>", "count": 20}
+    GET  /admin/profile/requests/<capture_id>     pstats file once `count` matching requests ran
+"""
+import cProfile
+import collections
+import hmac
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from flask import Blueprint, current_app, request, jsonify, g, make_response
+
+MAX_SECONDS = 120
+MAX_CAPTURE_REQUESTS = 100
+
+profiling = Blueprint('profiling', __name__, url_prefix='/admin/profile')
+
+_captures = {} # capture_id -> _RequestCapture
+_captures_lock = threading.Lock()
+
+
+class _RequestCapture:
+    """cProfile data accumulated over the next `count` requests to one URL rule."""
+
+    def __init__(self, rule: str, count: int):
+        self.id = uuid.uuid4().hex
+        self.rule = rule
+        self.count = count
+        self.remaining = count
+        self.running = 0
+        self.stats = None
+        self.lock = threading.Lock()
+
+    @property
+    def done(self) -> bool:
+        return self.remaining <= 0 and self.running == 0
+
+    def claim(self) -> bool:
+        with self.lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            self.running += 1
+            return True
+
+    def add(self, profiler: cProfile.Profile):
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profiler)
+            else:
+                self.stats.add(profiler)
+            self.running -= 1
+
+    def dump(self) -> bytes:
+        # The pstats file format is the marshalled stats dict (see pstats.Stats.dump_stats)
+        with self.lock:
+            return marshal.dumps(self.stats.stats if self.stats else {})
+
+
+def _authorized() -> bool:
+    expected = current_app.config['CONFIG'].get('ADMIN_TOKEN') or os.getenv('GALLERY_ADMIN_TOKEN')
+    provided = request.headers.get('X-Admin-Token', '')
+    return bool(expected) and hmac.compare_digest(provided.encode(), str(expected).encode())
+
+
+@profiling.before_request
+def _require_admin():
+    if not _authorized():
+        return jsonify({'error': 'Forbidden'}), 403
+
+
+def _seconds() -> float:
+    return min(max(request.args.get('seconds', 10, type=float), 0.1), MAX_SECONDS)
+
+
+def _download(data: bytes, filename: str, mimetype: str):
+    response = make_response(data)
+    response.headers['Content-Type'] = mimetype
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ':')
+
+
+def sample_stacks(seconds: float, interval: float = 0.005) -> collections.Counter:
+    """
+    Samples the stacks of all other threads every `interval` seconds.
+
+    Returns:
+        Counter: Collapsed stack ('thread;outer;...;inner') to sample count.
+    """
+    own_thread = threading.get_ident()
+    names = {}
+    counts = collections.Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if len(names) != threading.active_count():
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)).replace(';', ':'))
+            counts[';'.join(reversed(stack))] += 1
+        time.sleep(interval)
+    return counts
+
+
+@profiling.route('/sample')
+def sample():
+    interval = min(max(request.args.get('interval', 0.005, type=float), 0.001), 1.0)
+    counts = sample_stacks(_seconds(), interval)
+    body = ''.join(f"{stack} {count}\n" for stack, count in counts.most_common())
+    return _download(body.encode('utf-8'), f"profile_{os.getpid()}_{int(time.time())}.collapsed", 'text/plain')
+
+
+@profiling.route('/memory')
+def memory():
+    top = request.args.get('top', 25, type=int)
+    group_by = 'traceback' if request.args.get('traceback') else 'lineno'
+    started_here = not tracemalloc.is_tracing()
+    if started_here:
+        tracemalloc.start(25)
+    try:
+        before = tracemalloc.take_snapshot()
+        time.sleep(_seconds())
+        after = tracemalloc.take_snapshot()
+    finally:
+        if started_here:
+            tracemalloc.stop()
+
+    # Hide the bookkeeping of tracemalloc itself
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    before, after = before.filter_traces(ignore), after.filter_traces(ignore)
+
+    out = io.StringIO()
+    out.write(f"Top {top} allocation sites by net growth over the window (pid {os.getpid()})\n\n")
+    for stat in after.compare_to(before, group_by)[:top]:
+        out.write(f"{stat}\n")
+        if group_by == 'traceback':
+            for line in stat.traceback.format():
+                out.write(f"    {line}\n")
+    return _download(out.getvalue().encode('utf-8'), f"memory_{os.getpid()}_{int(time.time())}.txt", 'text/plain')
+
+
+@profiling.route('/requests', methods=['POST'])
+def start_request_capture():
+    data = request.get_json() or {}
+    rule = data.get('rule')
+    try:
+        count = min(int(data.get('count', 10)), MAX_CAPTURE_REQUESTS)
+    except (TypeError, ValueError):
+        count = 0
+    if not rule or count < 1:
+        return jsonify({'error': 'Missing rule or invalid count'}), 400
+    if rule not in {r.rule for r in current_app.url_map.iter_rules()}:
+        return jsonify({'error': f'Unknown URL rule: {rule}'}), 400
+    capture = _RequestCapture(rule, count)
+    with _captures_lock:
+        _captures[capture.id] = capture
+    return jsonify({'capture_id': capture.id, 'rule': rule, 'count': count}), 202
+
+
+@profiling.route('/requests/<capture_id>')
+def get_request_capture(capture_id):
+    capture = _captures.get(capture_id)
+    if capture is None:
+        return jsonify({'error': 'Capture not found'}), 404
+    if not capture.done:
+        return jsonify({'capture_id': capture.id, 'remaining': capture.remaining}), 202
+    with _captures_lock:
+        _captures.pop(capture_id, None)
+    return _download(capture.dump(), f"profile_{capture.id}.pstats", 'application/octet-stream')
+
+
+def _start_request_profile():
+    if not _captures or request.url_rule is None:
+        return
+    for capture in list(_captures.values()):
+        if capture.rule == request.url_rule.rule and capture.claim():
+            profiler = cProfile.Profile()
+            g._profile = (capture, profiler)
+            profiler.enable()
+            return
+
+
+def _finish_request_profile(exc):
+    entry = g.pop('_profile', None)
+    if entry is not None:
+        capture, profiler = entry
+        profiler.disable()
+        capture.add(profiler)
+
+
+def init_app(app):
+    """Registers the profiling endpoints when PROFILING_ENABLED is set."""
+    if not app.config['CONFIG'].get('PROFILING_ENABLED', False):
+        return
+    app.register_blueprint(profiling)
+    app.before_request(_start_request_profile)
+    app.teardown_request(_finish_request_profile)
@@ -1,11 +1,24 @@
-from flask import Blueprint, render_template, request, jsonify, current_app, send_from_directory, session, redirect, url_for, send_file, make_response
-from gallery_generator.services.upload_service import UploadService
+from flask import Blueprint, render_template, request, jsonify, current_app, send_from_directory, session, redirect, url_for, send_file, make_response, Response, stream_with_context
+from gallery_generator.services.job_queue import RUNNING, DONE, FAILED
 from gallery_generator.services.delete_service import DeleteService
+from gallery_generator.services.archive_service import ArchiveService
+from gallery_generator.services.image_batch import ImageBatchService, MEDIA_TYPE as IMAGE_BATCH_MEDIA_TYPE
 from gallery_generator.services.report_service import ReportService
+from gallery_generator.services.duplicate_service import DuplicateService
+from gallery_generator.services.progress_reporter import ProgressReporter
+from gallery_generator.services.codec import dumps_json
+from gallery_generator.services.catalog import SORT_KEYS
+from gallery_generator.services.selection import Selection, STATUSES
+from gallery_generator.metrics import registry as metrics_registry
+from gallery_generator.tracing import span, bind, current_trace_id
+from gallery_generator import http_cache
 import logging
 import io
 import os
+import json
+import uuid
 from mimetypes import guess_type
+from urllib.parse import quote
 from datetime import datetime # Import datetime
 
 logger = logging.getLogger(__name__)
@@ -26,6 +39,53 @@ def create_gallery():
             return render_template('create_gallery.html', error='Gallery name cannot be empty.')
     return render_template('create_gallery.html')
 
+# Galleries per page of the gallery list (the API accepts up to MAX_GALLERY_PAGE)
+GALLERY_PAGE_SIZE = 50
+MAX_GALLERY_PAGE = 500
+
+def _catalog_query():
+    """Reads sort/order/offset/limit/q from the query string; returns (query kwargs, error)."""
+    sort = request.args.get('sort', 'name')
+    order = request.args.get('order', 'asc')
+    if sort not in SORT_KEYS or order not in ('asc', 'desc'):
+        return None, f"sort must be one of {', '.join(SORT_KEYS)} and order asc or desc"
+    return {
+        'sort': sort,
+        'descending': order == 'desc',
+        'offset': max(request.args.get('offset', 0, type=int), 0),
+        'limit': min(max(request.args.get('limit', GALLERY_PAGE_SIZE, type=int), 1), MAX_GALLERY_PAGE),
+        'search': request.args.get('q', '').strip()
+    }, None
+
+@main.route('/galleries')
+def list_galleries():
+    query, error = _catalog_query()
+    if error:
+        return jsonify({'error': error}), 400
+    page = current_app.data_manager.catalog.query(**query)
+    return render_template('galleries.html', page=page, sort=query['sort'],
+                           order='desc' if query['descending'] else 'asc', search=query['search'])
+
+@main.route('/api/galleries')
+def get_galleries():
+    query, error = _catalog_query()
+    if error:
+        return jsonify({'error': error}), 400
+    return jsonify(current_app.data_manager.catalog.query(**query))
+
+@main.app_template_filter('filesize')
+def _filesize(num_bytes):
+    size = float(num_bytes or 0)
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+@main.app_template_filter('timestamp')
+def _timestamp(seconds):
+    return datetime.fromtimestamp(seconds).strftime('%Y/%m/%d %H:%M') if seconds else ''
+
 @main.route('/gallery/<gallery_name>')
 def index(gallery_name):
     gallery_data = current_app.data_manager.load_gallery_data(gallery_name)
@@ -40,67 +100,103 @@ def upload_file(gallery_name):
         return jsonify({'error': 'No selected file'}), 400
     
     if file:
-        # Read the file content into memory or save to a temporary file
-        # so it can be passed to the background task
-        file_content = file.read()
-        original_filename = file.filename
-
-        # Start background task for processing
-        current_app.socketio.start_background_task(
-            _process_upload_in_background,
-            current_app._get_current_object(), # Pass the app context
-            file_content,
-            original_filename,
-            gallery_name
-        )
-        return jsonify({'message': 'Upload initiated successfully'}), 202
+        # Spool the upload to local disk so any job worker can pick it up,
+        # and so the job survives a restart of this web worker.
+        job_id = uuid.uuid4().hex
+        spool_path = os.path.join(current_app.config['JOB_SPOOL_DIR'], f"{job_id}.zip")
+        with span('request_read'):
+            file.save(spool_path)
+
+        with span('enqueue'):
+            current_app.job_queue.enqueue('upload', gallery_name, {
+                'zip_path': spool_path,
+                'original_filename': file.filename,
+                'trace_id': current_trace_id() # Links the job's trace to this request
+            }, job_id=job_id)
+        current_app.job_service.publish(job_id)
+
+        if current_app.config['JOB_EXECUTION'] == 'inline':
+            current_app.socketio.start_background_task(bind(current_app.job_service.drain))
+        return jsonify({'message': 'Upload initiated successfully', 'job_id': job_id}), 202
     return jsonify({'error': 'Something went wrong'}), 500
 
-def _process_upload_in_background(app, file_content, original_filename, gallery_name):
-    with app.app_context():
-        upload_service = UploadService(app.storage, socketio=app.socketio)
-        # Create a BytesIO object from the file_content to simulate a file stream
-        import io
-        file_stream = io.BytesIO(file_content)
-        file_stream.filename = original_filename # Add filename attribute for consistency
 
-        new_gallery_data = upload_service.process_zip_file(file_stream, gallery_name)
-        
-        if new_gallery_data:
-            existing_data = app.data_manager.load_gallery_data(gallery_name)
-            
-            def merge_data(existing, new):
-                existing_image_filenames = {img['filename'] for img in existing.get('images', [])}
-                for new_image in new.get('images', []) :
-                    if new_image['filename'] not in existing_image_filenames:
-                        existing.get('images', []).append(new_image)
-
-                existing_children_map = {child['name']: child for child in existing.get('children', [])}
-                for new_child in new.get('children') :
-                    if new_child['name'] in existing_children_map:
-                        merge_data(existing_children_map[new_child['name']], new_child)
-                    else:
-                        existing.get('children', []).append(new_child)
-            
-            if not existing_data or (not existing_data.get('images') and not existing_data.get('children')):
-                final_gallery_data = new_gallery_data
-            else:
-                merge_data(existing_data, new_gallery_data)
-                final_gallery_data = existing_data
-
-            
-            app.data_manager.save_gallery_data(final_gallery_data, gallery_name)
-            app.socketio.emit('gallery_updated', {'message': 'Upload complete and gallery updated!', 'gallery_data': final_gallery_data})
-        else:
-            # Handle failure in background task
-            app.socketio.emit('upload_failed', {'message': 'Failed to process zip file', 'gallery_name': gallery_name})
-            logger.error(f"Failed to process zip file for gallery {gallery_name}")
+@main.route('/gallery/<gallery_name>/ingest', methods=['POST'])
+def ingest_directory(gallery_name):
+    """
+    Queues an ingest of a directory below the configured INGEST_ROOT, given as
+    {"path": "relative/dir"}. Only files that are new or changed since the
+    last ingest of the same directory are processed.
+    """
+    ingest_root = current_app.config['CONFIG'].get('INGEST_ROOT')
+    if not ingest_root:
+        return jsonify({'error': 'Directory ingest is not enabled (set INGEST_ROOT)'}), 403
+    relative_path = (request.get_json(silent=True) or {}).get('path', '')
+    if not isinstance(relative_path, str):
+        return jsonify({'error': 'path must be a string'}), 400
+    root = os.path.realpath(ingest_root)
+    source_dir = os.path.realpath(os.path.join(root, relative_path.lstrip('/')))
+    if os.path.commonpath([root, source_dir]) != root:
+        return jsonify({'error': 'path must be inside INGEST_ROOT'}), 400
+    if not os.path.isdir(source_dir):
+        return jsonify({'error': 'No such directory'}), 404
+
+    with span('enqueue'):
+        job_id = current_app.job_queue.enqueue('ingest', gallery_name, {
+            'source_dir': source_dir,
+            'trace_id': current_trace_id()
+        })
+    current_app.job_service.publish(job_id)
+    if current_app.config['JOB_EXECUTION'] == 'inline':
+        current_app.socketio.start_background_task(bind(current_app.job_service.drain))
+    return jsonify({'message': 'Ingest initiated successfully', 'job_id': job_id}), 202
 
 
 @main.route('/gallery/<gallery_name>/upload_status', methods=['GET'])
 def get_upload_status(gallery_name):
-    progress = UploadService.get_upload_progress(gallery_name)
-    return jsonify({'progress': progress}), 200
+    job = current_app.job_queue.latest_for_gallery(gallery_name, kind='upload')
+    if job is None:
+        return jsonify({'progress': None}), 200
+
+    # Keep the legacy progress contract: None = pending, 0-100 = running/done, -1 = failed
+    if job['state'] == DONE:
+        progress = 100
+    elif job['state'] == FAILED:
+        progress = -1
+    elif job['state'] == RUNNING:
+        progress = job['progress']
+    else:
+        progress = None
+    return jsonify({'progress': progress, 'job_id': job['id'], 'state': job['state']}), 200
+
+@main.route('/gallery/<gallery_name>/api/jobs')
+def get_gallery_jobs(gallery_name):
+    """
+    The jobs of a gallery, newest first: those queued or running, and those
+    that finished within JOB_HISTORY_SECONDS. Clients fetch this once when
+    their Socket.IO connection is (re)established and follow `job_update`
+    events from there.
+    """
+    history_seconds = current_app.job_service.history_seconds
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    jobs = current_app.job_queue.list_jobs(gallery_name, limit=limit, finished_within=history_seconds)
+    return jsonify({'jobs': [current_app.job_service.public_job(job) for job in jobs]}), 200
+
+@main.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    job = current_app.job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(current_app.job_service.public_job(job)), 200
+
+@main.route('/metrics')
+def metrics():
+    if not current_app.config['STORAGE_METRICS_ENABLED']:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    response = make_response(metrics_registry.render_prometheus())
+    response.mimetype = 'text/plain'
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
 
 @main.route('/gallery/<gallery_name>/delete', methods=['POST'])
 def delete_items(gallery_name):
@@ -109,10 +205,10 @@ def delete_items(gallery_name):
     if not paths_to_delete:
         return jsonify({'error': 'No items specified for deletion'}), 400
 
-    delete_service = DeleteService(current_app.storage, current_app.data_manager)
+    delete_service = DeleteService(current_app.storage, current_app.data_manager, socketio=current_app.socketio)
     if delete_service.delete_items(paths_to_delete, gallery_name):
-        updated_gallery_data = current_app.data_manager.load_gallery_data(gallery_name)
-        current_app.socketio.emit('gallery_updated', updated_gallery_data)
+        with span('emit'):
+            current_app.socketio.emit('gallery_updated', {'message': 'Items deleted'}, to=gallery_name)
         return jsonify({'message': 'Items deleted successfully'}), 200
     else:
         return jsonify({'error': 'Failed to delete items'}), 500
@@ -127,8 +223,8 @@ def update_comment(gallery_name):
         return jsonify({'error': 'Path not specified for comment update'}), 400
 
     if current_app.data_manager.update_comment(path, comment, gallery_name):
-        updated_gallery_data = current_app.data_manager.load_gallery_data(gallery_name)
-        current_app.socketio.emit('gallery_updated', updated_gallery_data)
+        with span('emit'):
+            current_app.socketio.emit('gallery_updated', {'message': 'Comment updated'}, to=gallery_name)
         return jsonify({'message': 'Comment updated successfully'}), 200
     else:
         return jsonify({'error': 'Failed to update comment!'}), 500
@@ -146,12 +242,152 @@ def update_image_status(gallery_name):
         return jsonify({'error': 'Invalid status'}), 400
 
     if current_app.data_manager.update_image_status(image_paths, status, gallery_name):
-        updated_gallery_data = current_app.data_manager.load_gallery_data(gallery_name)
-        current_app.socketio.emit('gallery_updated', {'message': f'Image status updated to {status}', 'gallery_data': updated_gallery_data})
+        with span('emit'):
+            current_app.socketio.emit('gallery_updated', {'message': f'Image status updated to {status}'}, to=gallery_name)
         return jsonify({'message': 'Image status updated successfully'}), 200
     else:
         return jsonify({'error': 'Failed to update image status!'}), 500
 
+def _parse_selection(data):
+    """The Selection of a request body, or a 400 response if it is malformed."""
+    try:
+        return Selection.from_json(data.get('selection')), None
+    except ValueError as e:
+        return None, (jsonify({'error': str(e)}), 400)
+
+@main.route('/gallery/<gallery_name>/api/selection/status', methods=['POST'])
+def update_selection_status(gallery_name):
+    """
+    Sets the status of the images matched by a selection expression, e.g.
+    {"selection": {"folders": ["Trip/Day 1"], "recursive": false, "status": "neutral", "date": "2024-05-01"},
+     "status": "good"}
+    """
+    data = request.get_json(silent=True) or {}
+    status = data.get('status')
+    if status not in STATUSES:
+        return jsonify({'error': 'Invalid status'}), 400
+    selection, error = _parse_selection(data)
+    if error:
+        return error
+
+    result = current_app.data_manager.update_status_by_selection(selection, status, gallery_name)
+    if result is None:
+        return jsonify({'error': 'Failed to update image status!'}), 500
+    if result['filenames']:
+        with span('emit'):
+            current_app.socketio.emit('gallery_updated', {'message': f"{len(result['filenames'])} images marked {status}"},
+                                       to=gallery_name)
+    # The delta lets the client update its copy of the tree without re-fetching it
+    return jsonify({
+        'matched': result['matched'],
+        'changed': len(result['filenames']),
+        'status': status,
+        'filenames': result['filenames'],
+        'version': current_app.data_manager.get_gallery_version(gallery_name)
+    }), 200
+
+@main.route('/gallery/<gallery_name>/api/selection/delete', methods=['POST'])
+def delete_selection(gallery_name):
+    """Deletes the images matched by a selection expression (see update_selection_status)."""
+    data = request.get_json(silent=True) or {}
+    selection, error = _parse_selection(data)
+    if error:
+        return error
+
+    delete_service = DeleteService(current_app.storage, current_app.data_manager, socketio=current_app.socketio)
+    result = delete_service.delete_selection(selection, gallery_name)
+    if result is None:
+        return jsonify({'error': 'Failed to delete items'}), 500
+    if result['filenames']:
+        with span('emit'):
+            current_app.socketio.emit('gallery_updated', {'message': f"{len(result['filenames'])} images deleted"},
+                                       to=gallery_name)
+    return jsonify({
+        'deleted': len(result['filenames']),
+        'filenames': result['filenames'],
+        'version': current_app.data_manager.get_gallery_version(gallery_name)
+    }), 200
+
+@main.route('/gallery/<gallery_name>/api/selection/download', methods=['POST'])
+def download_selection(gallery_name):
+    """
+    Streams a zip archive of the images matched by a selection expression
+    (see update_selection_status), e.g. {"selection": {"folders": [""],
+    "status": "good"}} for every good image. The selection may also come as
+    a JSON-encoded "selection" form field, so a plain form submission lets the
+    browser save the stream straight to disk.
+    """
+    data = request.get_json(silent=True)
+    if data is None and 'selection' in request.form:
+        try:
+            data = {'selection': json.loads(request.form['selection'])}
+        except ValueError:
+            return jsonify({'error': 'selection must be JSON'}), 400
+    selection, error = _parse_selection(data or {})
+    if error:
+        return error
+
+    archive_service = ArchiveService(current_app.storage, current_app.data_manager,
+                                     prefetch=current_app.config['CONFIG'].get('DOWNLOAD_PREFETCH', 8))
+    chunks = archive_service.stream_selection(selection, gallery_name)
+    if chunks is None:
+        return jsonify({'error': 'Gallery not found'}), 404
+    # No Content-Length: the archive is built while it is sent
+    response = Response(stream_with_context(chunks), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(gallery_name)}.zip"
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+# Largest Hamming distance a client may ask for; beyond it nearly every image matches every other
+MAX_DUPLICATE_DISTANCE = 16
+
+def _duplicate_service():
+    return DuplicateService(current_app.config['CONFIG'].get('DUPLICATE_MAX_DISTANCE', 10))
+
+def _parse_max_distance(value):
+    """An optional max_distance from a query string or JSON body; raises ValueError if it is invalid."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value <= MAX_DUPLICATE_DISTANCE:
+        raise ValueError(value)
+    return value
+
+_MAX_DISTANCE_ERROR = f'max_distance must be an integer from 0 to {MAX_DUPLICATE_DISTANCE}'
+
+@main.route('/gallery/<gallery_name>/api/duplicates')
+def get_duplicates(gallery_name):
+    try:
+        max_distance = _parse_max_distance(request.args.get('max_distance'))
+    except ValueError:
+        return jsonify({'error': _MAX_DISTANCE_ERROR}), 400
+    gallery_data = current_app.data_manager.load_gallery_data(gallery_name)
+    clusters = _duplicate_service().find_clusters(gallery_data, max_distance)
+    return jsonify({'clusters': clusters}), 200
+
+@main.route('/gallery/<gallery_name>/api/duplicates/status', methods=['POST'])
+def update_duplicate_cluster_status(gallery_name):
+    data = request.get_json()
+    filename = data.get('filename')
+    status = data.get('status')
+
+    if not filename or status not in ['good', 'bad', 'neutral']:
+        return jsonify({'error': 'Missing filename or invalid status'}), 400
+    try:
+        max_distance = _parse_max_distance(data.get('max_distance'))
+    except ValueError:
+        return jsonify({'error': _MAX_DISTANCE_ERROR}), 400
+
+    gallery_data = current_app.data_manager.load_gallery_data(gallery_name)
+    filenames = _duplicate_service().find_cluster_of(gallery_data, filename, max_distance)
+    if current_app.data_manager.update_image_status(filenames, status, gallery_name):
+        with span('emit'):
+            current_app.socketio.emit('gallery_updated', {'message': f'{len(filenames)} similar images marked {status}'},
+                                       to=gallery_name)
+        return jsonify({'message': 'Cluster status updated successfully', 'filenames': filenames}), 200
+    return jsonify({'error': 'Failed to update cluster status!'}), 500
+
 @main.route('/images/<gallery_name>/<path:image_path>')
 def serve_image(gallery_name, image_path):
     storage = current_app.storage
@@ -169,15 +405,93 @@ def serve_image(gallery_name, image_path):
         logger.warning(f"Image not found: {full_image_path}")
         return jsonify({'error': 'Image not found'}), 404
 
+@main.route('/gallery/<gallery_name>/api/images/batch', methods=['POST'])
+def serve_image_batch(gallery_name):
+    """
+    Streams up to IMAGE_BATCH_MAX_FILES images named in {"filenames": [...]}
+    in one response (see services/image_batch.py for the framing), so the
+    grid fills a screen with a few requests instead of one per image.
+    """
+    filenames = (request.get_json(silent=True) or {}).get('filenames')
+    max_files = current_app.config['CONFIG'].get('IMAGE_BATCH_MAX_FILES', 64)
+    if not isinstance(filenames, list) or not filenames or not all(isinstance(name, str) for name in filenames):
+        return jsonify({'error': 'filenames must be a non-empty list of strings'}), 400
+    if len(filenames) > max_files:
+        return jsonify({'error': f'At most {max_files} images per batch'}), 400
+    # Stored images sit directly in the gallery directory
+    if any(not name or '/' in name or '\\' in name or name.startswith('.') for name in filenames):
+        return jsonify({'error': 'Invalid filename'}), 400
+
+    batch_service = ImageBatchService(current_app.storage, current_app.config['CONFIG'].get('IMAGE_BATCH_WORKERS', 8))
+    return Response(stream_with_context(batch_service.stream(gallery_name, filenames)), mimetype=IMAGE_BATCH_MEDIA_TYPE)
+
+def _json_body(data) -> bytes | None:
+    # Gallery trees can be large; encode them compactly (with orjson when available) instead of via jsonify
+    if not data:
+        return None
+    with span('json_encode'):
+        return dumps_json(data)
+
+# The current tree and the version list change on every save, so clients must revalidate;
+# backups never change once written.
+REVALIDATE = 'no-cache'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
 @main.route('/gallery/<gallery_name>/api/gallery_data')
 def get_gallery_data(gallery_name):
-    gallery_data = current_app.data_manager.load_gallery_data(gallery_name)
-    if gallery_data:
-        return jsonify(gallery_data)
+    data_manager = current_app.data_manager
+    version = data_manager.get_gallery_version(gallery_name)
+    if version is not None:
+        response = http_cache.cached_response(
+            current_app.response_cache, ('gallery_data', gallery_name, version),
+            lambda: _json_body(data_manager.load_gallery_data(gallery_name)), version, REVALIDATE)
+        if response is not None:
+            return response
     return jsonify({'error': 'Gallery data not found'}), 404
 
+@main.route('/gallery/<gallery_name>/api/outline')
+def get_gallery_outline(gallery_name):
+    # Folder names and per-folder aggregates (image, status and byte counts, date range), without images
+    data_manager = current_app.data_manager
+    version = data_manager.get_gallery_version(gallery_name)
+    if version is not None:
+        response = http_cache.cached_response(
+            current_app.response_cache, ('outline', gallery_name, version),
+            lambda: _json_body(data_manager.load_outline(gallery_name)), f"outline-{version}", REVALIDATE)
+        if response is not None:
+            return response
+    return jsonify({'error': 'Gallery data not found'}), 404
+
+# Search results per request (the API accepts up to MAX_SEARCH_RESULTS)
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_RESULTS = 200
+
+@main.route('/gallery/<gallery_name>/api/search')
+def search_gallery(gallery_name):
+    """Ranked token/prefix search over folder paths, comments and original file names: ?q=day 1&limit=20&kind=folder"""
+    kind = request.args.get('kind') or None
+    if kind not in (None, 'folder', 'image'):
+        return jsonify({'error': 'kind must be folder or image'}), 400
+    limit = min(max(request.args.get('limit', SEARCH_PAGE_SIZE, type=int), 1), MAX_SEARCH_RESULTS)
+    query = request.args.get('q', '').strip()
+    result = current_app.data_manager.search(gallery_name, query, limit, kind)
+    if result is None:
+        return jsonify({'error': 'Gallery data not found'}), 404
+    return jsonify({'query': query, **result})
+
+@main.route('/gallery/<gallery_name>/api/dates')
+def get_gallery_dates(gallery_name):
+    return jsonify(current_app.data_manager.load_date_index(gallery_name))
+
 @main.route('/gallery/<gallery_name>/api/versions')
 def list_versions(gallery_name):
+    # Backups are only added when the gallery data is saved, which changes its version
+    version = current_app.data_manager.get_gallery_version(gallery_name)
+    if version is not None:
+        return http_cache.cached_response(
+            current_app.response_cache, ('versions', gallery_name, version),
+            lambda: dumps_json(current_app.data_manager.get_backup_versions(gallery_name)),
+            f"versions-{version}", REVALIDATE)
     versions = current_app.data_manager.get_backup_versions(gallery_name)
     # Timestamps need to be serializable
     # The 'timestamp' field is already a float (Unix timestamp), which is serializable.
@@ -190,9 +504,12 @@ def list_versions(gallery_name):
 
 @main.route('/gallery/<gallery_name>/api/version/<filename>')
 def get_version(gallery_name, filename):
-    version_data = current_app.data_manager.read_backup(filename, gallery_name)
-    if version_data:
-        return jsonify(version_data)
+    response = http_cache.cached_response(
+        current_app.response_cache, ('backup', gallery_name, filename),
+        lambda: _json_body(current_app.data_manager.read_backup(filename, gallery_name)),
+        f"backup-{filename}", IMMUTABLE)
+    if response is not None:
+        return response
     return jsonify({'error': 'Version not found'}), 404
 
 @main.route('/gallery/<gallery_name>/revert_version', methods=['POST'])
@@ -203,8 +520,8 @@ def revert_version(gallery_name):
         return jsonify({'error': 'Filename not specified'}), 400
 
     if current_app.data_manager.revert_to_version(filename, gallery_name):
-        updated_gallery_data = current_app.data_manager.load_gallery_data(gallery_name)
-        current_app.socketio.emit('gallery_updated', updated_gallery_data)
+        with span('emit'):
+            current_app.socketio.emit('gallery_updated', {'message': 'Reverted to an earlier version'}, to=gallery_name)
         return jsonify({'message': 'Successfully reverted'}), 200
     else:
         return jsonify({'error': 'Failed to revert version!'}), 500
@@ -221,6 +538,7 @@ def export_report(gallery_name):
         return jsonify({'error': 'Missing format or gallery data'}), 400
 
     report_service = ReportService(current_app.storage)
+    progress = ProgressReporter('report', gallery_name, socketio=current_app.socketio)
     
     try:
         config_manager = current_app.config['CONFIG']
@@ -249,11 +567,11 @@ def export_report(gallery_name):
         base_filename = f"{gallery_name}_{version_suffix}"
 
         if report_format == 'html':
-            report_content = report_service.generate_html_report(gallery_data, gallery_name, base_url, report_mode)
+            report_content = report_service.generate_html_report(gallery_data, gallery_name, base_url, report_mode, progress=progress)
             mimetype = 'text/html'
             download_name = f"{base_filename}.html"
         elif report_format == 'markdown':
-            report_content = report_service.generate_markdown_report(gallery_data, gallery_name, base_url, report_mode)
+            report_content = report_service.generate_markdown_report(gallery_data, gallery_name, base_url, report_mode, progress=progress)
             mimetype = 'text/markdown'
             download_name = f"{base_filename}.md"
         else:
@@ -0,0 +1,130 @@
+import io
+import os
+import zipfile
+import logging
+import collections
+import concurrent.futures
+from typing import Dict, Any, Iterator
+from ..storage.storage import Storage
+from .selection import Selection
+from .search_index import original_name
+from ..tracing import span, bind
+
+logger = logging.getLogger(__name__)
+
+# Already-compressed formats, stored as they are; deflating them costs CPU and saves nothing
+STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic')
+MISSING_LIST = 'MISSING_FILES.txt'
+
+
+class _ZipSink(io.RawIOBase):
+    """A write-only, unseekable stream; zipfile then writes data descriptors instead of seeking back."""
+
+    def __init__(self):
+        self.chunks = collections.deque()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> Iterator[bytes]:
+        while self.chunks:
+            yield self.chunks.popleft()
+
+
+class ArchiveService:
+    """
+    Streams the images of a selection as a zip archive built on the fly, with
+    their folders restored from the gallery tree and their original file
+    names. Images are fetched from storage by a small thread pool that runs
+    at most `prefetch` images ahead of the writer, so memory stays bounded by
+    a few images whatever the size of the archive; Zip64 records are written
+    as needed for archives beyond 4 GiB.
+    """
+
+    def __init__(self, storage: Storage, data_manager, prefetch: int = 8):
+        self.storage = storage
+        self.data_manager = data_manager
+        self.prefetch = max(1, prefetch)
+
+    @staticmethod
+    def archive_names(found: list[tuple[str, Dict[str, Any]]]) -> list[str]:
+        """Archive member names of (folder path, image) pairs, keeping stored names where original names clash."""
+        names, taken = [], set()
+        for path, image in found:
+            name = f"{path}/{original_name(image['filename'])}" if path else original_name(image['filename'])
+            if name in taken:
+                name = f"{path}/{image['filename']}" if path else image['filename']
+            taken.add(name)
+            names.append(name)
+        return names
+
+    def stream_selection(self, selection: Selection, gallery_name: str) -> Iterator[bytes] | None:
+        """
+        Resolves `selection` and returns an iterator over the bytes of the zip
+        archive of its images, or None if the gallery does not exist. Images
+        missing from storage are left out and listed in MISSING_FILES.txt.
+        """
+        found = self.data_manager.find_by_selection(selection, gallery_name)
+        if found is None:
+            return None
+        return self._stream(gallery_name, found)
+
+    def _stream(self, gallery_name: str, found: list[tuple[str, Dict[str, Any]]]) -> Iterator[bytes]:
+        load = bind(self.storage.load) # Storage reads in the pool belong to the request's trace
+        sink = _ZipSink()
+        missing = []
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.prefetch)
+        try:
+            entries = iter(zip(self.archive_names(found), found))
+            pending = collections.deque()
+
+            def fetch_next():
+                entry = next(entries, None)
+                if entry is not None:
+                    _, (_, image) = entry
+                    pending.append((entry, executor.submit(load, f"{gallery_name}/{image['filename']}")))
+
+            for _ in range(self.prefetch):
+                fetch_next()
+            with zipfile.ZipFile(sink, 'w', allowZip64=True) as archive:
+                while pending:
+                    (name, (_, image)), future = pending.popleft()
+                    fetch_next()
+                    try:
+                        with span('archive_fetch'):
+                            data = future.result()
+                    except Exception as e:
+                        logger.warning(f"Leaving {image['filename']} of {gallery_name} out of the archive: {e}")
+                        missing.append(name)
+                        continue
+                    archive.writestr(self._member(name, image), data)
+                    del data
+                    yield from sink.drain()
+                if missing:
+                    archive.writestr(MISSING_LIST, '\n'.join(missing) + '\n')
+            yield from sink.drain() # The central directory
+        finally:
+            # Also runs when the client disconnects and the response stops iterating
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _member(name: str, image: Dict[str, Any]) -> zipfile.ZipInfo:
+        member = zipfile.ZipInfo(name, date_time=ArchiveService._date_time(image.get('modification_date')))
+        stored = os.path.splitext(name)[1].lower() in STORED_EXTENSIONS
+        member.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+        member.external_attr = 0o644 << 16
+        return member
+
+    @staticmethod
+    def _date_time(date: str | None) -> tuple:
+        try:
+            year, month, day = (int(part) for part in date[:10].split('-'))
+            if year >= 1980:
+                return (year, month, day, 0, 0, 0)
+        except (TypeError, ValueError):
+            pass
+        return (1980, 1, 1, 0, 0, 0) # The earliest date a zip entry can hold
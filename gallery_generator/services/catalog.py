@@ -0,0 +1,104 @@
+import os
+import time
+import threading
+import logging
+from typing import Dict, Any
+from gallery_generator.storage.storage import Storage
+from gallery_generator.services.codec import dumps_json, loads_json
+
+logger = logging.getLogger(__name__)
+
+CATALOG_FORMAT = 1
+
+SORT_KEYS = ('name', 'images', 'bytes', 'last_modified')
+
+
+class GalleryCatalog:
+    """
+    A summary of every gallery, kept in one small document (catalog.json at the
+    storage root) that the DataManager updates whenever a gallery is saved:
+
+        {"catalog_format": 1,
+         "galleries": {"MyGallery": {"name": ..., "images": 1200, "statuses": {"neutral": 1100, ...},
+                                     "bytes": 734003200, "last_modified": 1760000000.0,
+                                     "version": "3f2a..."}}}
+
+    Listing galleries therefore costs one read, however many galleries there
+    are and however large they are. Updates re-read the document right before
+    writing it and are serialized within the process; a concurrent save in
+    another process can still lose an update, which the next save of that
+    gallery repairs.
+    """
+
+    def __init__(self, storage: Storage, base_dir: str = ''):
+        self.storage = storage
+        self.path = os.path.join(base_dir, 'catalog.json')
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """Returns gallery name -> summary; empty if no gallery was saved yet."""
+        try:
+            if self.storage.exists(self.path):
+                return loads_json(self.storage.load(self.path)).get('galleries', {})
+        except Exception as e:
+            logger.error(f"Error loading gallery catalog from {self.path}: {e}")
+        return {}
+
+    def _save(self, galleries: Dict[str, Dict[str, Any]]):
+        self.storage.save(self.path, dumps_json({'catalog_format': CATALOG_FORMAT, 'galleries': galleries}))
+
+    def record(self, gallery_name: str, stats: Dict[str, Any], version: str | None):
+        """
+        Stores the summary of a gallery that was just saved.
+
+        Args:
+            gallery_name (str): The gallery.
+            stats (dict): Its image count, status counts and byte size (see DataManager.gallery_stats).
+            version (str): Its current data version.
+        """
+        try:
+            with self._lock:
+                galleries = self.load()
+                galleries[gallery_name] = {
+                    'name': gallery_name,
+                    **stats,
+                    'last_modified': time.time(),
+                    'version': version
+                }
+                self._save(galleries)
+        except Exception as e:
+            logger.error(f"Error updating gallery catalog for {gallery_name}: {e}")
+
+    def query(self, sort: str = 'name', descending: bool = False, offset: int = 0, limit: int = 50,
+              search: str = '') -> Dict[str, Any]:
+        """
+        Returns one page of the catalog.
+
+        Args:
+            sort (str): One of SORT_KEYS.
+            descending (bool): Sort order.
+            offset (int): Number of galleries to skip.
+            limit (int): Maximum number of galleries to return.
+            search (str): Only galleries whose name contains this (case-insensitive).
+
+        Returns:
+            dict: 'total' (after filtering), 'offset', 'limit' and the 'galleries' of the page.
+        """
+        if sort not in SORT_KEYS:
+            raise ValueError(f"Unknown sort key: {sort}")
+        galleries = list(self.load().values())
+        if search:
+            needle = search.casefold()
+            galleries = [entry for entry in galleries if needle in entry['name'].casefold()]
+        if sort == 'name':
+            galleries.sort(key=lambda entry: entry['name'].casefold(), reverse=descending)
+        else:
+            # Ties (and galleries without the field) are ordered by name
+            galleries.sort(key=lambda entry: entry['name'].casefold())
+            galleries.sort(key=lambda entry: entry.get(sort) or 0, reverse=descending)
+        return {
+            'total': len(galleries),
+            'offset': offset,
+            'limit': limit,
+            'galleries': galleries[offset:offset + limit]
+        }
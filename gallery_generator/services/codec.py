@@ -0,0 +1,129 @@
+"""
+Encoding of stored gallery documents (gallery_data.json and its backups).
+
+Documents are written as compact JSON by default (with orjson when it is
+installed), or as MessagePack, optionally compressed with gzip or zstd.
+Decoding sniffs the compression and format from the leading bytes, so files
+written with any setting, including the original pretty-printed JSON, can
+always be read back. File names are unchanged regardless of the encoding.
+"""
+import gzip
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError: # Optional, speeds up JSON encoding and decoding several times
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FORMATS = ('json', 'msgpack')
+COMPRESSIONS = ('none', 'gzip', 'zstd')
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def dumps_json(data: Any) -> bytes:
+    """Compact UTF-8 JSON, also used for API responses."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def loads_json(raw: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw.decode('utf-8'))
+
+
+def encode(data: Any, fmt: str = 'json', compression: str = 'none', level: int | None = None) -> bytes:
+    """
+    Encodes a document for storage.
+
+    Args:
+        data: The document.
+        fmt (str): 'json' or 'msgpack'.
+        compression (str): 'none', 'gzip' or 'zstd'.
+        level (int): Compression level; the codec's default if None.
+
+    Returns:
+        bytes: The encoded document.
+    """
+    if fmt == 'msgpack':
+        if msgpack is None:
+            raise RuntimeError("GALLERY_DATA_FORMAT 'msgpack' requires the msgpack package")
+        raw = msgpack.packb(data, use_bin_type=True)
+    elif fmt == 'json':
+        raw = dumps_json(data)
+    else:
+        raise ValueError(f"Unknown gallery data format: {fmt}")
+
+    if compression == 'gzip':
+        # mtime=0 keeps the output deterministic for identical documents
+        return gzip.compress(raw, compresslevel=6 if level is None else level, mtime=0)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("GALLERY_DATA_COMPRESSION 'zstd' requires the zstandard package")
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress(raw)
+    if compression not in (None, 'none'):
+        raise ValueError(f"Unknown gallery data compression: {compression}")
+    return raw
+
+
+def decompress(raw: bytes) -> bytes:
+    """Strips gzip/zstd compression, if any."""
+    if raw[:2] == GZIP_MAGIC:
+        return gzip.decompress(raw)
+    if raw[:4] == ZSTD_MAGIC:
+        if zstandard is None:
+            raise RuntimeError("Reading zstd-compressed gallery data requires the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(raw, max_output_size=1 << 31)
+    return raw
+
+
+def decode(raw: bytes) -> Any:
+    """Decodes a document written by encode() or a plain (pretty) JSON file."""
+    raw = decompress(raw)
+    head = raw[:64].lstrip()
+    if not head or head[:1] in b'{["' or head[:3] == b'\xef\xbb\xbf':
+        return loads_json(raw.lstrip(b'\xef\xbb\xbf'))
+    if msgpack is None:
+        raise RuntimeError("Reading MessagePack gallery data requires the msgpack package")
+    return msgpack.unpackb(raw, raw=False, strict_map_key=False)
+
+
+class DocumentCodec:
+    """The encoding configured for a deployment (GALLERY_DATA_FORMAT / GALLERY_DATA_COMPRESSION)."""
+
+    def __init__(self, fmt: str = 'json', compression: str = 'none', level: int | None = None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown gallery data format: {fmt}")
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown gallery data compression: {compression}")
+        self.fmt = fmt
+        self.compression = compression
+        self.level = level
+
+    @classmethod
+    def from_config(cls, config_manager) -> 'DocumentCodec':
+        if config_manager is None:
+            return cls()
+        return cls(config_manager.get('GALLERY_DATA_FORMAT', 'json'),
+                   config_manager.get('GALLERY_DATA_COMPRESSION', 'none'),
+                   config_manager.get('GALLERY_DATA_COMPRESSION_LEVEL'))
+
+    def encode(self, data: Any) -> bytes:
+        return encode(data, self.fmt, self.compression, self.level)
+
+    def decode(self, raw: bytes) -> Any:
+        return decode(raw)
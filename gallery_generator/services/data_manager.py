@@ -1,8 +1,15 @@
 import json
 import os
+import hashlib
 from datetime import datetime, timezone # Import timezone
 import pytz # Import pytz for timezone handling
 from gallery_generator.storage.storage import Storage # Import Storage interface
+from gallery_generator.tracing import span
+from gallery_generator.services.codec import DocumentCodec
+from gallery_generator.services.catalog import GalleryCatalog
+from gallery_generator.services.selection import Selection
+from gallery_generator.services import node_stats
+from gallery_generator.services.search_index import SearchIndexStore
 from typing import Dict, Any
 
 class DataManager:
@@ -10,7 +17,13 @@ class DataManager:
         self.base_dir = base_dir
         self.config_manager = config_manager
         self.storage = storage
-        
+        # How gallery_data.json and its backups are encoded; any encoding is readable
+        self.codec = DocumentCodec.from_config(config_manager)
+        # Per-gallery summaries for the gallery list, updated on every save
+        self.catalog = GalleryCatalog(storage, base_dir)
+        # Per-gallery search indexes, updated by the writers below
+        self.search_indexes = SearchIndexStore(storage, base_dir, self.codec)
+
         if self.base_dir: # If base_dir is provided (e.g., 'gallery_data' for Databricks)
             self.backup_base_dir = os.path.join(self.base_dir, 'backups')
         else: # If base_dir is empty (e.g., for LocalStorage, where LocalStorage handles the absolute path)
@@ -22,6 +35,12 @@ class DataManager:
         # os.makedirs(gallery_dir, exist_ok=True) # Handled by storage implementation
         return os.path.join(gallery_dir, 'gallery_data.json')
 
+    def _get_date_index_path(self, gallery_name: str) -> str:
+        return os.path.join(self.base_dir, gallery_name, 'date_index.json')
+
+    def _get_version_path(self, gallery_name: str) -> str:
+        return os.path.join(self.base_dir, gallery_name, 'gallery_data.version')
+
     def _get_backup_dir_for_gallery(self, gallery_name: str) -> str:
         backup_dir = os.path.join(self.backup_base_dir, gallery_name)
         # os.makedirs(backup_dir, exist_ok=True) # Handled by storage implementation
@@ -30,10 +49,13 @@ class DataManager:
     def load_gallery_data(self, gallery_name: str) -> Dict[str, Any]:
         gallery_data_path = self._get_gallery_data_path(gallery_name)
         try:
-            if self.storage.exists(gallery_data_path):
-                data_bytes = self.storage.load(gallery_data_path)
-                return json.loads(data_bytes.decode('utf-8'))
-            return {}
+            with span('json_load'):
+                if self.storage.exists(gallery_data_path):
+                    data_bytes = self.storage.load(gallery_data_path)
+                    data = self.codec.decode(data_bytes)
+                    node_stats.ensure(data)
+                    return data
+                return {}
         except FileNotFoundError:
             return {} # Return empty if file not found
         except Exception as e:
@@ -46,30 +68,210 @@ class DataManager:
         backup_dir = self._get_backup_dir_for_gallery(gallery_name)
 
         try:
+            # Callers keep the aggregates current; trees without them (e.g. fresh uploads) get them here
+            node_stats.ensure(data)
+            with span('encode'):
+                encoded = self.codec.encode(data)
+
             # Backup current gallery_data.json before saving new data
-            if self.storage.exists(gallery_data_path):
-                try:
-                    old_data_bytes = self.storage.load(gallery_data_path)
-                    old_data = json.loads(old_data_bytes.decode('utf-8'))
-                    
-                    # Always use JST for backup timestamp in filename
-                    jst = pytz.timezone('Asia/Tokyo')
-                    timestamp = datetime.now(jst).strftime('%Y%m%d%H%M%S')
-                    backup_filename = f"gallery_data_{timestamp}.json"
-                    backup_filepath = os.path.join(backup_dir, backup_filename)
-                    
-                    self.storage.save(backup_filepath, json.dumps(old_data, ensure_ascii=False, indent=4).encode('utf-8'))
-                except FileNotFoundError:
-                    pass # No existing file to backup
-                except Exception as e:
-                    print(f"Error backing up gallery data from {gallery_data_path}: {e}")
+            with span('backup'):
+                if self.storage.exists(gallery_data_path):
+                    try:
+                        # The backup is a byte copy of the current file, so it keeps the encoding it was written with
+                        old_data_bytes = self.storage.load(gallery_data_path)
+                        if old_data_bytes == encoded:
+                            # Nothing changed: no backup, no write, and the version (ETag) stays valid
+                            return True
 
-            self.storage.save(gallery_data_path, json.dumps(data, ensure_ascii=False, indent=4).encode('utf-8'))
+                        # Always use JST for backup timestamp in filename
+                        jst = pytz.timezone('Asia/Tokyo')
+                        timestamp = datetime.now(jst).strftime('%Y%m%d%H%M%S')
+                        backup_filename = f"gallery_data_{timestamp}.json"
+                        backup_filepath = os.path.join(backup_dir, backup_filename)
+
+                        self.storage.save(backup_filepath, old_data_bytes)
+                    except FileNotFoundError:
+                        pass # No existing file to backup
+                    except Exception as e:
+                        print(f"Error backing up gallery data from {gallery_data_path}: {e}")
+
+            with span('json_save'):
+                self.storage.save(gallery_data_path, encoded)
+            version = self._save_version(encoded, gallery_name)
+            with span('date_index'):
+                self._save_date_index(data, gallery_name)
+            with span('catalog'):
+                self.catalog.record(gallery_name, self.gallery_stats(data), version)
             return True
         except Exception as e:
             print(f"Error saving gallery data to {gallery_data_path}: {e}")
             return False
 
+    @staticmethod
+    def build_date_index(data: Dict[str, Any]) -> Dict[str, int]:
+        """
+        Counts the images of a gallery tree per date (the EXIF capture date, or
+        the zip timestamp for images without one).
+
+        Returns:
+            dict: Sorted mapping of 'YYYY-MM-DD' to image count.
+        """
+        counts = {}
+        stack = [data] if data else []
+        while stack:
+            node = stack.pop()
+            for image in node.get('images', []):
+                date = image.get('modification_date')
+                if date:
+                    counts[date] = counts.get(date, 0) + 1
+            stack.extend(node.get('children', []))
+        return dict(sorted(counts.items()))
+
+    @staticmethod
+    def gallery_stats(data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Summarizes a gallery tree for the catalog.
+
+        Returns:
+            dict: 'images' (count), 'statuses' (status -> count) and 'bytes'
+            (total size of the image files).
+        """
+        stats = (data or {}).get(node_stats.KEY)
+        if stats is not None:
+            return {
+                'images': stats['images'],
+                'statuses': {status: stats[status] for status in node_stats.STATUSES if stats[status]},
+                'bytes': stats['bytes']
+            }
+        images, size, statuses = 0, 0, {}
+        stack = [data] if data else []
+        while stack:
+            node = stack.pop()
+            for image in node.get('images', []):
+                images += 1
+                size += image.get('size') or 0
+                status = image.get('status', 'neutral')
+                statuses[status] = statuses.get(status, 0) + 1
+            stack.extend(node.get('children', []))
+        return {'images': images, 'statuses': statuses, 'bytes': size}
+
+    def refresh_catalog(self, gallery_name: str) -> bool:
+        """Records a gallery in the catalog from its stored data, e.g. for galleries saved before the catalog existed."""
+        data = self.load_gallery_data(gallery_name)
+        if not data:
+            return False
+        self.catalog.record(gallery_name, self.gallery_stats(data), self.get_gallery_version(gallery_name))
+        return True
+
+    def backfill_image_metadata(self, gallery_name: str, analyze, keys=('width', 'height', 'placeholder')) -> int:
+        """
+        Adds metadata that ingest computes today to images stored before it
+        did, reading each such image from storage once. `analyze(data)` returns
+        the metadata of an image's bytes (image_analysis.analyze_image_bytes);
+        only the missing `keys` are added.
+
+        Returns:
+            int: The number of images updated.
+        """
+        data = self.load_gallery_data(gallery_name)
+        if not data:
+            return 0
+        updated = 0
+        stack = [data]
+        while stack:
+            node = stack.pop()
+            for image in node.get('images', []):
+                missing = [key for key in keys if key not in image]
+                if not missing:
+                    continue
+                try:
+                    metadata = analyze(self.storage.load(os.path.join(gallery_name, image['filename'])))
+                except Exception as e:
+                    print(f"Skipping {image['filename']} of {gallery_name}: {e}")
+                    continue
+                added = {key: metadata[key] for key in missing if key in metadata}
+                if added:
+                    image.update(added)
+                    updated += 1
+            stack.extend(node.get('children', []))
+        if updated:
+            before = self.get_gallery_version(gallery_name)
+            if not self.save_gallery_data(data, gallery_name):
+                return 0
+            self._index_change(gallery_name, before) # Names and folders are unchanged
+        return updated
+
+    def load_outline(self, gallery_name: str) -> Dict[str, Any] | None:
+        """
+        The folder tree of a gallery with each folder's aggregates (see
+        node_stats) but without images, or None if the gallery has no data.
+        """
+        data = self.load_gallery_data(gallery_name)
+        return node_stats.outline(data) if data else None
+
+    def search(self, gallery_name: str, query: str, limit: int = 20, kind: str | None = None) -> Dict[str, Any] | None:
+        """
+        Searches folder paths, folder comments and original image file names
+        (see SearchIndex.search), or returns None if the gallery has no data.
+        """
+        version = self.get_gallery_version(gallery_name)
+        if version is None:
+            return None
+        with span('search'):
+            return self.search_indexes.search(gallery_name, version, lambda: self.load_gallery_data(gallery_name),
+                                              query, limit, kind)
+
+    def _index_change(self, gallery_name: str, before: str | None, apply=None):
+        """Applies a change just saved (over version `before`) to the search index; see SearchIndexStore.update."""
+        self.search_indexes.update(gallery_name, before, self.get_gallery_version(gallery_name), apply)
+
+    def _save_date_index(self, data: Dict[str, Any], gallery_name: str):
+        date_index_path = self._get_date_index_path(gallery_name)
+        try:
+            self.storage.save(date_index_path, json.dumps(self.build_date_index(data)).encode('utf-8'))
+        except Exception as e:
+            print(f"Error saving date index to {date_index_path}: {e}")
+
+    def load_date_index(self, gallery_name: str) -> Dict[str, int]:
+        """
+        Returns the per-date image counts of a gallery without loading the tree,
+        building the index from the tree for galleries saved before it existed.
+        """
+        date_index_path = self._get_date_index_path(gallery_name)
+        try:
+            if self.storage.exists(date_index_path):
+                return json.loads(self.storage.load(date_index_path).decode('utf-8'))
+        except Exception as e:
+            print(f"Error loading date index from {date_index_path}: {e}")
+        return self.build_date_index(self.load_gallery_data(gallery_name))
+
+    def _save_version(self, encoded: bytes, gallery_name: str) -> str:
+        version = hashlib.sha256(encoded).hexdigest()[:32]
+        try:
+            self.storage.save(self._get_version_path(gallery_name), version.encode('ascii'))
+        except Exception as e:
+            print(f"Error saving version of gallery {gallery_name}: {e}")
+        return version
+
+    def get_gallery_version(self, gallery_name: str) -> str | None:
+        """
+        Returns a content hash of the stored gallery data, read from a small
+        sidecar file written on every save, or None if the gallery has no data.
+        Used as the ETag of the gallery API responses.
+        """
+        try:
+            return self.storage.load(self._get_version_path(gallery_name)).decode('ascii').strip()
+        except Exception:
+            pass
+        # Galleries saved before the sidecar existed
+        gallery_data_path = self._get_gallery_data_path(gallery_name)
+        try:
+            if self.storage.exists(gallery_data_path):
+                return self._save_version(self.storage.load(gallery_data_path), gallery_name)
+        except Exception as e:
+            print(f"Error reading gallery data version from {gallery_data_path}: {e}")
+        return None
+
     def get_backup_versions(self, gallery_name: str) -> list[Dict[str, Any]]:
         backup_files = []
         jst = pytz.timezone('Asia/Tokyo')
@@ -107,20 +309,54 @@ class DataManager:
         if self.storage.exists(backup_filepath):
             try:
                 data_bytes = self.storage.load(backup_filepath)
-                data = json.loads(data_bytes.decode('utf-8'))
-                self.storage.save(gallery_data_path, json.dumps(data, ensure_ascii=False, indent=4).encode('utf-8'))
+                data = self.codec.decode(data_bytes)
+                node_stats.ensure(data)
+                encoded = self.codec.encode(data)
+                self.storage.save(gallery_data_path, encoded)
+                version = self._save_version(encoded, gallery_name)
+                self._save_date_index(data, gallery_name)
+                self.catalog.record(gallery_name, self.gallery_stats(data), version)
                 return True
             except Exception as e:
                 print(f"Error reverting to version {filename}: {e}")
                 return False
         return False
 
+    def migrate_encoding(self, gallery_name: str, include_backups: bool = True) -> Dict[str, int]:
+        """
+        Rewrites a gallery's data file (and its backups) in the configured
+        encoding, without creating a new backup.
+
+        Returns:
+            dict: Number of files rewritten and their total size before and after.
+        """
+        paths = []
+        gallery_data_path = self._get_gallery_data_path(gallery_name)
+        if self.storage.exists(gallery_data_path):
+            paths.append(gallery_data_path)
+        if include_backups:
+            backup_dir = self._get_backup_dir_for_gallery(gallery_name)
+            paths.extend(os.path.join(backup_dir, version['filename']) for version in self.get_backup_versions(gallery_name))
+
+        summary = {'files': 0, 'bytes_before': 0, 'bytes_after': 0}
+        for path in paths:
+            data_bytes = self.storage.load(path)
+            encoded = self.codec.encode(self.codec.decode(data_bytes))
+            summary['bytes_before'] += len(data_bytes)
+            summary['bytes_after'] += len(encoded)
+            if encoded != data_bytes:
+                self.storage.save(path, encoded)
+                if path == gallery_data_path:
+                    self._save_version(encoded, gallery_name)
+                summary['files'] += 1
+        return summary
+
     def read_backup(self, filename: str, gallery_name: str) -> Dict[str, Any] | None:
         backup_filepath = os.path.join(self._get_backup_dir_for_gallery(gallery_name), filename)
         if self.storage.exists(backup_filepath):
             try:
                 data_bytes = self.storage.load(backup_filepath)
-                return json.loads(data_bytes.decode('utf-8'))
+                return self.codec.decode(data_bytes)
             except Exception as e:
                 print(f"Error reading backup {filename}: {e}")
                 return None
@@ -152,34 +388,199 @@ class DataManager:
 
         node = self._find_node_by_path(gallery_data, path_parts)
         if node:
+            before = self.get_gallery_version(gallery_name)
             node['comment'] = comment
             self.save_gallery_data(gallery_data, gallery_name)
+            self._index_change(gallery_name, before, self._comment_indexer(path_parts, comment))
             return True
         return False
 
-    def _find_image_and_update_status(self, node, image_filename, status):
-        if 'images' in node:
-            for image in node['images']:
-                if image['filename'] == image_filename:
-                    image['status'] = status
-                    return True
-        if 'children' in node:
-            for child in node['children']:
-                if self._find_image_and_update_status(child, image_filename, status):
-                    return True
-        return False
+    @staticmethod
+    def _comment_indexer(path_parts: list[str], comment: str):
+        # The root's comment is not indexed, so changing it leaves the index content as is
+        folder_path = '/'.join(part for part in path_parts if part)
+        return (lambda index: index.set_folder(folder_path, comment)) if folder_path else None
 
     def update_image_status(self, image_paths: list[str], status: str, gallery_name: str) -> bool:
         gallery_data = self.load_gallery_data(gallery_name)
         if not gallery_data:
             return False
 
+        before = self.get_gallery_version(gallery_name)
+        if self._set_status_of_filenames(gallery_data, image_paths, status):
+            saved = self.save_gallery_data(gallery_data, gallery_name)
+            self._index_change(gallery_name, before) # Statuses are not indexed
+            return saved
+        return False
+
+    @staticmethod
+    def _set_status_of_filenames(node: Dict[str, Any], image_paths: list[str], status: str) -> bool:
+        """Sets the status of the given images below `node` and refreshes the affected aggregates."""
+        # One pass over the tree for all filenames, instead of one search per filename
+        filenames = {full_image_path.split('/')[-1] for full_image_path in image_paths}
         updated = False
-        for full_image_path in image_paths:
-            image_filename = full_image_path.split('/')[-1]
-            if self._find_image_and_update_status(gallery_data, image_filename, status):
-                updated = True
-        
-        if updated:
-            return self.save_gallery_data(gallery_data, gallery_name)
-        return False
\ No newline at end of file
+        changed_paths = set()
+        stack = [(node, ())]
+        while stack:
+            current, path = stack.pop()
+            for image in current.get('images', []):
+                if image['filename'] in filenames:
+                    image['status'] = status
+                    updated = True
+                    changed_paths.add(path)
+            stack.extend((child, path + (child.get('name'),)) for child in current.get('children', []))
+        node_stats.refresh_paths(node, changed_paths)
+        return updated
+
+    def update_status_by_selection(self, selection: Selection, status: str, gallery_name: str) -> Dict[str, Any] | None:
+        """
+        Sets the status of every image matched by `selection`.
+
+        Returns:
+            dict | None: 'matched' (number of selected images) and 'filenames'
+            (those whose status changed), or None if the gallery does not exist
+            or saving failed.
+        """
+        gallery_data = self.load_gallery_data(gallery_name)
+        if not gallery_data:
+            return None
+        before = self.get_gallery_version(gallery_name)
+        with span('select'):
+            matched, changed = self._set_status_of_matches(selection, status, gallery_data)
+        if changed:
+            if not self.save_gallery_data(gallery_data, gallery_name):
+                return None
+            self._index_change(gallery_name, before)
+        return {'matched': matched, 'filenames': changed}
+
+    @staticmethod
+    def _set_status_of_matches(selection: Selection, status: str, node: Dict[str, Any],
+                               path: tuple = ()) -> tuple[int, list[str]]:
+        """
+        Sets the status of the images below `node` (whose path is `path`) matched
+        by `selection`, refreshing the aggregates of the folders that changed.
+
+        Returns:
+            tuple: The number of matched images and the filenames whose status changed.
+        """
+        matched, changed, changed_paths = 0, [], set()
+        for _, image, image_path in selection.iter_matches(node, path):
+            matched += 1
+            if image.get('status', 'neutral') != status:
+                image['status'] = status
+                changed.append(image['filename'])
+                changed_paths.add(image_path[len(path):])
+        node_stats.refresh_paths(node, changed_paths)
+        return matched, changed
+
+    @staticmethod
+    def prune_empty_folders(node: Dict[str, Any], path: tuple = (), pruned: list | None = None) -> bool:
+        """
+        Removes folders without images below `node` (whose path is `path`) in
+        place, appending their paths to `pruned` if given. Returns True if
+        `node` itself is empty.
+        """
+        kept = []
+        for child in node.get('children', []):
+            child_path = path + (child.get('name'),)
+            if not DataManager.prune_empty_folders(child, child_path, pruned):
+                kept.append(child)
+            elif pruned is not None:
+                pruned.append(child_path)
+        node['children'] = kept
+        return not node.get('images') and not node['children']
+
+    def find_by_selection(self, selection: Selection, gallery_name: str) -> list[tuple[str, Dict[str, Any]]] | None:
+        """
+        Resolves `selection` without changing anything.
+
+        Returns:
+            list | None: (folder path, image) of every selected image, folders
+            in tree order, or None if the gallery does not exist.
+        """
+        gallery_data = self.load_gallery_data(gallery_name)
+        if not gallery_data:
+            return None
+        with span('select'):
+            return [('/'.join(path), image) for _, image, path in selection.iter_matches(gallery_data)]
+
+    def delete_by_selection(self, selection: Selection, gallery_name: str) -> Dict[str, Any] | None:
+        """
+        Removes every image matched by `selection` from the gallery data, and
+        folders left empty.
+
+        Returns:
+            dict | None: 'matched' and 'filenames' of the removed images, or
+            None if the gallery does not exist or saving failed.
+        """
+        gallery_data = self.load_gallery_data(gallery_name)
+        if not gallery_data:
+            return None
+        before = self.get_gallery_version(gallery_name)
+        with span('select'):
+            removed = self._remove_matches(selection, gallery_data)
+        if removed:
+            pruned = []
+            self.prune_empty_folders(gallery_data, pruned=pruned)
+            if not self.save_gallery_data(gallery_data, gallery_name):
+                return None
+            self._index_change(gallery_name, before, lambda index: index.remove(removed, pruned))
+        return {'matched': len(removed), 'filenames': [filename for _, filename in removed]}
+
+    @staticmethod
+    def _remove_matches(selection: Selection, node: Dict[str, Any], path: tuple = ()) -> list[tuple[tuple, str]]:
+        """Removes the images below `node` matched by `selection`; returns them as (folder path, filename)."""
+        by_node = {}
+        for folder, image, image_path in selection.iter_matches(node, path):
+            by_node.setdefault(id(folder), (folder, image_path, set()))[2].add(image['filename'])
+        removed = []
+        for folder, folder_path, filenames in by_node.values():
+            folder['images'] = [image for image in folder['images'] if image['filename'] not in filenames]
+            removed.extend((folder_path, filename) for filename in filenames)
+        # Folders emptied here and pruned later count for nothing, so their ancestors stay right
+        node_stats.refresh_paths(node, [folder_path[len(path):] for _, folder_path, _ in by_node.values()])
+        return removed
+
+    @staticmethod
+    def merge_trees(existing: Dict[str, Any], new: Dict[str, Any]):
+        """
+        Merges the `new` tree into `existing` in place, skipping images already in
+        the same folder. Only the aggregates of folders `new` reaches are refreshed.
+        """
+        existing_image_filenames = {img['filename'] for img in existing.get('images', [])}
+        for new_image in new.get('images', []):
+            if new_image['filename'] not in existing_image_filenames:
+                existing.setdefault('images', []).append(new_image)
+
+        existing_children_map = {child['name']: child for child in existing.get('children', [])}
+        for new_child in new.get('children', []):
+            if new_child['name'] in existing_children_map:
+                DataManager.merge_trees(existing_children_map[new_child['name']], new_child)
+            else:
+                node_stats.compute(new_child)
+                existing.setdefault('children', []).append(new_child)
+        node_stats.refresh(existing)
+
+    def merge_gallery_data(self, new_data: Dict[str, Any], gallery_name: str) -> Dict[str, Any] | None:
+        """
+        Merges a newly ingested tree into the stored gallery and saves the result.
+        Images already present (same hashed filename) are skipped, so merging the
+        same upload twice is harmless.
+
+        Returns:
+            dict | None: The merged gallery data, or None if saving failed.
+        """
+        existing_data = self.load_gallery_data(gallery_name)
+        before = self.get_gallery_version(gallery_name)
+
+        with span('merge'):
+            if not existing_data or (not existing_data.get('images') and not existing_data.get('children')):
+                final_gallery_data = new_data
+            else:
+                self.merge_trees(existing_data, new_data)
+                final_gallery_data = existing_data
+
+        if self.save_gallery_data(final_gallery_data, gallery_name):
+            self._index_change(gallery_name, before, lambda index: index.add_tree(new_data))
+            return final_gallery_data
+        return None
@@ -1,16 +1,22 @@
 import logging
 from ..storage.storage import Storage
 from .data_manager import DataManager
+from .progress_reporter import ProgressReporter
+from .selection import Selection
+from . import node_stats
+from ..tracing import span
 
 logger = logging.getLogger(__name__)
 
 class DeleteService:
-    def __init__(self, storage: Storage, data_manager: DataManager):
+    def __init__(self, storage: Storage, data_manager: DataManager, socketio=None):
         """
         Initializes the DeleteService with storage and data_manager objects.
+        An optional socketio instance receives 'delete_progress' events.
         """
         self.storage = storage
         self.data_manager = data_manager
+        self.socketio = socketio
 
     def _collect_all_images_in_node(self, node, images_to_delete_in_storage):
         for img in node.get('images', []):
@@ -18,6 +24,20 @@ class DeleteService:
         for child in node.get('children', []):
             self._collect_all_images_in_node(child, images_to_delete_in_storage)
 
+    def delete_selection(self, selection: Selection, gallery_name: str) -> dict | None:
+        """
+        Deletes the images matched by a selection expression, resolved by the
+        DataManager in one pass.
+
+        Returns:
+            dict | None: 'matched' and 'filenames' of the deleted images, or None on failure.
+        """
+        progress = ProgressReporter('delete', gallery_name, socketio=self.socketio)
+        progress.start() # The number of matches is only known once the selection is resolved
+        result = self.data_manager.delete_by_selection(selection, gallery_name)
+        progress.finish(success=result is not None)
+        return result
+
     def delete_items(self, paths_to_delete: list[str], gallery_name: str) -> bool:
         """
         Deletes specified items (images or directories) from the gallery.
@@ -29,9 +49,11 @@ class DeleteService:
         Returns:
             bool: True if deletion was successful, False otherwise.
         """
+        progress = ProgressReporter('delete', gallery_name, socketio=self.socketio)
         current_gallery_data = self.data_manager.load_gallery_data(gallery_name)
         if not current_gallery_data:
             logger.error("No gallery data found for deletion.")
+            progress.finish(success=False)
             return False
 
         images_to_delete_in_storage = set()
@@ -50,9 +72,10 @@ class DeleteService:
             for child in node.get('children', []):
                 find_and_collect_images(child, paths_to_delete_set)
 
-        find_and_collect_images(current_gallery_data, paths_set)
-        
-        
+        with span('delete_collect'):
+            find_and_collect_images(current_gallery_data, paths_set)
+        progress.start(total=len(images_to_delete_in_storage))
+
 
         # This recursive function will remove items from the JSON structure
         def remove_from_json(node, paths_to_delete_set):
@@ -67,6 +90,11 @@ class DeleteService:
             return node
 
         # Update the JSON data structure
-        updated_gallery_data = remove_from_json(current_gallery_data, paths_set)
-        
-        return self.data_manager.save_gallery_data(updated_gallery_data, gallery_name)
+        with span('delete_prune'):
+            updated_gallery_data = remove_from_json(current_gallery_data, paths_set)
+            node_stats.compute(updated_gallery_data) # The walk above touched every folder anyway
+        progress.advance(len(images_to_delete_in_storage))
+
+        success = self.data_manager.save_gallery_data(updated_gallery_data, gallery_name)
+        progress.finish(success=success)
+        return success
@@ -0,0 +1,145 @@
+from typing import Dict, Any
+
+
+class BKTree:
+    """
+    A Burkhard-Keller tree over 64-bit perceptual hashes. A radius query only
+    descends into children whose edge distance is within the radius of the
+    query's distance to the node (triangle inequality), so near-duplicate
+    lookups visit a small fraction of the tree.
+    """
+
+    def __init__(self):
+        self.root = None # [hash_int, [items], {distance: child}]
+
+    def add(self, phash: str, item):
+        value = int(phash, 16)
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = (value ^ node[0]).bit_count()
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, phash: str, max_distance: int) -> list:
+        """Returns the items whose hash is within `max_distance` bits of `phash`."""
+        if self.root is None:
+            return []
+        value = int(phash, 16)
+        matches = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = (value ^ node[0]).bit_count()
+            if distance <= max_distance:
+                matches.extend(node[1])
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        return matches
+
+
+class DuplicateService:
+    """Finds clusters of near-duplicate images from the stored perceptual hashes."""
+
+    def __init__(self, max_distance: int = 10):
+        self.max_distance = max_distance
+
+    def _collect_hashed_images(self, node, images):
+        for image in node.get('images', []):
+            if image.get('phash'):
+                images.append((image, node.get('full_path', '')))
+        for child in node.get('children', []):
+            self._collect_hashed_images(child, images)
+
+    def find_clusters(self, gallery_data: Dict[str, Any], max_distance: int | None = None) -> list[Dict[str, Any]]:
+        """
+        Groups images whose hashes are within `max_distance` bits of each other,
+        transitively (a burst of frames forms one cluster even if its first and
+        last frames are further apart).
+
+        Args:
+            gallery_data (dict): The gallery tree.
+            max_distance (int): Maximum Hamming distance; defaults to the service's.
+
+        Returns:
+            list[dict]: Clusters with at least two images, largest first. Each has
+            an 'id' (its representative's filename), the 'representative' and the
+            member 'filenames' in gallery order.
+        """
+        if max_distance is None:
+            max_distance = self.max_distance
+        images = []
+        self._collect_hashed_images(gallery_data, images)
+
+        tree = BKTree()
+        for index, (image, _) in enumerate(images):
+            tree.add(image['phash'], index)
+
+        # Union-find over the near-duplicate pairs
+        parent = list(range(len(images)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for index, (image, _) in enumerate(images):
+            for other in tree.search(image['phash'], max_distance):
+                root_a, root_b = find(index), find(other)
+                if root_a != root_b:
+                    parent[max(root_a, root_b)] = min(root_a, root_b)
+
+        groups = {}
+        for index in range(len(images)):
+            groups.setdefault(find(index), []).append(index)
+
+        clusters = []
+        for members in groups.values():
+            if len(members) < 2:
+                continue
+            filenames = [images[i][0]['filename'] for i in members]
+            clusters.append({
+                'id': filenames[0],
+                'representative': filenames[0],
+                'filenames': filenames,
+                'paths': sorted({images[i][1] for i in members})
+            })
+        clusters.sort(key=lambda cluster: len(cluster['filenames']), reverse=True)
+        return clusters
+
+    def find_cluster_of(self, gallery_data: Dict[str, Any], filename: str, max_distance: int | None = None) -> list[str]:
+        """
+        Returns the filenames in the cluster containing `filename` (just itself
+        if it has no near-duplicates), in gallery order. Only that cluster is
+        built, by repeated radius queries from its members.
+        """
+        if max_distance is None:
+            max_distance = self.max_distance
+        images = []
+        self._collect_hashed_images(gallery_data, images)
+        start = next((index for index, (image, _) in enumerate(images) if image['filename'] == filename), None)
+        if start is None:
+            return [filename]
+
+        tree = BKTree()
+        for index, (image, _) in enumerate(images):
+            tree.add(image['phash'], index)
+        members = {start}
+        frontier = [start]
+        while frontier:
+            index = frontier.pop()
+            for other in tree.search(images[index][0]['phash'], max_distance):
+                if other not in members:
+                    members.add(other)
+                    frontier.append(other)
+        return [images[index][0]['filename'] for index in sorted(members)]
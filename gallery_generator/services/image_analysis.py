@@ -0,0 +1,213 @@
+"""
+CPU-bound per-image work done during ingest.
+
+The functions in this module are top-level and only take picklable arguments,
+so UploadService can run them in a process pool. Each worker process keeps its
+own open handle on the zip archive and receives member names (file offsets
+into the archive), or file paths for directory ingest, rather than the image
+bytes.
+"""
+import io
+import base64
+import hashlib
+import zipfile
+from datetime import datetime
+import numpy as np
+from PIL import Image, ImageOps
+
+# EXIF tags used below
+_TAG_ORIENTATION = 0x0112
+_TAG_DATETIME = 0x0132
+_TAG_EXIF_IFD = 0x8769
+_TAG_DATETIME_ORIGINAL = 0x9003
+
+_open_archives = {} # Per-process cache: zip path -> ZipFile
+
+_PHASH_SIZE = 32 # Side of the grayscale thumbnail the DCT runs on
+_PHASH_BITS = 8 # Side of the low-frequency block kept (8x8 = 64-bit hash)
+_PLACEHOLDER_CELLS = 6 # Cells on the long side of a placeholder
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    # Orthonormal DCT-II basis, so the 2D transform is D @ A @ D.T
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT = _dct_matrix(_PHASH_SIZE)
+
+
+def _get_archive(zip_path: str) -> zipfile.ZipFile:
+    archive = _open_archives.get(zip_path)
+    if archive is None:
+        # Archives from earlier jobs are no longer needed by this worker
+        for stale in _open_archives.values():
+            stale.close()
+        _open_archives.clear()
+        archive = zipfile.ZipFile(zip_path, 'r')
+        _open_archives[zip_path] = archive
+    return archive
+
+
+def _parse_exif_datetime(value) -> str | None:
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.strptime(value.strip('\x00 ')[:19], '%Y:%m:%d %H:%M:%S').isoformat()
+    except ValueError:
+        return None
+
+
+def compute_phash(image: Image.Image) -> str:
+    """
+    Computes a 64-bit DCT perceptual hash: the sign of the lowest 8x8 DCT
+    frequencies of a 32x32 grayscale thumbnail relative to their median.
+    Near-identical images (re-exports, burst shots) differ in only a few bits.
+
+    Args:
+        image (Image.Image): An opened, not yet decoded image.
+
+    Returns:
+        str: The hash as 16 hex digits.
+    """
+    # draft() lets the JPEG decoder downscale in the DCT domain, which is far
+    # cheaper than decoding at full resolution.
+    image.draft('L', (_PHASH_SIZE * 2, _PHASH_SIZE * 2))
+    thumbnail = image.convert('L').resize((_PHASH_SIZE, _PHASH_SIZE), Image.Resampling.BOX)
+    pixels = np.asarray(thumbnail, dtype=np.float64)
+    low_frequencies = (_DCT @ pixels @ _DCT.T)[:_PHASH_BITS, :_PHASH_BITS].flatten()
+    # The DC term only reflects overall brightness, so it is left out of the median
+    bits = low_frequencies > np.median(low_frequencies[1:])
+    return f"{int(np.packbits(bits).view('>u8')[0]):016x}"
+
+
+def compute_placeholder(image: Image.Image) -> str:
+    """
+    Computes a placeholder for the grid: the image averaged down to a few
+    cells (6 on the long side, as displayed), as '<w>x<h>:<base64 RGB bytes>',
+    e.g. '6x4:' followed by 96 characters. The page expands it into a blurred
+    preview with the image's aspect ratio.
+
+    Args:
+        image (Image.Image): An opened, not yet decoded image.
+
+    Returns:
+        str: The placeholder.
+    """
+    image.draft('RGB', (_PLACEHOLDER_CELLS * 8, _PLACEHOLDER_CELLS * 8))
+    image = ImageOps.exif_transpose(image).convert('RGB')
+    width, height = image.size
+    scale = _PLACEHOLDER_CELLS / max(width, height)
+    cells = (max(1, round(width * scale)), max(1, round(height * scale)))
+    pixels = image.resize(cells, Image.Resampling.BOX).tobytes()
+    return f"{cells[0]}x{cells[1]}:{base64.b64encode(pixels).decode('ascii')}"
+
+
+def hamming_distance(hash_a: str, hash_b: str) -> int:
+    """Returns the number of differing bits between two hex hashes."""
+    return (int(hash_a, 16) ^ int(hash_b, 16)).bit_count()
+
+
+def read_image_header(data: bytes) -> dict:
+    """
+    Reads dimensions, orientation and capture time from an image's header.
+    Pillow parses only the header on open, so the pixels are never decoded.
+
+    Args:
+        data (bytes): The encoded image.
+
+    Returns:
+        dict: 'width' and 'height' (as displayed, i.e. after applying the EXIF
+        orientation), 'orientation' and 'capture_date' (ISO 8601), for the
+        fields that could be read.
+    """
+    header = {}
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            width, height = image.size
+            exif = image.getexif()
+    except Exception:
+        return header
+
+    orientation = exif.get(_TAG_ORIENTATION, 1)
+    if orientation in (5, 6, 7, 8): # Rotated by 90 or 270 degrees
+        width, height = height, width
+    header['width'] = width
+    header['height'] = height
+    if orientation != 1:
+        header['orientation'] = orientation
+
+    capture_date = _parse_exif_datetime(exif.get_ifd(_TAG_EXIF_IFD).get(_TAG_DATETIME_ORIGINAL))
+    if capture_date is None:
+        capture_date = _parse_exif_datetime(exif.get(_TAG_DATETIME))
+    if capture_date:
+        header['capture_date'] = capture_date
+    return header
+
+
+def analyze_image_bytes(data: bytes) -> dict:
+    """
+    Extracts compact metadata from an image's bytes.
+
+    Args:
+        data (bytes): The encoded image.
+
+    Returns:
+        dict: Metadata to be stored in the image record.
+    """
+    metadata = {'size': len(data)}
+    metadata.update(read_image_header(data))
+    if 'width' in metadata: # Pillow could open it
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                metadata['phash'] = compute_phash(image)
+        except Exception:
+            pass # Truncated or unsupported image data; store it without a hash
+        try:
+            # draft() above changed how the first handle decodes, so open it again
+            with Image.open(io.BytesIO(data)) as image:
+                metadata['placeholder'] = compute_placeholder(image)
+        except Exception:
+            pass # The grid falls back to the generic placeholder
+    return metadata
+
+
+def analyze_zip_member(zip_path: str, member_name: str) -> dict:
+    """
+    Inflates a zip member and analyzes it.
+
+    Args:
+        zip_path (str): Path of the zip archive on local disk.
+        member_name (str): Name of the member inside the archive.
+
+    Returns:
+        dict: The metadata only. The caller reads the member again for the
+        storage write, so image bytes are not sent back between processes.
+    """
+    with _get_archive(zip_path).open(member_name) as file_in_zip:
+        data = file_in_zip.read()
+    return analyze_image_bytes(data)
+
+
+def analyze_file(path: str, known_hash: str | None = None) -> tuple[str, dict | None]:
+    """
+    Reads and hashes a file, and analyzes it unless its content is unchanged.
+
+    Args:
+        path (str): Path of the image on local disk.
+        known_hash (str): MD5 of the content last ingested from this path, if any.
+
+    Returns:
+        tuple: The hex MD5 of the content and the metadata, or None if the MD5
+        equals `known_hash`. Like analyze_zip_member, the bytes are not
+        returned; the caller reads the file again for the storage write.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    content_hash = hashlib.md5(data).hexdigest()
+    if content_hash == known_hash:
+        return content_hash, None
+    return content_hash, analyze_image_bytes(data)
@@ -0,0 +1,77 @@
+"""
+Many images in one response, for the gallery grid.
+
+The body is a sequence of frames, one per requested image, in the order the
+storage reads complete:
+
+    [4-byte big-endian header length][header: UTF-8 JSON][body: header["size"] bytes]
+
+The header is {"filename", "type", "size"}, or {"filename", "error", "size": 0}
+for an image that could not be read ("not_found" or "failed"), so one missing
+image does not fail the batch.
+"""
+import json
+import struct
+import logging
+import concurrent.futures
+from mimetypes import guess_type
+from typing import Dict, Any, Iterator
+from ..storage.storage import Storage
+from ..tracing import bind
+
+logger = logging.getLogger(__name__)
+
+MEDIA_TYPE = 'application/x-gallery-image-batch'
+_LENGTH = struct.Struct('>I')
+
+
+def encode_frame(header: Dict[str, Any], body: bytes = b'') -> bytes:
+    encoded = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    return _LENGTH.pack(len(encoded)) + encoded + body
+
+
+def decode_frames(raw: bytes) -> list[tuple[Dict[str, Any], bytes]]:
+    """Splits a whole batch body into (header, body) pairs."""
+    frames, offset = [], 0
+    while offset < len(raw):
+        (header_length,) = _LENGTH.unpack_from(raw, offset)
+        offset += _LENGTH.size
+        header = json.loads(raw[offset:offset + header_length])
+        offset += header_length
+        frames.append((header, raw[offset:offset + header['size']]))
+        offset += header['size']
+    return frames
+
+
+class ImageBatchService:
+    """Reads the images of a batch from storage in parallel, each distinct file once."""
+
+    def __init__(self, storage: Storage, max_workers: int = 8):
+        self.storage = storage
+        self.max_workers = max(1, max_workers)
+
+    def stream(self, gallery_name: str, filenames: list[str]) -> Iterator[bytes]:
+        """Yields one frame per distinct filename, as soon as its read completes."""
+        unique = list(dict.fromkeys(filenames))
+        if not unique:
+            return
+        load = bind(self.storage.load) # Storage reads in the pool belong to the request's trace
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(self.max_workers, len(unique)))
+        try:
+            futures = {executor.submit(load, f"{gallery_name}/{filename}"): filename for filename in unique}
+            for future in concurrent.futures.as_completed(futures):
+                filename = futures[future]
+                try:
+                    data = future.result()
+                except FileNotFoundError:
+                    yield encode_frame({'filename': filename, 'error': 'not_found', 'size': 0})
+                    continue
+                except Exception as e:
+                    logger.error(f"Error reading image {gallery_name}/{filename} for a batch: {e}")
+                    yield encode_frame({'filename': filename, 'error': 'failed', 'size': 0})
+                    continue
+                mimetype = guess_type(filename)[0] or 'application/octet-stream'
+                yield encode_frame({'filename': filename, 'type': mimetype, 'size': len(data)}, data)
+        finally:
+            # Also runs when the client goes away mid-batch
+            executor.shutdown(wait=False, cancel_futures=True)
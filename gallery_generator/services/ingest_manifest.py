@@ -0,0 +1,125 @@
+import os
+import hashlib
+import logging
+from typing import Any
+from gallery_generator.storage.storage import Storage
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FORMAT = 1
+
+
+class IngestManifest:
+    """
+    What a directory ingest last saw of a source directory tree, so a rescan
+    processes only new or changed files:
+
+        {"relative/path.jpg": [size, mtime_ns, md5, stored filename], ...}
+
+    A file whose size and modification time are unchanged is skipped without
+    being read. One whose stat changed is read and hashed again, and only
+    processed if its content changed. The manifest is stored with the gallery
+    data (one per source directory), and only saved once the gallery data
+    includes what was recorded, so an interrupted ingest is simply redone.
+    """
+
+    def __init__(self, storage: Storage, codec: Any, path: str, source_dir: str, files: dict | None = None):
+        self.storage = storage
+        self.codec = codec
+        self.path = path
+        self.source_dir = source_dir
+        self.files = files or {}
+        self._replaced = set() # Stored filenames of files whose content changed
+        self._dirty = False
+
+    @classmethod
+    def load(cls, storage: Storage, codec: Any, base_dir: str, gallery_name: str, source_dir: str) -> 'IngestManifest':
+        """The manifest of `source_dir` for a gallery, empty if there is none (or it is unreadable)."""
+        source_dir = os.path.abspath(source_dir)
+        source_key = hashlib.sha256(source_dir.encode('utf-8')).hexdigest()[:16]
+        path = os.path.join(base_dir, gallery_name, f"ingest_manifest_{source_key}.json")
+        try:
+            if storage.exists(path):
+                data = codec.decode(storage.load(path))
+                if data.get('manifest_format') == MANIFEST_FORMAT and data.get('source_dir') == source_dir:
+                    return cls(storage, codec, path, source_dir, data['files'])
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable ingest manifest {path}: {e}")
+        return cls(storage, codec, path, source_dir)
+
+    def scan(self, extensions) -> tuple[list[tuple[str, int, int]], list[str]]:
+        """
+        Walks the source directory (skipping hidden entries) for files with
+        one of `extensions`.
+
+        Returns:
+            tuple: The (relative path, size, mtime_ns) of new files and files
+            whose size or modification time changed, in walk order, and the
+            relative paths of recorded files that are gone.
+        """
+        changed, seen = [], set()
+        stack = ['']
+        while stack:
+            relative_dir = stack.pop()
+            try:
+                entries = sorted(os.scandir(os.path.join(self.source_dir, relative_dir)), key=lambda entry: entry.name)
+            except OSError as e:
+                logger.warning(f"Cannot list {relative_dir or '.'} in {self.source_dir}: {e}")
+                continue
+            subdirs = []
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                relative_path = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(relative_path)
+                elif os.path.splitext(entry.name)[1].lower() in extensions and entry.is_file():
+                    stat = entry.stat()
+                    seen.add(relative_path)
+                    recorded = self.files.get(relative_path)
+                    if recorded is None or recorded[0] != stat.st_size or recorded[1] != stat.st_mtime_ns:
+                        changed.append((relative_path, stat.st_size, stat.st_mtime_ns))
+            stack.extend(reversed(subdirs)) # Visit subdirectories in name order
+        missing = [relative_path for relative_path in self.files if relative_path not in seen]
+        return changed, missing
+
+    def known_hash(self, relative_path: str) -> str | None:
+        recorded = self.files.get(relative_path)
+        return recorded[2] if recorded else None
+
+    def record(self, relative_path: str, size: int, mtime_ns: int, content_hash: str, filename: str):
+        """Records the current state of a file and the name its content is stored under."""
+        previous = self.files.get(relative_path)
+        if previous is not None and previous[3] != filename:
+            self._replaced.add(previous[3])
+        self.files[relative_path] = [size, mtime_ns, content_hash, filename]
+        self._dirty = True
+
+    def forget(self, relative_paths):
+        """Drops files that no longer exist. Their images stay in the gallery."""
+        for relative_path in relative_paths:
+            if self.files.pop(relative_path, None) is not None:
+                self._dirty = True
+
+    def replaced_filenames(self) -> list[str]:
+        """Stored filenames of earlier versions of changed files that no recorded file uses anymore."""
+        if not self._replaced:
+            return []
+        in_use = {recorded[3] for recorded in self.files.values()}
+        return sorted(self._replaced - in_use)
+
+    def save(self) -> bool:
+        if not self._dirty:
+            return True
+        try:
+            self.storage.save(self.path, self.codec.encode({
+                'manifest_format': MANIFEST_FORMAT,
+                'source_dir': self.source_dir,
+                'files': self.files
+            }))
+        except Exception as e:
+            # The next ingest processes these files again, which merges nothing new
+            logger.error(f"Error saving ingest manifest {self.path}: {e}")
+            return False
+        self._dirty = False
+        return True
@@ -0,0 +1,284 @@
+import json
+import os
+import sqlite3
+import time
+import uuid
+import logging
+from contextlib import closing
+from typing import Dict, Any
+
+logger = logging.getLogger(__name__)
+
+# Job states. 'queued' and 'running' are live states, the others are terminal.
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    gallery_name TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL,
+    progress REAL,
+    detail TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker_id TEXT,
+    lease_expires REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_gallery ON jobs (gallery_name, created_at);
+"""
+
+
+class JobQueue:
+    """
+    A persistent job queue backed by a local SQLite database.
+
+    Every web worker and every job worker process opens the same database file,
+    so job state and progress are visible from any process. Jobs are claimed
+    with a lease; a job whose lease expires (because its worker crashed or was
+    restarted) is handed out again, so job handlers must be idempotent.
+    """
+
+    def __init__(self, db_path: str, max_concurrent: int = 4, max_per_gallery: int = 1,
+                 lease_seconds: float = 60, max_attempts: int = 3):
+        """
+        Initializes the JobQueue and creates the database schema if needed.
+
+        Args:
+            db_path (str): Path of the SQLite database file.
+            max_concurrent (int): Maximum number of running jobs across all galleries.
+            max_per_gallery (int): Maximum number of running jobs per gallery.
+            lease_seconds (float): How long a claim stays valid without a heartbeat.
+            max_attempts (int): How many times a job is tried before it is marked failed.
+        """
+        self.db_path = db_path
+        self.max_concurrent = max_concurrent
+        self.max_per_gallery = max_per_gallery
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # A short-lived connection per operation keeps the queue safe to use from
+        # any thread; isolation_level=None lets us issue BEGIN IMMEDIATE ourselves.
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row | None) -> Dict[str, Any] | None:
+        if row is None:
+            return None
+        job = dict(row)
+        job['payload'] = json.loads(job['payload']) if job['payload'] else {}
+        job['detail'] = json.loads(job['detail']) if job['detail'] else {}
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def enqueue(self, kind: str, gallery_name: str, payload: Dict[str, Any], job_id: str | None = None) -> str:
+        """
+        Adds a job to the queue. Enqueuing an existing job id is a no-op.
+
+        Args:
+            kind (str): The job handler name, e.g. 'upload'.
+            gallery_name (str): The gallery the job operates on.
+            payload (dict): JSON-serializable handler arguments.
+            job_id (str): Optional caller-chosen id, for idempotent submission.
+
+        Returns:
+            str: The job id.
+        """
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO jobs (id, kind, gallery_name, payload, state, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (job_id, kind, gallery_name, json.dumps(payload), QUEUED, now, now)
+            )
+        return job_id
+
+    def claim(self, worker_id: str, job_id: str | None = None) -> Dict[str, Any] | None:
+        """
+        Claims the oldest runnable job, honouring the global and per-gallery
+        concurrency limits. Running jobs with an expired lease are reclaimed.
+
+        Args:
+            worker_id (str): Identifier of the claiming worker.
+            job_id (str): Restrict the claim to this job.
+
+        Returns:
+            dict | None: The claimed job, or None if nothing can run right now.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # Expired leases no longer count against the limits; they are candidates again.
+            running = conn.execute(
+                'SELECT gallery_name, COUNT(*) AS n FROM jobs WHERE state = ? AND lease_expires >= ? GROUP BY gallery_name',
+                (RUNNING, now)
+            ).fetchall()
+            running_per_gallery = {row['gallery_name']: row['n'] for row in running}
+            if sum(running_per_gallery.values()) >= self.max_concurrent:
+                conn.execute('COMMIT')
+                return None
+
+            query = ('SELECT * FROM jobs WHERE (state = ? OR (state = ? AND lease_expires < ?))')
+            params = [QUEUED, RUNNING, now]
+            if job_id:
+                query += ' AND id = ?'
+                params.append(job_id)
+            query += ' ORDER BY created_at'
+
+            claimed = None
+            for row in conn.execute(query, params).fetchall():
+                if running_per_gallery.get(row['gallery_name'], 0) >= self.max_per_gallery:
+                    continue
+                if row['attempts'] >= self.max_attempts:
+                    conn.execute(
+                        'UPDATE jobs SET state = ?, error = ?, worker_id = NULL, updated_at = ? WHERE id = ?',
+                        (FAILED, f"Gave up after {row['attempts']} attempts", now, row['id'])
+                    )
+                    continue
+                claimed = row
+                break
+
+            if claimed is None:
+                conn.execute('COMMIT')
+                return None
+
+            conn.execute(
+                'UPDATE jobs SET state = ?, worker_id = ?, attempts = attempts + 1, lease_expires = ?, updated_at = ? WHERE id = ?',
+                (RUNNING, worker_id, now + self.lease_seconds, now, claimed['id'])
+            )
+            conn.execute('COMMIT')
+            return self.get(claimed['id'])
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        """
+        Extends the lease of a running job.
+
+        Returns:
+            bool: False if the job is no longer owned by this worker.
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                'UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE id = ? AND worker_id = ? AND state = ?',
+                (now + self.lease_seconds, now, job_id, worker_id, RUNNING)
+            )
+            return cursor.rowcount == 1
+
+    def update_progress(self, job_id: str, progress: float | None, detail: Dict[str, Any] | None = None):
+        """
+        Records job progress (0-100) and optional detail; also renews the lease.
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                'UPDATE jobs SET progress = ?, detail = COALESCE(?, detail), lease_expires = ?, updated_at = ? '
+                'WHERE id = ? AND state = ?',
+                (progress, json.dumps(detail) if detail is not None else None,
+                 now + self.lease_seconds, now, job_id, RUNNING)
+            )
+
+    def complete(self, job_id: str, result: Dict[str, Any] | None = None):
+        """Marks a job as successfully finished."""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                'UPDATE jobs SET state = ?, progress = 100, result = ?, worker_id = NULL, lease_expires = NULL, updated_at = ? WHERE id = ?',
+                (DONE, json.dumps(result) if result is not None else None, now, job_id)
+            )
+
+    def fail(self, job_id: str, error: str, retry: bool = False):
+        """
+        Marks a job as failed, or puts it back in the queue if `retry` is set
+        and it has attempts left.
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT attempts FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return
+            state = QUEUED if retry and row['attempts'] < self.max_attempts else FAILED
+            conn.execute(
+                'UPDATE jobs SET state = ?, progress = ?, error = ?, worker_id = NULL, lease_expires = NULL, updated_at = ? WHERE id = ?',
+                (state, None if state == QUEUED else -1, error, now, job_id)
+            )
+
+    def get(self, job_id: str) -> Dict[str, Any] | None:
+        """Returns a job by id, or None."""
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._row_to_job(row)
+
+    def latest_for_gallery(self, gallery_name: str, kind: str | None = None) -> Dict[str, Any] | None:
+        """Returns the most recently created job of a gallery, or None."""
+        query = 'SELECT * FROM jobs WHERE gallery_name = ?'
+        params = [gallery_name]
+        if kind:
+            query += ' AND kind = ?'
+            params.append(kind)
+        query += ' ORDER BY created_at DESC LIMIT 1'
+        with closing(self._connect()) as conn:
+            row = conn.execute(query, params).fetchone()
+        return self._row_to_job(row)
+
+    def list_jobs(self, gallery_name: str | None = None, limit: int = 50,
+                  finished_within: float | None = None) -> list[Dict[str, Any]]:
+        """
+        Lists jobs, newest first, optionally for a single gallery. With
+        `finished_within`, finished jobs are only listed if they finished in
+        the last that many seconds; live jobs are always listed.
+        """
+        conditions, params = [], []
+        if gallery_name:
+            conditions.append('gallery_name = ?')
+            params.append(gallery_name)
+        if finished_within is not None:
+            conditions.append('(state IN (?, ?) OR updated_at >= ?)')
+            params.extend([QUEUED, RUNNING, time.time() - finished_within])
+        query = 'SELECT * FROM jobs'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY created_at DESC LIMIT ?'
+        params.append(limit)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def prune(self, older_than_seconds: float) -> int:
+        """
+        Deletes finished jobs that have not changed for `older_than_seconds`.
+
+        Returns:
+            int: The number of deleted jobs.
+        """
+        cutoff = time.time() - older_than_seconds
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                'DELETE FROM jobs WHERE state IN (?, ?) AND updated_at < ?',
+                (DONE, FAILED, cutoff)
+            )
+            return cursor.rowcount
@@ -0,0 +1,242 @@
+import os
+import socket
+import time
+import threading
+import logging
+from typing import Dict, Any
+from .job_queue import JobQueue, RUNNING
+from . import node_stats
+from ..tracing import start_trace, span
+
+logger = logging.getLogger(__name__)
+
+# The one Socket.IO event carrying job state, sent to the job's gallery room
+JOB_EVENT = 'job_update'
+
+
+class JobService:
+    """
+    Runs queued jobs against a storage backend and a DataManager.
+
+    The same service is used by the web process (in 'inline' mode it drains the
+    queue in a background task) and by the standalone worker processes in
+    gallery_generator/worker.py.
+
+    Clients follow jobs through a single `job_update` event: the job as
+    returned by public_job(), pushed when it is queued, claimed, finished or
+    put back for a retry, and at most once per `progress_interval` seconds
+    while it runs. The same state is persisted in the queue first, so a client
+    that missed events can fetch it again.
+    """
+
+    def __init__(self, queue: JobQueue, storage, data_manager, socketio=None, worker_id: str | None = None,
+                 progress_interval: float = 1.0, history_seconds: float | None = None):
+        self.queue = queue
+        self.storage = storage
+        self.data_manager = data_manager
+        self.socketio = socketio
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.progress_interval = progress_interval
+        # Finished jobs older than this are pruned from the queue (None keeps them)
+        self.history_seconds = history_seconds
+        self.handlers = {
+            'upload': self._run_upload,
+            'ingest': self._run_ingest,
+        }
+
+    def drain(self, max_jobs: int | None = None) -> int:
+        """
+        Claims and runs jobs until none can be claimed (or `max_jobs` ran).
+
+        Returns:
+            int: The number of jobs that were run.
+        """
+        ran = 0
+        while max_jobs is None or ran < max_jobs:
+            job = self.queue.claim(self.worker_id)
+            if job is None:
+                break
+            self.publish(job)
+            self.run(job)
+            ran += 1
+        return ran
+
+    def sweep(self, interval: float, stop: threading.Event | None = None):
+        """
+        Drains the queue now and then every `interval` seconds until `stop` is
+        set. In 'inline' mode this resumes jobs that were queued, or whose
+        worker died, while no web worker was draining: otherwise they would
+        wait for the next upload.
+        """
+        stop = stop or threading.Event()
+        while True:
+            try:
+                self.drain()
+                self.prune_history()
+            except Exception as e:
+                logger.error(f"Job sweep failed: {e}")
+            if stop.wait(interval):
+                return
+
+    def prune_history(self) -> int:
+        """Deletes finished jobs older than `history_seconds`; returns how many."""
+        if self.history_seconds is None:
+            return 0
+        pruned = self.queue.prune(self.history_seconds)
+        if pruned:
+            logger.info(f"Pruned {pruned} finished jobs from the queue")
+        return pruned
+
+    def run(self, job: Dict[str, Any]) -> bool:
+        """
+        Runs a claimed job and records its outcome in the queue.
+
+        Returns:
+            bool: True if the job completed successfully.
+        """
+        handler = self.handlers.get(job['kind'])
+        if handler is None:
+            self.queue.fail(job['id'], f"Unknown job kind: {job['kind']}")
+            return False
+        # Keep the lease alive while the handler runs, so long jobs are not
+        # mistaken for crashed ones and handed to another worker.
+        stop_heartbeat = threading.Event()
+
+        def heartbeat():
+            while not stop_heartbeat.wait(self.queue.lease_seconds / 3):
+                if not self.queue.heartbeat(job['id'], self.worker_id):
+                    break
+
+        heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+        heartbeat_thread.start()
+        try:
+            with start_trace(f"job {job['kind']}", parent_id=job['payload'].get('trace_id'),
+                             job_id=job['id'], gallery=job['gallery_name']):
+                result = handler(job)
+        except Exception as e:
+            # Unexpected errors (e.g. storage outages) are retried until the
+            # attempt limit; handlers raise only for transient conditions.
+            logger.error(f"Job {job['id']} ({job['kind']}) failed: {e}")
+            self.queue.fail(job['id'], str(e), retry=True)
+            self.publish(job['id'])
+            return False
+        finally:
+            stop_heartbeat.set()
+        if result is None:
+            self.queue.fail(job['id'], 'Job handler reported failure')
+            self.publish(job['id'])
+            return False
+        self.queue.complete(job['id'], result)
+        self.publish(job['id'])
+        return True
+
+    @staticmethod
+    def public_job(job: Dict[str, Any]) -> Dict[str, Any]:
+        """A job as sent to clients, without its payload (which holds server-side paths)."""
+        return {key: value for key, value in job.items() if key not in ('payload', 'worker_id', 'lease_expires')}
+
+    def publish(self, job: Dict[str, Any] | str):
+        """Pushes the current state of a job (or job id) to its gallery's room."""
+        if not self.socketio:
+            return
+        if isinstance(job, str):
+            job = self.queue.get(job)
+            if job is None:
+                return
+        with span('emit'):
+            self.socketio.emit(JOB_EVENT, self.public_job(job), to=job['gallery_name'])
+
+    def _progress_recorder(self, job: Dict[str, Any]):
+        """
+        Returns a ProgressReporter callback that persists each (already
+        coalesced) snapshot to the queue and pushes it to clients.
+        """
+        def record(snapshot):
+            self.queue.update_progress(job['id'], snapshot['progress'], detail=snapshot)
+            self.publish({**job, 'state': RUNNING, 'progress': snapshot['progress'], 'detail': snapshot,
+                          'updated_at': time.time()})
+
+        return record
+
+    def _upload_service(self, job: Dict[str, Any]):
+        # Imported here so processes that never run uploads (e.g. web workers in 'worker'
+        # mode) do not load the image analysis stack (Pillow, numpy)
+        from .upload_service import UploadService
+        # Progress reaches clients only through job updates, so the service gets no socketio
+        return UploadService(self.storage, progress_callback=self._progress_recorder(job), job_id=job['id'],
+                             progress_interval=self.progress_interval)
+
+    def _run_upload(self, job: Dict[str, Any]) -> Dict[str, Any] | None:
+        gallery_name = job['gallery_name']
+        zip_path = job['payload']['zip_path']
+        if not os.path.exists(zip_path):
+            # The spool file is removed only after a successful merge, so a
+            # missing file means a previous attempt already finished the job.
+            logger.warning(f"Spooled upload {zip_path} for job {job['id']} no longer exists.")
+            return {'skipped': True}
+
+        upload_service = self._upload_service(job)
+        with open(zip_path, 'rb') as zip_file_stream:
+            new_gallery_data = upload_service.process_zip_file(zip_file_stream, gallery_name)
+
+        if not new_gallery_data:
+            logger.error(f"Failed to process zip file for gallery {gallery_name}")
+            os.remove(zip_path)
+            return None
+
+        final_gallery_data = self.data_manager.merge_gallery_data(new_gallery_data, gallery_name)
+        if final_gallery_data is None:
+            raise RuntimeError(f"Failed to save merged gallery data for {gallery_name}")
+
+        os.remove(zip_path)
+        if self.socketio:
+            with span('emit'):
+                self.socketio.emit('gallery_updated', {'message': 'Upload complete and gallery updated!'}, to=gallery_name)
+        return {'gallery_name': gallery_name}
+
+    def _run_ingest(self, job: Dict[str, Any]) -> Dict[str, Any] | None:
+        """
+        Ingests new and changed files from a directory tree on the server (see
+        IngestManifest). Files whose content changed replace their earlier
+        image in the gallery.
+        """
+        gallery_name = job['gallery_name']
+        source_dir = job['payload']['source_dir']
+        if not os.path.isdir(source_dir):
+            logger.error(f"Ingest source {source_dir} for job {job['id']} is not a directory.")
+            return None
+
+        from .ingest_manifest import IngestManifest
+        from .selection import Selection
+        upload_service = self._upload_service(job)
+        manifest = IngestManifest.load(self.storage, self.data_manager.codec, self.data_manager.base_dir,
+                                       gallery_name, source_dir)
+        with span('scan'):
+            changed, missing = manifest.scan(upload_service.allowed_extensions)
+        logger.info(f"Ingest of {source_dir} into {gallery_name}: {len(changed)} new or changed, "
+                    f"{len(missing)} missing, {len(manifest.files) - len(missing)} known")
+
+        new_gallery_data = upload_service.process_directory(manifest, changed, gallery_name)
+        if new_gallery_data is None:
+            logger.error(f"Failed to ingest {source_dir} into gallery {gallery_name}")
+            return None
+
+        ingested = node_stats.compute(new_gallery_data)['images']
+        if ingested:
+            if self.data_manager.merge_gallery_data(new_gallery_data, gallery_name) is None:
+                raise RuntimeError(f"Failed to save merged gallery data for {gallery_name}")
+        replaced = manifest.replaced_filenames()
+        if replaced:
+            # Earlier versions of changed files; their new versions were merged above
+            if self.data_manager.delete_by_selection(Selection(filenames=replaced), gallery_name) is None:
+                raise RuntimeError(f"Failed to remove replaced images from {gallery_name}")
+        manifest.forget(missing)
+        manifest.save()
+
+        if self.socketio and (ingested or replaced):
+            with span('emit'):
+                # Clients re-fetch the gallery themselves, so the (possibly large) tree is not sent
+                self.socketio.emit('gallery_updated', {'message': f'Ingest complete: {ingested} new images'},
+                                   to=gallery_name)
+        return {'gallery_name': gallery_name, 'ingested': ingested, 'replaced': len(replaced),
+                'unchanged': len(manifest.files) - ingested, 'missing': len(missing)}
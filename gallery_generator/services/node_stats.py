@@ -0,0 +1,118 @@
+"""
+Aggregates kept on every node of a gallery tree under the 'stats' key:
+
+    {"images": 120, "good": 30, "bad": 5, "neutral": 85, "bytes": 3145728,
+     "first_date": "2024-05-01", "last_date": "2024-05-03"}
+
+covering the node's own images and everything below it, so questions like
+"does this folder contain any good image" are answered without walking the
+subtree. Writers keep them current by refreshing only the folders they
+changed and their ancestors (refresh_paths); trees saved before the
+aggregates existed get them computed once on load (ensure).
+"""
+from typing import Dict, Any, Iterable
+
+KEY = 'stats'
+STATUSES = ('good', 'bad', 'neutral')
+
+
+def empty() -> Dict[str, Any]:
+    return {'images': 0, 'good': 0, 'bad': 0, 'neutral': 0, 'bytes': 0, 'first_date': None, 'last_date': None}
+
+
+def combine(stats: Dict[str, Any], other: Dict[str, Any]) -> Dict[str, Any]:
+    """Adds `other` into `stats` in place and returns `stats`."""
+    for key in ('images', 'bytes') + STATUSES:
+        stats[key] += other.get(key, 0)
+    if other.get('first_date') and (stats['first_date'] is None or other['first_date'] < stats['first_date']):
+        stats['first_date'] = other['first_date']
+    if other.get('last_date') and (stats['last_date'] is None or other['last_date'] > stats['last_date']):
+        stats['last_date'] = other['last_date']
+    return stats
+
+
+def of_images(images: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Aggregates of a list of images alone."""
+    stats = empty()
+    for image in images:
+        stats['images'] += 1
+        stats['bytes'] += image.get('size') or 0
+        status = image.get('status', 'neutral')
+        if status in STATUSES:
+            stats[status] += 1
+        date = image.get('modification_date')
+        if date:
+            if stats['first_date'] is None or date < stats['first_date']:
+                stats['first_date'] = date
+            if stats['last_date'] is None or date > stats['last_date']:
+                stats['last_date'] = date
+    return stats
+
+
+def _update(node: Dict[str, Any], own: Dict[str, Any]) -> Dict[str, Any]:
+    for child in node.get('children', []):
+        combine(own, child[KEY] if KEY in child else compute(child))
+    node[KEY] = own
+    return own
+
+
+def refresh(node: Dict[str, Any]) -> Dict[str, Any]:
+    """Recomputes the aggregates of `node` from its own images and its children's aggregates."""
+    return _update(node, of_images(node.get('images', [])))
+
+
+def compute(node: Dict[str, Any], own_stats=None) -> Dict[str, Any]:
+    """
+    Computes the aggregates of `node` and every node below it from scratch.
+    `own_stats(node)`, if given, returns the aggregates of a node's own images
+    instead of reading its 'images'.
+    """
+    order, stack = [], [node]
+    while stack:
+        current = stack.pop()
+        order.append(current)
+        stack.extend(current.get('children', []))
+    for current in reversed(order): # Children before their parents
+        own = own_stats(current) if own_stats else of_images(current.get('images', []))
+        # Children were just computed, so this only sums them
+        _update(current, own)
+    return node[KEY]
+
+
+def ensure(node: Dict[str, Any]) -> Dict[str, Any]:
+    """The aggregates of `node`, computed first if it has none (trees saved before they existed)."""
+    if not node:
+        return empty()
+    return node[KEY] if KEY in node else compute(node)
+
+
+def _find(node: Dict[str, Any], path: tuple) -> Dict[str, Any] | None:
+    for name in path:
+        node = next((child for child in node.get('children', []) if child.get('name') == name), None)
+        if node is None:
+            return None
+    return node
+
+
+def refresh_paths(node: Dict[str, Any], paths: Iterable[tuple]):
+    """
+    Refreshes the folders at `paths` (tuples of folder names below `node`),
+    their ancestors and `node` itself, deepest first, after their images changed.
+    Costs the size of those folders' own image lists, not of the tree.
+    """
+    prefixes = {()}
+    for path in paths:
+        prefixes.update(tuple(path[:depth]) for depth in range(1, len(path) + 1))
+    for path in sorted(prefixes, key=len, reverse=True):
+        folder = _find(node, path)
+        if folder is not None:
+            refresh(folder)
+
+
+def outline(node: Dict[str, Any]) -> Dict[str, Any]:
+    """The folder tree below `node` with names and aggregates only (no images or comments)."""
+    return {
+        'name': node.get('name'),
+        KEY: ensure(node),
+        'children': [outline(child) for child in node.get('children', [])]
+    }
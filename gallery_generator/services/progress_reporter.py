@@ -0,0 +1,126 @@
+import threading
+import time
+from typing import Dict, Any, Callable
+
+
+class ProgressReporter:
+    """
+    Coalesces progress updates of a long-running operation (upload, delete,
+    report build) into a bounded number of Socket.IO events.
+
+    An update is emitted only when at least `min_interval` seconds have passed
+    and progress moved by at least `min_step` percent since the last one, plus
+    once at the start and once at the end. Events go to the gallery's room
+    (see socket_events.py) and are emitted outside the internal lock, so
+    worker threads calling advance() never wait on the network.
+    """
+
+    def __init__(self, operation: str, gallery_name: str, total: int = 0, total_bytes: int = 0,
+                 socketio=None, event: str | None = None, job_id: str | None = None,
+                 callback: Callable[[Dict[str, Any]], None] | None = None,
+                 min_interval: float = 0.5, min_step: float = 1.0):
+        """
+        Args:
+            operation (str): What is being tracked, e.g. 'upload'.
+            gallery_name (str): The gallery, also used as the Socket.IO room.
+            total (int): Number of work items.
+            total_bytes (int): Expected number of bytes, if known.
+            socketio: Optional SocketIO instance to emit through.
+            event (str): Event name; defaults to '<operation>_progress'.
+            job_id (str): Optional job id included in every update.
+            callback (callable): Optional function receiving every emitted snapshot.
+            min_interval (float): Minimum seconds between two updates.
+            min_step (float): Minimum progress change (percent) between two updates.
+        """
+        self.operation = operation
+        self.gallery_name = gallery_name
+        self.total = total
+        self.total_bytes = total_bytes
+        self.socketio = socketio
+        self.event = event or f"{operation}_progress"
+        self.job_id = job_id
+        self.callback = callback
+        self.min_interval = min_interval
+        self.min_step = min_step
+
+        self.processed = 0
+        self.processed_bytes = 0
+        self.state = 'pending'
+        self._lock = threading.Lock()
+        self._started_at = None
+        self._last_emit_at = 0.0
+        self._last_emit_progress = None
+
+    def _progress(self) -> float | None:
+        if self.state == 'failed':
+            return -1
+        if self.state == 'done':
+            return 100
+        if self.state == 'pending':
+            return None
+        return (self.processed / self.total) * 100 if self.total else 0
+
+    def _snapshot(self, now: float) -> Dict[str, Any]:
+        elapsed = now - self._started_at if self._started_at else 0
+        rate = self.processed / elapsed if elapsed > 0 else 0
+        remaining = self.total - self.processed
+        return {
+            'operation': self.operation,
+            'gallery_name': self.gallery_name,
+            'job_id': self.job_id,
+            'state': self.state,
+            'progress': self._progress(),
+            'processed': self.processed,
+            'total': self.total,
+            'bytes': self.processed_bytes,
+            'total_bytes': self.total_bytes,
+            'elapsed_seconds': round(elapsed, 3),
+            'bytes_per_second': round(self.processed_bytes / elapsed) if elapsed > 0 else 0,
+            'eta_seconds': round(remaining / rate, 1) if rate > 0 and self.state == 'running' else None
+        }
+
+    def _publish(self, snapshot: Dict[str, Any]):
+        if self.callback:
+            self.callback(snapshot)
+        if self.socketio:
+            self.socketio.emit(self.event, snapshot, to=self.gallery_name)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns the current state without emitting it."""
+        with self._lock:
+            return self._snapshot(time.monotonic())
+
+    def start(self, total: int | None = None, total_bytes: int | None = None):
+        """Marks the operation as running and emits the initial update."""
+        with self._lock:
+            if total is not None:
+                self.total = total
+            if total_bytes is not None:
+                self.total_bytes = total_bytes
+            self.state = 'running'
+            self._started_at = self._last_emit_at = time.monotonic()
+            self._last_emit_progress = 0
+            snapshot = self._snapshot(self._started_at)
+        self._publish(snapshot)
+
+    def advance(self, count: int = 1, nbytes: int = 0):
+        """Records finished work items; emits only if the coalescing thresholds are met."""
+        with self._lock:
+            self.processed += count
+            self.processed_bytes += nbytes
+            now = time.monotonic()
+            progress = self._progress()
+            if (now - self._last_emit_at < self.min_interval
+                    or progress - (self._last_emit_progress or 0) < self.min_step):
+                return
+            self._last_emit_at = now
+            self._last_emit_progress = progress
+            snapshot = self._snapshot(now)
+        self._publish(snapshot)
+
+    def finish(self, success: bool = True):
+        """Emits the final update (progress 100, or -1 on failure)."""
+        with self._lock:
+            self.state = 'done' if success else 'failed'
+            snapshot = self._snapshot(time.monotonic())
+        self._publish(snapshot)
@@ -1,12 +1,22 @@
 import os
 from flask import render_template_string
 import re # Import re
+from ..tracing import traced
+from . import node_stats
+
+# Statuses each report mode includes
+REPORT_STATUSES = {'good_only': ('good',), 'good_and_neutral': ('good', 'neutral')}
 
 class ReportService:
     def __init__(self, config):
         self.config = config
 
     def filter_report_data(self, node, report_mode):
+        # Subtrees whose aggregates show no reportable image are dropped without walking them
+        stats = node.get(node_stats.KEY)
+        if stats is not None and not any(stats.get(status) for status in REPORT_STATUSES.get(report_mode, ('good',))):
+            return None
+
         # Filter this node's direct images
         if report_mode == 'good_only':
             filtered_images = [img for img in node.get('images', []) if img.get('status') == 'good']
@@ -35,10 +45,18 @@ class ReportService:
         # If a node has no direct 'good' images and no children after filtering, discard it
         return None
 
-    def generate_html_report(self, gallery_data, gallery_name, base_url, report_mode):
+    def _count_sections(self, node):
+        # Number of headings a report renders, i.e. nodes with direct images
+        count = 1 if node.get('name') != 'root' and node.get('images') else 0
+        return count + sum(self._count_sections(child) for child in node.get('children', []))
+
+    @traced('report_html')
+    def generate_html_report(self, gallery_data, gallery_name, base_url, report_mode, progress=None):
         gallery_data = self.filter_report_data(gallery_data, report_mode)
         if not gallery_data:
             return "<h1>No good images to report.</h1>"
+        if progress:
+            progress.start(total=self._count_sections(gallery_data))
         
         # List to store TOC entries
         toc_entries = []
@@ -88,6 +106,8 @@ class ReportService:
                 html += "</div>" # Close image-grid
                 html += "</div>" # Close gallery-section
                 html += "<hr>\n" # Add horizontal rule after each section
+                if progress:
+                    progress.advance()
 
             # Recursively render children, always passing the updated path
             if node.get('children'):
@@ -115,6 +135,9 @@ class ReportService:
             toc_html += "</ul>\n"
 
 
+        if progress:
+            progress.finish()
+
         html_template = f"""
         <!DOCTYPE html>
         <html lang="en">
@@ -182,10 +205,13 @@ class ReportService:
         return render_template_string(html_template)
 
 
-    def generate_markdown_report(self, gallery_data, gallery_name, base_url, report_mode):
+    @traced('report_markdown')
+    def generate_markdown_report(self, gallery_data, gallery_name, base_url, report_mode, progress=None):
         gallery_data = self.filter_report_data(gallery_data, report_mode)
         if not gallery_data:
             return "# No good images to report."
+        if progress:
+            progress.start(total=self._count_sections(gallery_data))
         
         def render_node_md(node, level=1, current_path_parts=None):
             if current_path_parts is None:
@@ -221,6 +247,8 @@ class ReportService:
                         md += f"  <div style='text-align: center;'><img src='{image_path}' alt='{image.get('filename')}' style='width: 100%; height: auto;'></div>\n"
                     md += "</div>\n\n"
                 md += "---\n\n" # Add Markdown horizontal rule after each section
+                if progress:
+                    progress.advance()
 
             if node.get('children'):
                 for child in node['children']:
@@ -237,5 +265,7 @@ class ReportService:
         # Use a regex for more robust removal of trailing horizontal rules
         markdown_content = re.sub(r'---\n\n$', '', markdown_content) # Remove "---" followed by two newlines at the end
         markdown_content = markdown_content.rstrip() # Remove any remaining trailing whitespace
+        if progress:
+            progress.finish()
 
         return markdown_content
\ No newline at end of file
@@ -0,0 +1,342 @@
+import os
+import re
+import json
+import bisect
+import heapq
+import threading
+import logging
+from typing import Dict, Any, Callable
+from gallery_generator.storage.storage import Storage
+
+logger = logging.getLogger(__name__)
+
+INDEX_FORMAT = 1
+
+# Token weights per field: a folder's own name ranks above its ancestors' names and its comment
+FOLDER_NAME_WEIGHT = 3
+FOLDER_PARENT_WEIGHT = 1
+COMMENT_WEIGHT = 1
+IMAGE_NAME_WEIGHT = 2
+# A query token that is only a prefix of an indexed token counts this fraction of its weight
+PREFIX_FACTOR = 0.5
+# Short prefixes can match a large part of the vocabulary; only this many tokens are expanded
+MAX_PREFIX_EXPANSIONS = 256
+
+_TOKEN = re.compile(r'[^\W_]+')
+# The '_<md5>' UploadService appends to stored file names
+_UPLOAD_HASH = re.compile(r'_[0-9a-f]{32}$')
+
+
+def tokenize(text: str | None) -> list[str]:
+    """Lowercased alphanumeric runs of `text`; '_', punctuation and spaces separate tokens."""
+    return _TOKEN.findall(text.casefold()) if text else []
+
+
+def original_name(filename: str) -> str:
+    """The uploaded file name of a stored image, i.e. without the '_<hash>' the upload adds."""
+    stem, ext = os.path.splitext(filename)
+    return _UPLOAD_HASH.sub('', stem) + ext
+
+
+def _folder_key(path: str) -> str:
+    return f"f:{path}"
+
+
+def _image_key(path: str, filename: str) -> str:
+    return f"i:{path}/{filename}"
+
+
+class SearchIndex:
+    """
+    An inverted index over one gallery's folders (path segments and comment)
+    and images (original file name), for token and prefix search.
+
+    `version` is the gallery data version the index reflects; the store
+    rebuilds an index whose version does not match the gallery's.
+    `base_version` is the version its persisted content was written at.
+    """
+
+    def __init__(self, version: str | None = None):
+        self.version = version
+        self.base_version = version
+        self.docs = {} # doc id -> {'kind', 'path', 'name', 'filename'?, 'comment'?}
+        self.keys = {} # folder/image key -> doc id
+        self.postings = {} # token -> {doc id: weight}
+        self.tokens = [] # sorted keys of postings, for prefix lookups
+        self.next_id = 0
+
+    # -- Documents ---------------------------------------------------------
+
+    @staticmethod
+    def _weights(doc: Dict[str, Any]) -> Dict[str, float]:
+        weights = {}
+
+        def add(tokens, weight):
+            for token in tokens:
+                weights[token] = weights.get(token, 0) + weight
+        if doc['kind'] == 'folder':
+            segments = doc['path'].split('/')
+            add(tokenize(segments[-1]), FOLDER_NAME_WEIGHT)
+            add(tokenize(' '.join(segments[:-1])), FOLDER_PARENT_WEIGHT)
+            add(tokenize(doc.get('comment')), COMMENT_WEIGHT)
+        else:
+            add(tokenize(os.path.splitext(doc['name'])[0]), IMAGE_NAME_WEIGHT)
+        return weights
+
+    def _add(self, key: str, doc: Dict[str, Any]):
+        self._remove(key)
+        doc_id = self.next_id
+        self.next_id += 1
+        self.keys[key] = doc_id
+        self.docs[doc_id] = doc
+        for token, weight in self._weights(doc).items():
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = {}
+                bisect.insort(self.tokens, token)
+            posting[doc_id] = weight
+
+    def _remove(self, key: str):
+        doc_id = self.keys.pop(key, None)
+        if doc_id is None:
+            return
+        doc = self.docs.pop(doc_id)
+        for token in self._weights(doc):
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            posting.pop(doc_id, None)
+            if not posting:
+                del self.postings[token]
+                del self.tokens[bisect.bisect_left(self.tokens, token)]
+
+    def set_folder(self, path: str, comment: str = ''):
+        """Indexes (or re-indexes) the folder at `path` ('/'-separated names below the root)."""
+        if path:
+            self._add(_folder_key(path), {'kind': 'folder', 'path': path, 'name': path.split('/')[-1],
+                                          'comment': comment or ''})
+
+    def add_image(self, path: str, filename: str):
+        self._add(_image_key(path, filename), {'kind': 'image', 'path': path, 'name': original_name(filename),
+                                               'filename': filename})
+
+    def remove_folder(self, path: str):
+        self._remove(_folder_key(path))
+
+    def remove_image(self, path: str, filename: str):
+        self._remove(_image_key(path, filename))
+
+    def remove(self, images: list[tuple[tuple, str]], folders: list[tuple] = ()):
+        """Removes images given as (folder path, filename) and folders, with paths as tuples of names."""
+        for path, filename in images:
+            self.remove_image('/'.join(path), filename)
+        for path in folders:
+            self.remove_folder('/'.join(path))
+
+    def add_tree(self, node: Dict[str, Any], path: str = '', keep_comments: bool = True):
+        """
+        Indexes every folder and image below `node`, whose path is `path`.
+        With `keep_comments`, folders already in the index keep their indexed
+        comment (merging an upload never changes existing comments).
+        """
+        stack = [(node, path)]
+        while stack:
+            current, current_path = stack.pop()
+            if current_path and not (keep_comments and _folder_key(current_path) in self.keys):
+                self.set_folder(current_path, current.get('comment'))
+            for image in current.get('images', []):
+                if _image_key(current_path, image['filename']) not in self.keys:
+                    self.add_image(current_path, image['filename'])
+            for child in current.get('children', []):
+                child_path = f"{current_path}/{child.get('name', '')}" if current_path else child.get('name', '')
+                stack.append((child, child_path))
+
+    @classmethod
+    def build(cls, data: Dict[str, Any], version: str | None) -> 'SearchIndex':
+        index = cls(version)
+        if data:
+            index.add_tree(data, keep_comments=False)
+        return index
+
+    # -- Queries -----------------------------------------------------------
+
+    def _matches(self, token: str) -> Dict[int, float]:
+        """Doc id -> score for one query token: exact matches in full, prefix matches discounted."""
+        scores = dict(self.postings.get(token, {}))
+        start = bisect.bisect_right(self.tokens, token) # The exact token itself sorts first
+        for candidate in self.tokens[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not candidate.startswith(token):
+                break
+            for doc_id, weight in self.postings[candidate].items():
+                score = weight * PREFIX_FACTOR
+                if score > scores.get(doc_id, 0):
+                    scores[doc_id] = score
+        return scores
+
+    def search(self, query: str, limit: int = 20, kind: str | None = None) -> Dict[str, Any]:
+        """
+        Finds the documents matching every token of `query`, each token
+        matching exactly or as a prefix (so the last, partly typed word of a
+        query works too), ranked by summed weights.
+
+        Args:
+            query (str): Free text.
+            limit (int): Maximum number of results.
+            kind (str): 'folder' or 'image' to return only that kind.
+
+        Returns:
+            dict: 'total' (number of matches) and 'results' (best first), each
+            with 'kind', 'path', 'name', 'score' and, for images, 'filename'.
+        """
+        query_tokens = list(dict.fromkeys(tokenize(query)))
+        if not query_tokens:
+            return {'total': 0, 'results': []}
+        # Start from the most selective token, so the intersection stays small
+        per_token = sorted((self._matches(token) for token in query_tokens), key=len)
+        scores = per_token[0]
+        for matches in per_token[1:]:
+            scores = {doc_id: score + matches[doc_id] for doc_id, score in scores.items() if doc_id in matches}
+            if not scores:
+                break
+        if kind is not None:
+            scores = {doc_id: score for doc_id, score in scores.items() if self.docs[doc_id]['kind'] == kind}
+        # Folders before images on equal scores, then by path
+        best = heapq.nsmallest(limit, scores.items(), key=lambda item: (
+            -item[1], self.docs[item[0]]['kind'] != 'folder', self.docs[item[0]]['path'], self.docs[item[0]]['name']))
+        return {
+            'total': len(scores),
+            'results': [{**self.docs[doc_id], 'score': score} for doc_id, score in best]
+        }
+
+    # -- Persistence -------------------------------------------------------
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'index_format': INDEX_FORMAT,
+            'version': self.version,
+            'next_id': self.next_id,
+            'docs': [[doc_id, doc] for doc_id, doc in self.docs.items()],
+            # Flat [id, weight, id, weight, ...] lists keep the file compact
+            'postings': {token: [value for item in posting.items() for value in item]
+                         for token, posting in self.postings.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'SearchIndex':
+        if data.get('index_format') != INDEX_FORMAT:
+            raise ValueError(f"Unsupported search index format: {data.get('index_format')}")
+        index = cls(data['version'])
+        index.next_id = data['next_id']
+        index.docs = {doc_id: doc for doc_id, doc in data['docs']}
+        for doc_id, doc in index.docs.items():
+            key = _folder_key(doc['path']) if doc['kind'] == 'folder' else _image_key(doc['path'], doc['filename'])
+            index.keys[key] = doc_id
+        index.postings = {token: dict(zip(flat[::2], flat[1::2])) for token, flat in data['postings'].items()}
+        index.tokens = sorted(index.postings)
+        return index
+
+
+class SearchIndexStore:
+    """
+    The search indexes of all galleries, persisted next to the gallery data
+    and kept in memory once loaded, so a restart neither rebuilds them nor
+    walks the gallery tree:
+
+        <gallery>/search_index.json      the index as of the version it records
+        <gallery>/search_index.version   {"base": <that version>, "version": <current>}
+
+    Writers that know what they changed apply it to the index through
+    `update`. Changes that do not affect the index (status updates) only
+    rewrite the small version file. Any other change (a revert, a write by
+    another process) leaves the index at an older version, and `search`
+    rebuilds it on the next search. Searches and updates are serialized, as
+    updates modify the index in place.
+    """
+
+    def __init__(self, storage: Storage, base_dir: str, codec: Any):
+        self.storage = storage
+        self.base_dir = base_dir
+        self.codec = codec
+        self._indexes = {} # gallery -> SearchIndex
+        self._lock = threading.Lock()
+
+    def _path(self, gallery_name: str) -> str:
+        return os.path.join(self.base_dir, gallery_name, 'search_index.json')
+
+    def _version_path(self, gallery_name: str) -> str:
+        return os.path.join(self.base_dir, gallery_name, 'search_index.version')
+
+    def _read_versions(self, gallery_name: str) -> Dict[str, Any] | None:
+        try:
+            return json.loads(self.storage.load(self._version_path(gallery_name)))
+        except Exception:
+            return None
+
+    def _get(self, gallery_name: str) -> SearchIndex | None:
+        """The index as persisted (possibly by another process), reusing the one in memory when it is the same."""
+        versions = self._read_versions(gallery_name)
+        index = self._indexes.get(gallery_name)
+        if index is not None and versions is not None and versions['base'] == index.base_version:
+            index.version = versions['version'] # Only the version moved on
+            return index
+        path = self._path(gallery_name)
+        try:
+            if not self.storage.exists(path):
+                return None
+            index = SearchIndex.from_dict(self.codec.decode(self.storage.load(path)))
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable search index {path}: {e}")
+            return None
+        if versions is not None and versions['base'] == index.base_version:
+            index.version = versions['version']
+        self._indexes[gallery_name] = index
+        return index
+
+    def _save(self, gallery_name: str, index: SearchIndex, content_changed: bool = True):
+        try:
+            if content_changed:
+                index.base_version = index.version
+                self.storage.save(self._path(gallery_name), self.codec.encode(index.to_dict()))
+            self.storage.save(self._version_path(gallery_name),
+                              json.dumps({'base': index.base_version, 'version': index.version}).encode('utf-8'))
+        except Exception as e:
+            # The next search finds the persisted index stale and rebuilds it
+            logger.error(f"Error saving search index of {gallery_name}: {e}")
+
+    def search(self, gallery_name: str, version: str, load_data: Callable[[], Dict[str, Any]], query: str,
+               limit: int = 20, kind: str | None = None) -> Dict[str, Any]:
+        """
+        Searches the index of a gallery at `version` (see SearchIndex.search),
+        first rebuilding it from `load_data()` if no index is up to date.
+        """
+        with self._lock:
+            index = self._indexes.get(gallery_name)
+            if index is None or index.version != version:
+                index = self._get(gallery_name)
+            if index is None or index.version != version:
+                logger.info(f"Rebuilding search index of {gallery_name}")
+                index = self._indexes[gallery_name] = SearchIndex.build(load_data(), version)
+                self._save(gallery_name, index)
+            return index.search(query, limit, kind)
+
+    def update(self, gallery_name: str, before: str | None, after: str | None,
+               apply: Callable[[SearchIndex], None] | None = None):
+        """
+        Applies a change a writer made to the gallery, taking it from version
+        `before` to `after`, to the index if the index reflected `before`;
+        `apply(index)` makes the change, or is None if the index content is
+        unaffected. Otherwise the index is already stale and is rebuilt on the
+        next search.
+        """
+        if before is None or after is None or before == after:
+            return
+        with self._lock:
+            index = self._indexes.get(gallery_name)
+            if index is None or index.version != before:
+                index = self._get(gallery_name)
+            if index is None or index.version != before:
+                return
+            if apply is not None:
+                apply(index)
+            index.version = after
+            self._save(gallery_name, index, content_changed=apply is not None)
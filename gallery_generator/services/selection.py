@@ -0,0 +1,90 @@
+from typing import Dict, Any, Iterator
+
+STATUSES = ('good', 'bad', 'neutral')
+
+
+class Selection:
+    """
+    A set of images described by an expression instead of by enumeration, so
+    a client selecting whole folders sends a few paths rather than every
+    filename, and the server resolves it in one pass over the affected
+    subtrees.
+
+    An image is selected if it is in one of `folders` (directly, or anywhere
+    below with `recursive`) or its filename is in `filenames`, and it passes
+    the `status` and `date` filters and is not in `exclude`. Folder paths are
+    '/'-separated folder names below the root; '' is the root itself.
+    """
+
+    def __init__(self, folders=(), filenames=(), recursive: bool = True, status: str | None = None,
+                 date: str | None = None, exclude=()):
+        self.folders = {tuple(part for part in folder.strip('/').split('/') if part) for folder in folders}
+        self.filenames = set(filenames)
+        self.recursive = recursive
+        self.status = status
+        self.date = date
+        self.exclude = set(exclude)
+
+    @classmethod
+    def from_json(cls, data: Any) -> 'Selection':
+        """
+        Builds a Selection from a request body's "selection" object.
+
+        Raises:
+            ValueError: If the expression is malformed or selects nothing by construction.
+        """
+        if not isinstance(data, dict):
+            raise ValueError('selection must be an object')
+        folders = data.get('folders') or []
+        filenames = data.get('filenames') or []
+        exclude = data.get('exclude') or []
+        for name, value in (('folders', folders), ('filenames', filenames), ('exclude', exclude)):
+            if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+                raise ValueError(f'selection.{name} must be a list of strings')
+        if not folders and not filenames:
+            # An empty expression must not silently mean "everything"; select the root folder for that
+            raise ValueError('selection needs folders or filenames')
+        status = data.get('status')
+        if status is not None and status not in STATUSES:
+            raise ValueError(f"selection.status must be one of {', '.join(STATUSES)}")
+        date = data.get('date')
+        if date is not None and not isinstance(date, str):
+            raise ValueError('selection.date must be a string')
+        return cls(folders, filenames, recursive=bool(data.get('recursive', True)), status=status,
+                   date=date, exclude=exclude)
+
+    def accepts(self, image: Dict[str, Any]) -> bool:
+        """Whether an image in scope passes the filters."""
+        if self.status is not None and image.get('status', 'neutral') != self.status:
+            return False
+        if self.date is not None and image.get('modification_date') != self.date:
+            return False
+        return image.get('filename') not in self.exclude
+
+    def _in_scope(self, path: tuple) -> bool:
+        if path in self.folders:
+            return True
+        return self.recursive and any(path[:len(folder)] == folder for folder in self.folders)
+
+    def _may_contain(self, path: tuple) -> bool:
+        # Whether a folder, or something below it, can hold selected images
+        return bool(self.filenames) or self._in_scope(path) or any(folder[:len(path)] == path for folder in self.folders)
+
+    def iter_matches(self, node: Dict[str, Any], path: tuple = ()) -> Iterator[tuple[Dict[str, Any], Dict[str, Any], tuple]]:
+        """
+        Yields (folder node, image, folder path) for every selected image below
+        `node`, whose own path is `path`. Subtrees that cannot contain
+        selected images are skipped.
+        """
+        stack = [(node, path)]
+        while stack:
+            current, current_path = stack.pop()
+            in_scope = self._in_scope(current_path)
+            if in_scope or self.filenames:
+                for image in current.get('images', []):
+                    if (in_scope or image.get('filename') in self.filenames) and self.accepts(image):
+                        yield current, image, current_path
+            for child in reversed(current.get('children', [])):
+                child_path = current_path + (child.get('name', ''),)
+                if self._may_contain(child_path):
+                    stack.append((child, child_path))
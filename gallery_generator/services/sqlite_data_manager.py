@@ -0,0 +1,563 @@
+import json
+import os
+import sqlite3
+import time
+import uuid
+import logging
+from contextlib import closing
+from datetime import datetime
+from typing import Dict, Any
+import pytz
+from gallery_generator.storage.storage import Storage
+from gallery_generator.services.data_manager import DataManager
+from gallery_generator.services.selection import Selection
+from gallery_generator.services import node_stats
+from gallery_generator.tracing import span
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS galleries (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0,
+    last_backup_at REAL NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    id INTEGER PRIMARY KEY,
+    gallery TEXT NOT NULL,
+    parent_id INTEGER,
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    comment TEXT NOT NULL DEFAULT '',
+    position INTEGER NOT NULL,
+    extra TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_nodes_path ON nodes (gallery, path);
+CREATE INDEX IF NOT EXISTS idx_nodes_parent ON nodes (parent_id, position);
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    gallery TEXT NOT NULL,
+    node_id INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    modification_date TEXT,
+    status TEXT NOT NULL DEFAULT 'neutral',
+    position INTEGER NOT NULL,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_images_node ON images (node_id, position);
+CREATE INDEX IF NOT EXISTS idx_images_filename ON images (gallery, filename);
+CREATE INDEX IF NOT EXISTS idx_images_date ON images (gallery, modification_date);
+CREATE INDEX IF NOT EXISTS idx_images_status ON images (gallery, status);
+"""
+
+# Node and image keys that have their own columns; any other keys round-trip through `extra`.
+# Aggregates are not stored: they are derived from the images table.
+_NODE_KEYS = ('name', 'comment', 'images', 'children', node_stats.KEY)
+_IMAGE_KEYS = ('filename', 'modification_date', 'status')
+
+# SQLite limits the number of bound parameters per statement
+_IN_CHUNK = 500
+
+
+class SqliteDataManager(DataManager):
+    """
+    A DataManager that keeps gallery metadata in a local SQLite database (WAL
+    mode) instead of one JSON document per gallery.
+
+    Status and comment changes are single-row transactional updates, and
+    uploads are merged in one transaction, so concurrent writers no longer
+    overwrite each other's changes. The tree is exported in the same JSON shape
+    as before, so routes and the frontend are unaffected. Each gallery has a
+    version counter that is bumped by every write. Its ETag combines the
+    counter with an epoch chosen when the database is created, so a recreated
+    database does not reuse the ETags of the old one.
+
+    Backups are still JSON documents in storage (so version history and revert
+    work as before), but they are taken at most once per `backup_interval`
+    seconds instead of on every write. Galleries that only exist as
+    gallery_data.json are imported on first access.
+    """
+
+    def __init__(self, base_dir: str, config_manager: Any, storage: Storage, db_path: str,
+                 backup_interval: float = 60):
+        """
+        Args:
+            base_dir (str): Base directory of the gallery files in storage.
+            config_manager: The ConfigManager (may be None).
+            storage (Storage): Storage holding images, backups and legacy JSON files.
+            db_path (str): Path of the SQLite database file.
+            backup_interval (float): Minimum number of seconds between two backups of a gallery.
+        """
+        super().__init__(base_dir, config_manager, storage)
+        self.db_path = db_path
+        self.backup_interval = backup_interval
+        self._imported = set() # Galleries known to be in the database
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('epoch', ?)", (uuid.uuid4().hex[:12],))
+            self._epoch = conn.execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()['value']
+
+    def _connect(self) -> sqlite3.Connection:
+        # Same pattern as JobQueue: a short-lived connection per operation, explicit transactions
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    # -- Import / export -------------------------------------------------
+
+    @staticmethod
+    def _extra(item: Dict[str, Any], known: tuple) -> str | None:
+        extra = {key: value for key, value in item.items() if key not in known}
+        return json.dumps(extra, ensure_ascii=False) if extra else None
+
+    def _insert_images(self, conn, gallery_name: str, node_id: int, images: list, start: int = 0):
+        conn.executemany(
+            'INSERT INTO images (gallery, node_id, filename, modification_date, status, position, extra) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(gallery_name, node_id, image.get('filename'), image.get('modification_date'),
+              image.get('status', 'neutral'), start + index, self._extra(image, _IMAGE_KEYS))
+             for index, image in enumerate(images)]
+        )
+
+    def _insert_node(self, conn, gallery_name: str, node: Dict[str, Any], parent_id: int | None,
+                     path: str, position: int) -> int:
+        cursor = conn.execute(
+            'INSERT INTO nodes (gallery, parent_id, path, name, comment, position, extra) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (gallery_name, parent_id, path, node.get('name', ''), node.get('comment') or '', position,
+             self._extra(node, _NODE_KEYS))
+        )
+        return cursor.lastrowid
+
+    def _import_tree(self, conn, gallery_name: str, data: Dict[str, Any]):
+        stack = [(data, None, '', 0)]
+        while stack:
+            node, parent_id, path, position = stack.pop()
+            node_id = self._insert_node(conn, gallery_name, node, parent_id, path, position)
+            self._insert_images(conn, gallery_name, node_id, node.get('images', []))
+            for index, child in enumerate(node.get('children', [])):
+                child_path = f"{path}/{child.get('name', '')}" if path else child.get('name', '')
+                stack.append((child, node_id, child_path, index))
+
+    def _export_tree(self, conn, gallery_name: str) -> Dict[str, Any]:
+        nodes = {}
+        children = {}
+        root = None
+        for row in conn.execute('SELECT * FROM nodes WHERE gallery = ? ORDER BY parent_id, position', (gallery_name,)):
+            node = {'name': row['name'], 'images': [], 'comment': row['comment'], 'children': []}
+            if row['extra']:
+                node.update(json.loads(row['extra']))
+            nodes[row['id']] = node
+            if row['parent_id'] is None:
+                root = node
+            else:
+                children.setdefault(row['parent_id'], []).append(node)
+        if root is None:
+            return {}
+        for parent_id, child_nodes in children.items():
+            nodes[parent_id]['children'] = child_nodes
+        for row in conn.execute('SELECT * FROM images WHERE gallery = ? ORDER BY node_id, position', (gallery_name,)):
+            image = {'filename': row['filename']}
+            if row['modification_date'] is not None:
+                image['modification_date'] = row['modification_date']
+            image['status'] = row['status']
+            if row['extra']:
+                image.update(json.loads(row['extra']))
+            nodes[row['node_id']]['images'].append(image)
+        node_stats.compute(root)
+        return root
+
+    def _export_outline(self, conn, gallery_name: str) -> Dict[str, Any] | None:
+        """The folder tree with aggregates, from one grouped query over the images instead of their rows."""
+        nodes = {}
+        children = {}
+        root = None
+        for row in conn.execute('SELECT id, parent_id, name FROM nodes WHERE gallery = ? ORDER BY parent_id, position',
+                                (gallery_name,)):
+            nodes[row['id']] = {'name': row['name'], 'children': []}
+            if row['parent_id'] is None:
+                root = nodes[row['id']]
+            else:
+                children.setdefault(row['parent_id'], []).append(nodes[row['id']])
+        if root is None:
+            return None
+        for parent_id, child_nodes in children.items():
+            nodes[parent_id]['children'] = child_nodes
+        own = {} # id(node) -> aggregates of its own images
+        for row in conn.execute(
+                "SELECT node_id, status, COUNT(*) AS count, SUM(COALESCE(json_extract(extra, '$.size'), 0)) AS bytes, "
+                "MIN(NULLIF(modification_date, '')) AS first_date, MAX(NULLIF(modification_date, '')) AS last_date "
+                'FROM images WHERE gallery = ? GROUP BY node_id, status', (gallery_name,)):
+            partial = {'images': row['count'], 'bytes': row['bytes'] or 0,
+                       'first_date': row['first_date'], 'last_date': row['last_date']}
+            if row['status'] in node_stats.STATUSES:
+                partial[row['status']] = row['count']
+            node_stats.combine(own.setdefault(id(nodes[row['node_id']]), node_stats.empty()), partial)
+        node_stats.compute(root, own_stats=lambda node: own.get(id(node)) or node_stats.empty())
+        return root
+
+    def _bump_version(self, conn, gallery_name: str):
+        conn.execute(
+            'INSERT INTO galleries (name, version, updated_at) VALUES (?, 1, ?) '
+            'ON CONFLICT(name) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at',
+            (gallery_name, time.time())
+        )
+
+    def _record_catalog(self, gallery_name: str):
+        """Updates the gallery's catalog entry after a committed write."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT status, COUNT(*) AS count, SUM(COALESCE(json_extract(extra, '$.size'), 0)) AS bytes "
+                'FROM images WHERE gallery = ? GROUP BY status', (gallery_name,)).fetchall()
+            version = conn.execute('SELECT version FROM galleries WHERE name = ?', (gallery_name,)).fetchone()
+        stats = {
+            'images': sum(row['count'] for row in rows),
+            'statuses': {row['status']: row['count'] for row in rows},
+            'bytes': sum(row['bytes'] or 0 for row in rows)
+        }
+        self.catalog.record(gallery_name, stats, self._version_tag(version['version']) if version else None)
+
+    def _version_tag(self, version: int) -> str:
+        return f"db-{self._epoch}-{version}"
+
+    def _version(self, conn, gallery_name: str) -> str | None:
+        row = conn.execute('SELECT version FROM galleries WHERE name = ?', (gallery_name,)).fetchone()
+        return self._version_tag(row['version']) if row else None
+
+    def _has_gallery(self, conn, gallery_name: str) -> bool:
+        return conn.execute('SELECT 1 FROM galleries WHERE name = ?', (gallery_name,)).fetchone() is not None
+
+    def _ensure_imported(self, gallery_name: str):
+        """Imports a gallery that so far only exists as gallery_data.json."""
+        if gallery_name in self._imported:
+            return
+        with closing(self._connect()) as conn:
+            if self._has_gallery(conn, gallery_name):
+                self._imported.add(gallery_name)
+                return
+        legacy = super().load_gallery_data(gallery_name)
+        if legacy:
+            logger.info(f"Importing gallery {gallery_name} from gallery_data.json into {self.db_path}")
+            self._replace(legacy, gallery_name, backup=False)
+            self._imported.add(gallery_name)
+
+    def _backup(self, conn, gallery_name: str, force: bool = False):
+        """Writes the current tree as a JSON backup, unless one was taken within backup_interval."""
+        row = conn.execute('SELECT last_backup_at FROM galleries WHERE name = ?', (gallery_name,)).fetchone()
+        if row is None:
+            return
+        now = time.time()
+        if not force and now - row['last_backup_at'] < self.backup_interval:
+            return
+        jst = pytz.timezone('Asia/Tokyo')
+        backup_filename = f"gallery_data_{datetime.now(jst).strftime('%Y%m%d%H%M%S')}.json"
+        backup_filepath = os.path.join(self._get_backup_dir_for_gallery(gallery_name), backup_filename)
+        try:
+            self.storage.save(backup_filepath, self.codec.encode(self._export_tree(conn, gallery_name)))
+            conn.execute('UPDATE galleries SET last_backup_at = ? WHERE name = ?', (now, gallery_name))
+        except Exception as e:
+            logger.error(f"Error backing up gallery {gallery_name}: {e}")
+
+    def _replace(self, data: Dict[str, Any], gallery_name: str, backup: bool = True):
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if backup:
+                    # A whole-tree replacement is the JSON backend's "save", so always back up first
+                    self._backup(conn, gallery_name, force=True)
+                conn.execute('DELETE FROM images WHERE gallery = ?', (gallery_name,))
+                conn.execute('DELETE FROM nodes WHERE gallery = ?', (gallery_name,))
+                self._import_tree(conn, gallery_name, data)
+                self._bump_version(conn, gallery_name)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        self._record_catalog(gallery_name)
+
+    # -- DataManager interface -------------------------------------------
+
+    def load_gallery_data(self, gallery_name: str) -> Dict[str, Any]:
+        self._ensure_imported(gallery_name)
+        with span('db_load'), closing(self._connect()) as conn:
+            # A read transaction gives a consistent snapshot of nodes and images
+            conn.execute('BEGIN')
+            try:
+                return self._export_tree(conn, gallery_name)
+            finally:
+                conn.execute('COMMIT')
+
+    def save_gallery_data(self, data: Dict[str, Any], gallery_name: str) -> bool:
+        try:
+            with span('db_save'):
+                self._replace(data, gallery_name)
+            return True
+        except Exception as e:
+            logger.error(f"Error saving gallery data of {gallery_name}: {e}")
+            return False
+
+    def load_outline(self, gallery_name: str) -> Dict[str, Any] | None:
+        self._ensure_imported(gallery_name)
+        with span('db_load'), closing(self._connect()) as conn:
+            conn.execute('BEGIN')
+            try:
+                return self._export_outline(conn, gallery_name)
+            finally:
+                conn.execute('COMMIT')
+
+    def get_gallery_version(self, gallery_name: str) -> str | None:
+        self._ensure_imported(gallery_name)
+        with closing(self._connect()) as conn:
+            return self._version(conn, gallery_name)
+
+    def load_date_index(self, gallery_name: str) -> Dict[str, int]:
+        self._ensure_imported(gallery_name)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                'SELECT modification_date, COUNT(*) AS count FROM images '
+                'WHERE gallery = ? AND modification_date IS NOT NULL AND modification_date != \'\' '
+                'GROUP BY modification_date ORDER BY modification_date', (gallery_name,)).fetchall()
+        return {row['modification_date']: row['count'] for row in rows}
+
+    def update_comment(self, path: str, comment: str, gallery_name: str) -> bool:
+        self._ensure_imported(gallery_name)
+        node_path = '/'.join(part for part in (path or '').strip('/').split('/') if part)
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._backup(conn, gallery_name)
+                # Versions read inside the transaction, so no other writer's change falls in between
+                before = self._version(conn, gallery_name)
+                updated = conn.execute('UPDATE nodes SET comment = ? WHERE gallery = ? AND path = ?',
+                                       (comment, gallery_name, node_path)).rowcount
+                if updated:
+                    self._bump_version(conn, gallery_name)
+                after = self._version(conn, gallery_name)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        if updated:
+            self._record_catalog(gallery_name)
+            self.search_indexes.update(gallery_name, before, after, self._comment_indexer(node_path.split('/'), comment))
+        return bool(updated)
+
+    def update_image_status(self, image_paths: list[str], status: str, gallery_name: str) -> bool:
+        self._ensure_imported(gallery_name)
+        filenames = list({path.split('/')[-1] for path in image_paths})
+        updated = 0
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._backup(conn, gallery_name)
+                before = self._version(conn, gallery_name)
+                for start in range(0, len(filenames), _IN_CHUNK):
+                    chunk = filenames[start:start + _IN_CHUNK]
+                    updated += conn.execute(
+                        f"UPDATE images SET status = ? WHERE gallery = ? AND filename IN ({','.join('?' * len(chunk))})",
+                        (status, gallery_name, *chunk)).rowcount
+                if updated:
+                    self._bump_version(conn, gallery_name)
+                after = self._version(conn, gallery_name)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        if updated:
+            self._record_catalog(gallery_name)
+            self.search_indexes.update(gallery_name, before, after)
+        return updated > 0
+
+    @staticmethod
+    def _select(conn, gallery_name: str, selection: Selection) -> list:
+        """Rows (id, filename, status, modification_date, path of the folder) of the images matched by `selection`, in one indexed query."""
+        # Name lists can be long, so they go through temporary tables instead of bound parameters
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS selected_names (name TEXT PRIMARY KEY)')
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS excluded_names (name TEXT PRIMARY KEY)')
+        conn.execute('DELETE FROM temp.selected_names')
+        conn.execute('DELETE FROM temp.excluded_names')
+        conn.executemany('INSERT OR IGNORE INTO temp.selected_names VALUES (?)', [(name,) for name in selection.filenames])
+        conn.executemany('INSERT OR IGNORE INTO temp.excluded_names VALUES (?)', [(name,) for name in selection.exclude])
+
+        scope, params = [], []
+        for folder in selection.folders:
+            path = '/'.join(folder)
+            if selection.recursive and not path:
+                scope.append('1')
+            elif selection.recursive:
+                scope.append("(nodes.path = ? OR nodes.path LIKE ? ESCAPE '\\')")
+                escaped = path.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+                params.extend([path, f"{escaped}/%"])
+            else:
+                scope.append('nodes.path = ?')
+                params.append(path)
+        if selection.filenames:
+            scope.append('images.filename IN (SELECT name FROM temp.selected_names)')
+        conditions = ['images.gallery = ?', f"({' OR '.join(scope)})",
+                      'images.filename NOT IN (SELECT name FROM temp.excluded_names)']
+        params.insert(0, gallery_name)
+        if selection.status is not None:
+            conditions.append('images.status = ?')
+            params.append(selection.status)
+        if selection.date is not None:
+            conditions.append('images.modification_date = ?')
+            params.append(selection.date)
+        return conn.execute(
+            'SELECT images.id, images.filename, images.status, images.modification_date, nodes.path '
+            'FROM images JOIN nodes ON nodes.id = images.node_id '
+            f"WHERE {' AND '.join(conditions)}", params).fetchall()
+
+    def update_status_by_selection(self, selection: Selection, status: str, gallery_name: str) -> Dict[str, Any] | None:
+        self._ensure_imported(gallery_name)
+        try:
+            with span('select'), closing(self._connect()) as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    if not self._has_gallery(conn, gallery_name):
+                        conn.execute('ROLLBACK')
+                        return None
+                    rows = self._select(conn, gallery_name, selection)
+                    changed = [row for row in rows if row['status'] != status]
+                    before = self._version(conn, gallery_name)
+                    if changed:
+                        self._backup(conn, gallery_name)
+                        conn.executemany('UPDATE images SET status = ? WHERE id = ?', [(status, row['id']) for row in changed])
+                        self._bump_version(conn, gallery_name)
+                    after = self._version(conn, gallery_name)
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+        except Exception as e:
+            logger.error(f"Error updating image status in {gallery_name}: {e}")
+            return None
+        if changed:
+            self._record_catalog(gallery_name)
+            self.search_indexes.update(gallery_name, before, after)
+        return {'matched': len(rows), 'filenames': [row['filename'] for row in changed]}
+
+    def find_by_selection(self, selection: Selection, gallery_name: str) -> list[tuple[str, Dict[str, Any]]] | None:
+        # Images carry the columns of the selection query only (filename, status, modification_date)
+        self._ensure_imported(gallery_name)
+        with span('select'), closing(self._connect()) as conn:
+            conn.execute('BEGIN')
+            try:
+                if not self._has_gallery(conn, gallery_name):
+                    return None
+                rows = self._select(conn, gallery_name, selection)
+            finally:
+                conn.execute('COMMIT')
+        found = []
+        for row in sorted(rows, key=lambda row: (row['path'], row['id'])):
+            image = {'filename': row['filename'], 'status': row['status']}
+            if row['modification_date'] is not None:
+                image['modification_date'] = row['modification_date']
+            found.append((row['path'], image))
+        return found
+
+    def delete_by_selection(self, selection: Selection, gallery_name: str) -> Dict[str, Any] | None:
+        self._ensure_imported(gallery_name)
+        try:
+            with span('select'), closing(self._connect()) as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    if not self._has_gallery(conn, gallery_name):
+                        conn.execute('ROLLBACK')
+                        return None
+                    rows = self._select(conn, gallery_name, selection)
+                    before = self._version(conn, gallery_name)
+                    pruned = []
+                    if rows:
+                        self._backup(conn, gallery_name)
+                        conn.executemany('DELETE FROM images WHERE id = ?', [(row['id'],) for row in rows])
+                        # Folders left without images or subfolders go too, innermost first
+                        while True:
+                            empty = conn.execute(
+                                'SELECT id, path FROM nodes WHERE gallery = ? AND parent_id IS NOT NULL '
+                                'AND NOT EXISTS (SELECT 1 FROM images WHERE images.node_id = nodes.id) '
+                                'AND NOT EXISTS (SELECT 1 FROM nodes AS child WHERE child.parent_id = nodes.id)',
+                                (gallery_name,)).fetchall()
+                            if not empty:
+                                break
+                            conn.executemany('DELETE FROM nodes WHERE id = ?', [(row['id'],) for row in empty])
+                            pruned.extend(tuple(row['path'].split('/')) for row in empty)
+                        self._bump_version(conn, gallery_name)
+                    after = self._version(conn, gallery_name)
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+        except Exception as e:
+            logger.error(f"Error deleting images from {gallery_name}: {e}")
+            return None
+        if rows:
+            self._record_catalog(gallery_name)
+            removed = [(tuple(part for part in row['path'].split('/') if part), row['filename']) for row in rows]
+            self.search_indexes.update(gallery_name, before, after, lambda index: index.remove(removed, pruned))
+        return {'matched': len(rows), 'filenames': [row['filename'] for row in rows]}
+
+    def merge_gallery_data(self, new_data: Dict[str, Any], gallery_name: str) -> Dict[str, Any] | None:
+        self._ensure_imported(gallery_name)
+        try:
+            with span('merge'), closing(self._connect()) as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    self._backup(conn, gallery_name)
+                    before = self._version(conn, gallery_name)
+                    self._merge_node(conn, gallery_name, new_data, None, '')
+                    self._bump_version(conn, gallery_name)
+                    after = self._version(conn, gallery_name)
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+        except Exception as e:
+            logger.error(f"Error merging gallery data into {gallery_name}: {e}")
+            return None
+        self._record_catalog(gallery_name)
+        self.search_indexes.update(gallery_name, before, after, lambda index: index.add_tree(new_data))
+        return self.load_gallery_data(gallery_name)
+
+    def _merge_node(self, conn, gallery_name: str, node: Dict[str, Any], parent_id: int | None, path: str):
+        row = conn.execute('SELECT id FROM nodes WHERE gallery = ? AND path = ?', (gallery_name, path)).fetchone()
+        if row is None:
+            position = conn.execute(
+                'SELECT COUNT(*) FROM nodes WHERE gallery = ? AND parent_id IS ?', (gallery_name, parent_id)).fetchone()[0]
+            node_id = self._insert_node(conn, gallery_name, node, parent_id, path, position)
+            existing = set()
+            next_position = 0
+        else:
+            node_id = row['id']
+            existing = {r['filename'] for r in conn.execute('SELECT filename FROM images WHERE node_id = ?', (node_id,))}
+            next_position = conn.execute('SELECT COALESCE(MAX(position) + 1, 0) FROM images WHERE node_id = ?',
+                                         (node_id,)).fetchone()[0]
+        # Images already present (same hashed filename) are skipped, so merging the same upload twice is harmless
+        new_images = [image for image in node.get('images', []) if image['filename'] not in existing]
+        self._insert_images(conn, gallery_name, node_id, new_images, start=next_position)
+        for child in node.get('children', []):
+            child_path = f"{path}/{child.get('name', '')}" if path else child.get('name', '')
+            self._merge_node(conn, gallery_name, child, node_id, child_path)
+
+    def revert_to_version(self, filename: str, gallery_name: str) -> bool:
+        data = self.read_backup(filename, gallery_name)
+        if data is None:
+            return False
+        try:
+            self._replace(data, gallery_name, backup=False)
+            return True
+        except Exception as e:
+            logger.error(f"Error reverting {gallery_name} to version {filename}: {e}")
+            return False
+
+    def export_json(self, gallery_name: str) -> bool:
+        """Writes the gallery to gallery_data.json, e.g. to switch back to the JSON backend."""
+        return super().save_gallery_data(self.load_gallery_data(gallery_name), gallery_name)
@@ -1,17 +1,32 @@
 import os
+import time
 import zipfile
 import hashlib
+import concurrent.futures
+import multiprocessing
+import threading
 from datetime import datetime
 from ..storage.storage import Storage
+from .image_analysis import analyze_image_bytes, analyze_zip_member, analyze_file
+from .progress_reporter import ProgressReporter
+from ..tracing import span, bind
 import logging
 
 logger = logging.getLogger(__name__)
 
 class UploadService:
-    _upload_progress = {} # Class-level dictionary to store upload progress
-    def __init__(self, storage: Storage, socketio=None):
+    _process_pool = None # Shared ProcessPoolExecutor for the CPU stage of ingest
+    _process_pool_size = 0
+    _process_pool_lock = threading.Lock()
+
+    def __init__(self, storage: Storage, socketio=None, progress_callback=None, job_id=None, progress_interval=0.5):
         self.storage = storage
         self.socketio = socketio
+        # Called with every (coalesced) ProgressReporter snapshot, so the caller
+        # can persist it, e.g. into the job queue.
+        self.progress_callback = progress_callback
+        self.job_id = job_id
+        self.progress_interval = progress_interval # Minimum seconds between two progress updates
         # TODO: Make allowed_extensions configurable
         self.allowed_extensions = ['.jpg', '.jpeg', '.png', '.gif']
 
@@ -21,116 +36,321 @@ class UploadService:
         file_hash = hashlib.md5(hash_input).hexdigest()
         return f"{name}_{file_hash}{ext}"
 
+    def _save_with_retry(self, file_path, data, max_retries=3, initial_delay=1):
+        retries = 0
+        delay = initial_delay
+        while retries < max_retries:
+            try:
+                with span('storage_write'):
+                    self.storage.save(file_path, data)
+                return True # Success
+            except Exception as e:
+                logger.warning(f"Upload failed for {file_path} (attempt {retries + 1}/{max_retries}): {e}")
+                retries += 1
+                if retries < max_retries:
+                    time.sleep(delay)
+                    delay *= 2 # Exponential backoff
+                else:
+                    logger.error(f"Upload failed for {file_path} after {max_retries} attempts.")
+                    return False # Failure
+
     def process_zip_file(self, zip_file_stream, gallery_name):
-        import concurrent.futures
-        import threading
-        import time
         from ..config_manager import config_manager
 
         gallery_data = {"name": "root", "images": [], "comment": "", "children": []}
-        UploadService._upload_progress[gallery_name] = None # Set to None initially
+        progress = ProgressReporter('upload', gallery_name, socketio=self.socketio, job_id=self.job_id,
+                                    callback=self.progress_callback, min_interval=self.progress_interval)
 
         try:
             with zipfile.ZipFile(zip_file_stream, 'r') as zip_ref:
-                file_members = [m for m in zip_ref.infolist() if not m.is_dir() and os.path.splitext(os.path.basename(m.filename))[1].lower() in self.allowed_extensions]
-                total_files = len(file_members)
-                if total_files == 0:
+                with span('zip_scan'):
+                    file_members = [m for m in zip_ref.infolist() if not m.is_dir() and os.path.splitext(os.path.basename(m.filename))[1].lower() in self.allowed_extensions]
+                progress.start(total=len(file_members), total_bytes=sum(m.file_size for m in file_members))
+                if not file_members:
                     logger.warning("No processable image files found in the zip.")
-                    UploadService._upload_progress[gallery_name] = 100
+                    progress.finish()
                     return gallery_data
 
-                # Set progress to 0 once we know there are files to process
-                UploadService._upload_progress[gallery_name] = 0
-
-                processed_files = 0
-                progress_lock = threading.Lock()
-
-                def _update_progress():
-                    nonlocal processed_files
-                    with progress_lock:
-                        processed_files += 1
-                        progress = (processed_files / total_files) * 100
-                        UploadService._upload_progress[gallery_name] = progress
-                        if self.socketio:
-                            self.socketio.emit('upload_progress', {'progress': progress})
-                            self.socketio.sleep(0.01)
-
-                def _upload_with_retry(file_path, data, max_retries=3, initial_delay=1):
-                    retries = 0
-                    delay = initial_delay
-                    while retries < max_retries:
-                        try:
-                            self.storage.save(file_path, data)
-                            return True # Success
-                        except Exception as e:
-                            logger.warning(f"Upload failed for {file_path} (attempt {retries + 1}/{max_retries}): {e}")
-                            retries += 1
-                            if retries < max_retries:
-                                time.sleep(delay)
-                                delay *= 2 # Exponential backoff
-                            else:
-                                logger.error(f"Upload failed for {file_path} after {max_retries} attempts.")
-                                return False # Failure
-
-                files_to_upload = []
-                for member in file_members:
-                    original_filename = os.path.basename(member.filename)
-                    if not original_filename: continue
-                    with zip_ref.open(member) as file_in_zip:
-                        file_content = file_in_zip.read()
-                    mod_date = datetime(*member.date_time).strftime('%Y-%m-%d')
-                    hashed_filename = self._generate_hashed_filename(original_filename, mod_date)
-                    zip_internal_path = os.path.dirname(member.filename).replace('\\', '/')
-                    storage_path = f"{gallery_name}/{hashed_filename}"
-                    files_to_upload.append({
-                        'storage_path': storage_path, 'file_content': file_content,
-                        'zip_internal_path': zip_internal_path, 'hashed_filename': hashed_filename,
-                        'mod_date': mod_date
-                    })
-
+                # Bound once, so the storage writes in the pool threads are recorded in this trace
+                _upload_with_retry = bind(self._save_with_retry)
+                _upload_member = bind(self._upload_zip_member)
                 max_workers = config_manager.get('MAX_UPLOAD_WORKERS', 8)
+                # Decode/hash/metadata work runs in a process pool when configured, so it
+                # is not capped at one core by the GIL. Workers read members straight from
+                # the archive on disk, so this needs a real file rather than an in-memory stream.
+                process_workers = config_manager.get('INGEST_PROCESS_WORKERS', 0)
+                zip_path = getattr(zip_file_stream, 'name', None)
+                if not (process_workers and isinstance(zip_path, str) and os.path.isfile(zip_path)):
+                    zip_path = None
+
+                successful_uploads = []
                 with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-                    future_to_file = {executor.submit(_upload_with_retry, file['storage_path'], file['file_content']): file for file in files_to_upload}
-                    
-                    successful_uploads = []
-                    for future in concurrent.futures.as_completed(future_to_file):
-                        file_data = future_to_file[future]
-                        try:
-                            was_successful = future.result()
-                            if was_successful:
-                                successful_uploads.append(file_data)
-                        except Exception as exc:
-                            logger.error(f"An unexpected error occurred during the upload of {file_data['hashed_filename']}: {exc}")
-                        finally:
-                            _update_progress()
+                    future_to_file = {}
 
-                for file_data in successful_uploads:
-                    node = self._get_or_create_node(gallery_data, file_data['zip_internal_path'])
-                    node['images'].append({
-                        "filename": file_data['hashed_filename'],
-                        "modification_date": file_data['mod_date'],
-                        "status": "neutral"
-                    })
+                    def collect(futures):
+                        for future in futures:
+                            file_data = future_to_file.pop(future)
+                            try:
+                                if future.result():
+                                    successful_uploads.append(file_data)
+                            except Exception as exc:
+                                logger.error(f"An unexpected error occurred during the upload of {file_data['hashed_filename']}: {exc}")
+                            finally:
+                                progress.advance(nbytes=file_data['metadata']['size'])
+
+                    for member, result in self._iter_analyzed_members(zip_ref, zip_path, file_members, process_workers):
+                        if isinstance(result, Exception):
+                            logger.error(f"Failed to read {member.filename} from the zip: {result}")
+                            progress.advance()
+                            continue
+                        metadata, file_content = result
+                        original_filename = os.path.basename(member.filename)
+                        mod_date = datetime(*member.date_time).strftime('%Y-%m-%d')
+                        hashed_filename = self._generate_hashed_filename(original_filename, mod_date)
+                        file_data = {
+                            'storage_path': f"{gallery_name}/{hashed_filename}",
+                            'internal_path': os.path.dirname(member.filename).replace('\\', '/'),
+                            'hashed_filename': hashed_filename,
+                            'mod_date': mod_date,
+                            'metadata': metadata
+                        }
+                        if file_content is None: # Analyzed in the process pool, which returns metadata only
+                            future = executor.submit(_upload_member, zip_ref, member, file_data['storage_path'])
+                        else:
+                            future = executor.submit(_upload_with_retry, file_data['storage_path'], file_content)
+                        future_to_file[future] = file_data
+                        # Bound the images held in memory while their storage writes are pending
+                        if len(future_to_file) >= max_workers * 4:
+                            done, _ = concurrent.futures.wait(future_to_file, return_when=concurrent.futures.FIRST_COMPLETED)
+                            collect(done)
+                    collect(list(concurrent.futures.as_completed(future_to_file)))
+
+                self._build_tree(gallery_data, successful_uploads)
 
         except zipfile.BadZipFile:
             logger.error("Uploaded file is not a valid zip file.")
-            UploadService._upload_progress[gallery_name] = -1
+            progress.finish(success=False)
             return None
         except Exception as e:
             logger.error(f"Error processing zip file: {e}")
-            UploadService._upload_progress[gallery_name] = -1
+            progress.finish(success=False)
             return None
         
-        if self.socketio:
-            UploadService._upload_progress[gallery_name] = 100
-            self.socketio.emit('upload_progress', {'progress': 100})
+        progress.finish()
+        return gallery_data
+
+    def process_directory(self, manifest, changed, gallery_name):
+        """
+        Ingests files from a directory tree on the server, building the same
+        tree (folders follow the files' directories) and emitting the same
+        progress events as a zip upload. Images are stored under their
+        content hash, so a changed file becomes a new image instead of
+        silently overwriting the old one.
+
+        Args:
+            manifest (IngestManifest): The source directory's manifest. Every
+                file processed successfully is recorded in it.
+            changed (list): (relative path, size, mtime_ns) of the files to
+                process, as returned by IngestManifest.scan.
+            gallery_name (str): The gallery to store the images for.
+
+        Returns:
+            dict | None: The tree of the images with new content, or None if
+            ingest failed.
+        """
+        from ..config_manager import config_manager
+
+        gallery_data = {"name": "root", "images": [], "comment": "", "children": []}
+        progress = ProgressReporter('upload', gallery_name, socketio=self.socketio, job_id=self.job_id,
+                                    callback=self.progress_callback, min_interval=self.progress_interval)
+        progress.start(total=len(changed), total_bytes=sum(size for _, size, _ in changed))
+        try:
+            _upload_file = bind(self._upload_source_file)
+            max_workers = config_manager.get('MAX_UPLOAD_WORKERS', 8)
+            process_workers = config_manager.get('INGEST_PROCESS_WORKERS', 0)
 
+            successful_uploads = []
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                future_to_file = {}
+
+                def collect(futures):
+                    for future in futures:
+                        file_data = future_to_file.pop(future)
+                        try:
+                            if future.result():
+                                successful_uploads.append(file_data)
+                                manifest.record(file_data['relative_path'], file_data['size'], file_data['mtime_ns'],
+                                                file_data['content_hash'], file_data['hashed_filename'])
+                        except Exception as exc:
+                            logger.error(f"An unexpected error occurred during the upload of {file_data['hashed_filename']}: {exc}")
+                        finally:
+                            progress.advance(nbytes=file_data['size'])
+
+                for (relative_path, size, mtime_ns), result in self._iter_analyzed_files(manifest, changed, process_workers):
+                    if isinstance(result, Exception):
+                        logger.error(f"Failed to read {relative_path} in {manifest.source_dir}: {result}")
+                        progress.advance()
+                        continue
+                    content_hash, metadata = result
+                    if metadata is None: # Touched, but its content is what was ingested before
+                        manifest.record(relative_path, size, mtime_ns, content_hash, manifest.files[relative_path][3])
+                        progress.advance(nbytes=size)
+                        continue
+                    name, ext = os.path.splitext(os.path.basename(relative_path))
+                    hashed_filename = f"{name}_{content_hash}{ext}"
+                    file_data = {
+                        'storage_path': f"{gallery_name}/{hashed_filename}",
+                        'internal_path': os.path.dirname(relative_path),
+                        'hashed_filename': hashed_filename,
+                        'mod_date': datetime.fromtimestamp(mtime_ns / 1e9).strftime('%Y-%m-%d'),
+                        'metadata': metadata,
+                        'relative_path': relative_path,
+                        'size': size,
+                        'mtime_ns': mtime_ns,
+                        'content_hash': content_hash
+                    }
+                    future = executor.submit(_upload_file, os.path.join(manifest.source_dir, relative_path),
+                                             file_data['storage_path'], content_hash)
+                    future_to_file[future] = file_data
+                    # A directory can hold more than fits in memory; bound the bytes in flight
+                    if len(future_to_file) >= max_workers * 4:
+                        done, _ = concurrent.futures.wait(future_to_file, return_when=concurrent.futures.FIRST_COMPLETED)
+                        collect(done)
+                collect(list(concurrent.futures.as_completed(future_to_file)))
+
+            self._build_tree(gallery_data, successful_uploads)
+        except Exception as e:
+            logger.error(f"Error ingesting {manifest.source_dir}: {e}")
+            progress.finish(success=False)
+            return None
+
+        progress.finish()
         return gallery_data
 
+    def _iter_analyzed_files(self, manifest, changed, process_workers):
+        """
+        Yields (entry, (content hash, metadata)) for each entry of
+        `changed`, or (entry, exception) if the file could not be read; see
+        analyze_file. Runs in the process pool when `process_workers` is set.
+        """
+        def call_of(entry):
+            relative_path = entry[0]
+            return analyze_file, os.path.join(manifest.source_dir, relative_path), manifest.known_hash(relative_path)
+
+        if not process_workers:
+            for entry in changed:
+                fn, *args = call_of(entry)
+                try:
+                    with span('analyze'):
+                        result = fn(*args)
+                except Exception as e:
+                    yield entry, e
+                else:
+                    yield entry, result
+            return
+        yield from self._iter_in_process_pool(process_workers, changed, call_of)
+
+    def _build_tree(self, gallery_data, successful_uploads):
+        with span('tree_build'):
+            for file_data in successful_uploads:
+                node = self._get_or_create_node(gallery_data, file_data['internal_path'])
+                metadata = file_data['metadata']
+                node['images'].append({
+                    "filename": file_data['hashed_filename'],
+                    # Prefer the EXIF capture date; the zip entry's timestamp only
+                    # reflects when the archive was built.
+                    "modification_date": metadata['capture_date'][:10] if metadata.get('capture_date') else file_data['mod_date'],
+                    "status": "neutral",
+                    **metadata
+                })
+
     @classmethod
-    def get_upload_progress(cls, gallery_name):
-        return cls._upload_progress.get(gallery_name)
+    def _get_process_pool(cls, max_workers):
+        # One pool per process, shared by all uploads, so worker start-up is paid once.
+        # 'spawn' avoids forking a web worker that has live threads and sockets.
+        with cls._process_pool_lock:
+            if cls._process_pool is None or cls._process_pool_size != max_workers:
+                if cls._process_pool is not None:
+                    cls._process_pool.shutdown(wait=False)
+                cls._process_pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+                cls._process_pool_size = max_workers
+            return cls._process_pool
+
+    def _iter_analyzed_members(self, zip_ref, zip_path, file_members, process_workers):
+        """
+        Yields (member, (metadata, data)) for each member, or (member, exception)
+        if it could not be read. Runs in a process pool when `zip_path` is set,
+        keeping a bounded number of members in flight so memory stays flat;
+        data is then None and the member is read again for the storage write.
+        """
+        if not zip_path:
+            for member in file_members:
+                try:
+                    with span('extract'):
+                        with zip_ref.open(member) as file_in_zip:
+                            data = file_in_zip.read()
+                    with span('analyze'):
+                        metadata = analyze_image_bytes(data)
+                except Exception as e:
+                    yield member, e
+                else:
+                    yield member, (metadata, data)
+            return
+
+        for member, result in self._iter_in_process_pool(process_workers, file_members,
+                                                         lambda member: (analyze_zip_member, zip_path, member.filename)):
+            yield member, result if isinstance(result, Exception) else (result, None)
+
+    def _upload_source_file(self, path, file_path, content_hash):
+        """
+        Reads a file being ingested and saves it, unless its content changed
+        since it was analyzed; it is then left for the next ingest.
+        """
+        with span('extract'):
+            with open(path, 'rb') as f:
+                data = f.read()
+        if hashlib.md5(data).hexdigest() != content_hash:
+            logger.warning(f"{path} changed while it was ingested; skipping it until the next ingest")
+            return False
+        return self._save_with_retry(file_path, data)
+
+    def _upload_zip_member(self, zip_ref, member, file_path):
+        """Inflates a zip member in this process and saves it; see analyze_zip_member."""
+        with span('extract'):
+            with zip_ref.open(member) as file_in_zip:
+                data = file_in_zip.read()
+        return self._save_with_retry(file_path, data)
+
+    def _iter_in_process_pool(self, process_workers, items, call_of):
+        """
+        Yields (item, result) for each item, or (item, exception) if its call
+        failed, where `call_of(item)` is a picklable (function, *args) run in
+        the shared process pool. A bounded number of items is in flight, so
+        memory stays flat; results arrive in completion order.
+        """
+        pool = self._get_process_pool(process_workers)
+        items = iter(items)
+        pending = {}
+
+        def submit_next():
+            item = next(items, None)
+            if item is not None:
+                fn, *args = call_of(item)
+                pending[pool.submit(fn, *args)] = item
 
+        for _ in range(process_workers * 4):
+            submit_next()
+        while pending:
+            with span('analyze_wait'):
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                submit_next()
+                try:
+                    yield item, future.result()
+                except Exception as e:
+                    yield item, e
 
     def _get_or_create_node(self, root_node, path):
         if not path or path == '.':
@@ -0,0 +1,20 @@
+from flask_socketio import join_room, leave_room
+
+
+def register_socket_events(socketio):
+    """
+    Registers the Socket.IO handlers. Clients join the room of the gallery they
+    display, so progress events are only sent to the browsers that care.
+    """
+
+    @socketio.on('join_gallery')
+    def join_gallery(data):
+        gallery_name = (data or {}).get('gallery_name')
+        if gallery_name:
+            join_room(gallery_name)
+
+    @socketio.on('leave_gallery')
+    def leave_gallery(data):
+        gallery_name = (data or {}).get('gallery_name')
+        if gallery_name:
+            leave_room(gallery_name)
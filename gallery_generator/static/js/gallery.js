@@ -1,6 +1,8 @@
 document.addEventListener('DOMContentLoaded', () => {
     const galleryContainer = document.getElementById('gallery-container');
     const tocContainer = document.getElementById('toc-container');
+    const searchInput = document.getElementById('gallery-search');
+    const searchResults = document.getElementById('search-results');
     const dateFilter = document.getElementById('date-filter');
     const fileElem = document.getElementById('fileElem');
     const confirmDeletionBtn = document.getElementById('confirm-deletion');
@@ -32,6 +34,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const statusGoodBtn = document.getElementById('status-good-btn');
     const statusBadBtn = document.getElementById('status-bad-btn');
     const statusNeutralBtn = document.getElementById('status-neutral-btn');
+    const downloadBtn = document.getElementById('download-btn');
 
     // Get gallery name from the body's data attribute
     const galleryName = document.body.dataset.galleryName;
@@ -42,8 +45,15 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     let currentGalleryData = {};
-    let selectedImages = new Set();
+    let currentGalleryEtag = null; // ETag of the rendered tree, so unchanged data is not re-fetched
+    let selectedImages = new Set(); // Individually selected filenames
+    // Folders selected with their heading checkbox are sent as folder paths and resolved by the
+    // server; images unticked inside such a folder are sent as exclusions
+    const selectedFolders = new Set();
+    const excludedImages = new Set();
     let lastSelectedImage = null;
+    let duplicateClusters = []; // Near-duplicate clusters from the server
+    const expandedClusters = new Set(); // Cluster ids the user has expanded
 
     // Menu sidebar toggle
     menuToggle.addEventListener('click', (event) => {
@@ -86,7 +96,19 @@ document.addEventListener('DOMContentLoaded', () => {
     let progressBarToast = null; // To keep track of the toast element
     let progressBarInner = null; // To keep track of the inner progress bar element
 
-    const showProgressBarToast = (progress) => {
+    const formatProgressDetails = (details) => {
+        if (!details) return '';
+        const parts = [];
+        if (details.bytes_per_second) {
+            parts.push(`${(details.bytes_per_second / (1024 * 1024)).toFixed(1)} MB/s`);
+        }
+        if (typeof details.eta_seconds === 'number') {
+            parts.push(`ETA ${Math.ceil(details.eta_seconds)}s`);
+        }
+        return parts.length ? ` (${parts.join(', ')})` : '';
+    };
+
+    const showProgressBarToast = (progress, details = null) => {
         if (!progressBarToast) {
             progressBarToast = document.createElement('div');
             progressBarToast.classList.add('toast-message', 'toast-info', 'progress-toast');
@@ -104,7 +126,7 @@ document.addEventListener('DOMContentLoaded', () => {
         if (typeof progress === 'number') {
             const percentage = Math.round(progress);
             progressBarInner.style.width = `${percentage}%`;
-            progressBarToast.querySelector('.progress-text').textContent = `Uploading: ${percentage}%`;
+            progressBarToast.querySelector('.progress-text').textContent = `Uploading: ${percentage}%${formatProgressDetails(details)}`;
         } else {
             // Handle "pending" or "initiating" state
             progressBarInner.style.width = `0%`; // Or some indeterminate animation
@@ -128,42 +150,50 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
 
-    const checkUploadStatusAndDisplayProgressBar = async () => {
-        const galleryName = document.body.dataset.galleryName;
-        if (!galleryName) return;
+    const hideProgressBarToast = () => {
+        if (progressBarToast) {
+            progressBarToast.classList.remove('show');
+            progressBarToast.parentNode.removeChild(progressBarToast);
+            progressBarToast = null;
+            progressBarInner = null;
+        }
+    };
 
+    // Jobs of this gallery as last reported by the server. They are pushed as `job_update`
+    // events and fetched once whenever the socket (re)connects, to catch up on missed events.
+    const jobs = new Map(); // job id -> job
+    const JOB_LABELS = { upload: 'Upload', ingest: 'Ingest' };
+
+    const applyJobUpdate = (job) => {
+        const previous = jobs.get(job.id);
+        if (previous && previous.updated_at > job.updated_at) return; // An older state arriving late
+        jobs.set(job.id, job);
+        if (!(job.kind in JOB_LABELS)) return;
+
+        if (job.state === 'queued') {
+            showProgressBarToast(null);
+        } else if (job.state === 'running') {
+            if (job.progress === null || job.progress >= 0) showProgressBarToast(job.progress, job.detail);
+        } else if (previous && previous.state !== job.state) {
+            // Finished while this page followed it; jobs that had already finished are just history
+            if (job.state === 'done') {
+                showProgressBarToast(100);
+            } else {
+                showMessage(`${JOB_LABELS[job.kind]} failed: ${job.error || 'unknown error'}`, 'error');
+                hideProgressBarToast();
+            }
+        }
+    };
+
+    const fetchJobs = async () => {
         try {
-            const response = await fetch(`/gallery/${galleryName}/upload_status`);
+            const response = await fetch(`/gallery/${galleryName}/api/jobs`);
             if (response.ok) {
-                const data = await response.json();
-                const progress = data.progress;
-
-                if (progress === null || typeof progress === 'undefined') {
-                    // No upload in progress, do nothing
-                    return;
-                }
-
-                if (progress >= 0 && progress < 100) {
-                    showProgressBarToast(progress);
-                } else if (progress === 100) {
-                    if (progressBarToast) {
-                        progressBarToast.classList.remove('show');
-                        progressBarToast.parentNode.removeChild(progressBarToast);
-                        progressBarToast = null;
-                        progressBarInner = null;
-                    }
-                } else if (progress === -1) {
-                    showMessage('Previous upload failed. Please try again.', 'error');
-                    if (progressBarToast) {
-                        progressBarToast.classList.remove('show');
-                        progressBarToast.parentNode.removeChild(progressBarToast);
-                        progressBarToast = null;
-                        progressBarInner = null;
-                    }
-                }
+                // Oldest first, so the newest job is the one the progress toast ends up showing
+                (await response.json()).jobs.reverse().forEach(applyJobUpdate);
             }
-         } catch (error) {
-            console.error('Error checking upload status:', error);
+        } catch (error) {
+            console.error('Error fetching jobs:', error);
         }
     };
 
@@ -181,18 +211,25 @@ document.addEventListener('DOMContentLoaded', () => {
     // Function to fetch and render gallery data
     const fetchAndRenderGallery = async () => {
         try {
-            const dataResponse = await fetch(`/gallery/${galleryName}/api/gallery_data`);
+            const headers = currentGalleryEtag ? { 'If-None-Match': currentGalleryEtag } : {};
+            const dataResponse = await fetch(`/gallery/${galleryName}/api/gallery_data`, { headers, cache: 'no-store' });
+            if (dataResponse.status === 304) {
+                return; // Nothing changed since the last render
+            }
             if (dataResponse.ok) {
+                currentGalleryEtag = dataResponse.headers.get('ETag');
                 currentGalleryData = await dataResponse.json();
+                await fetchDuplicateClusters();
                 renderGallery(currentGalleryData);
-                populateDateFilter(currentGalleryData);
+                populateDateFilter();
                 populateVersionHistory();
             } else {
                 console.error('Failed to fetch initial gallery data:', dataResponse.statusText);
+                currentGalleryEtag = null;
                 // If gallery data not found, it might be a new gallery, so initialize with empty data
                 currentGalleryData = {"name": "root", "images": [], "comment": "", "children": []};
                 renderGallery(currentGalleryData);
-                populateDateFilter(currentGalleryData);
+                populateDateFilter();
                 populateVersionHistory();
             }
         }
@@ -201,11 +238,120 @@ document.addEventListener('DOMContentLoaded', () => {
             // If there's an error, initialize with empty data
             currentGalleryData = {"name": "root", "images": [], "comment": "", "children": []};
             renderGallery(currentGalleryData);
-            populateDateFilter(currentGalleryData);
+            populateDateFilter();
             populateVersionHistory();
         }
     };
 
+    const fetchDuplicateClusters = async () => {
+        try {
+            const response = await fetch(`/gallery/${galleryName}/api/duplicates`);
+            duplicateClusters = response.ok ? (await response.json()).clusters : [];
+        } catch (error) {
+            console.error('Error fetching duplicate clusters:', error);
+            duplicateClusters = [];
+        }
+    };
+
+    // Collapse each near-duplicate cluster behind its representative image
+    const applyDuplicateCollapsing = () => {
+        duplicateClusters.forEach(cluster => {
+            const representative = galleryContainer.querySelector(`.image-item[data-filename="${cluster.representative}"]`);
+            if (!representative) return;
+            const expanded = expandedClusters.has(cluster.id);
+            const members = cluster.filenames.filter(filename => filename !== cluster.representative);
+            members.forEach(filename => {
+                const item = galleryContainer.querySelector(`.image-item[data-filename="${filename}"]`);
+                if (item) item.classList.toggle('duplicate-hidden', !expanded);
+            });
+
+            const badge = document.createElement('span');
+            badge.classList.add('duplicate-badge');
+            badge.title = expanded ? 'Collapse similar images' : 'Show similar images';
+            badge.textContent = expanded ? '\u2212' : `+${members.length}`;
+            badge.addEventListener('click', (e) => {
+                e.stopPropagation(); // Do not open the viewer
+                if (expandedClusters.has(cluster.id)) {
+                    expandedClusters.delete(cluster.id);
+                } else {
+                    expandedClusters.add(cluster.id);
+                }
+                renderGallery(currentGalleryData, dateFilter.value);
+            });
+            representative.appendChild(badge);
+        });
+    };
+
+    // Folder path of the section an image is rendered in (as sent in selection.folders)
+    const folderOf = (imageItem) => {
+        const headingCheckbox = imageItem.closest('.gallery-section')?.querySelector('.heading-checkbox');
+        return headingCheckbox ? headingCheckbox.dataset.path : null;
+    };
+
+    const isImageSelected = (filename) => {
+        if (selectedImages.has(filename)) return true;
+        if (excludedImages.has(filename)) return false;
+        const imageItem = galleryContainer.querySelector(`.image-item[data-filename="${filename}"]`);
+        return !!imageItem && selectedFolders.has(folderOf(imageItem));
+    };
+
+    const hasSelection = () => selectedImages.size > 0 || selectedFolders.size > 0;
+
+    const setImageSelected = (imageItem, checked) => {
+        const filename = imageItem.dataset.filename;
+        if (selectedFolders.has(folderOf(imageItem))) {
+            checked ? excludedImages.delete(filename) : excludedImages.add(filename);
+        } else {
+            checked ? selectedImages.add(filename) : selectedImages.delete(filename);
+        }
+    };
+
+    const clearSelection = () => {
+        selectedImages.clear();
+        selectedFolders.clear();
+        excludedImages.clear();
+        lastSelectedImage = null;
+        document.querySelectorAll('.image-item .checkbox, .heading-checkbox').forEach(checkbox => {
+            checkbox.checked = false;
+        });
+        updateConfirmDeletionButtonState();
+        updateStatusButtonsState();
+    };
+
+    // The selection as an expression for the /api/selection endpoints
+    const buildSelection = () => {
+        const selection = {
+            folders: Array.from(selectedFolders),
+            recursive: false, // A heading selects the images shown under it; subfolders have their own headings
+            filenames: expandSelectionWithClusters(selectedImages),
+            exclude: Array.from(excludedImages)
+        };
+        if (selectedFolders.size > 0 && dateFilter.value !== 'all') {
+            selection.date = dateFilter.value; // Only the images shown under the selected headings
+        }
+        return selection;
+    };
+
+    // Selecting a collapsed cluster's representative selects the whole cluster
+    const expandSelectionWithClusters = (filenames) => {
+        const expanded = new Set(filenames);
+        duplicateClusters.forEach(cluster => {
+            if (!expandedClusters.has(cluster.id) && isImageSelected(cluster.representative)) {
+                cluster.filenames.forEach(filename => expanded.add(filename));
+            }
+        });
+        return Array.from(expanded);
+    };
+
+    // Whether a subtree's aggregates (node.stats, kept by the server) rule out any image for the
+    // date filter, so it can be skipped without walking it. Nodes without aggregates are walked.
+    const subtreeIsEmpty = (node, filterDate) => {
+        const stats = node.stats;
+        if (!stats) return false;
+        if (stats.images === 0) return true;
+        return filterDate !== 'all' && (!stats.first_date || filterDate < stats.first_date || filterDate > stats.last_date);
+    };
+
     // Function to render the gallery based on data
     const renderGallery = (data, filterDate = 'all') => {
         galleryContainer.innerHTML = '';
@@ -214,6 +360,10 @@ document.addEventListener('DOMContentLoaded', () => {
         let tocHtmlAccumulator = '';
 
         const renderNode = (node, level, currentPath = '') => {
+            if (subtreeIsEmpty(node, filterDate)) {
+                return { sectionHtml: '', nodeTocHtml: '', hasRenderedContent: false };
+            }
+
             // 1. Filter this node's direct images
             const filteredImages = (node.images || []).filter(img => {
                 return filterDate === 'all' || img.modification_date === filterDate;
@@ -249,7 +399,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 const headingId = `heading-${sanitizedHeadingText}-${uniqueHash}-${level}`;
 
                 currentSectionHtml += `<div class="gallery-section" id="${headingId}">`;
-                currentSectionHtml += `<h${level + 1}><input type="checkbox" class="heading-checkbox" data-heading-id="${headingId}"> ${headingText}</h${level + 1}>`;
+                currentSectionHtml += `<h${level + 1}><input type="checkbox" class="heading-checkbox" data-heading-id="${headingId}" data-path="${headingText}" ${selectedFolders.has(headingText) ? 'checked' : ''}> ${headingText}</h${level + 1}>`;
 
                 // Comment form - only display if there are direct images in this node
                 if (hasDirectImages) {
@@ -263,14 +413,16 @@ document.addEventListener('DOMContentLoaded', () => {
 `;
                 filteredImages.forEach(image => {
                     const imageUrl = `/images/${galleryName}/${image.filename}`;
-                    const placeholderUrl = `/static/images/placeholder.jpg`;
+                    const placeholderUrl = placeholderUrlOf(image);
+                    // Known dimensions let the browser reserve the image's box before anything loads
+                    const dimensions = image.width && image.height ? `width="${image.width}" height="${image.height}"` : '';
                     const displayName = image.filename.substring(0, image.filename.lastIndexOf('_'));
                     const imageStatusClass = image.status === 'good' ? 'good-image' : (image.status === 'bad' ? 'bad-image' : '');
 
                     currentSectionHtml += `
                         <div class="image-item ${imageStatusClass}" data-filename="${image.filename}" data-status="${image.status}">
-                            <input type="checkbox" class="checkbox" ${selectedImages.has(image.filename) ? 'checked' : ''}>
-                            <img src="${placeholderUrl}" data-src="${imageUrl}" alt="${image.filename}" class="lazyload">
+                            <input type="checkbox" class="checkbox" ${selectedImages.has(image.filename) || (selectedFolders.has(headingText) && !excludedImages.has(image.filename)) ? 'checked' : ''}>
+                            <img src="${placeholderUrl}" data-src="${imageUrl}" alt="${image.filename}" ${dimensions} class="lazyload${image.placeholder ? ' has-preview' : ''}">
                             <p>${displayName}</p>
                         </div>
                     `;
@@ -279,7 +431,11 @@ document.addEventListener('DOMContentLoaded', () => {
                 currentSectionHtml += `</div>`;
 
                 // Also create the TOC entry for this heading
-                nodeTocHtml += `<li class="level-${level}"><a href="#${headingId}">${headingText}</a>`;
+                // Counts cover the folder and its subfolders, so they are only shown unfiltered
+                const tocCount = node.stats && filterDate === 'all'
+                    ? ` <span class="toc-count" title="${node.stats.good} good, ${node.stats.bad} bad, ${node.stats.neutral} neutral">${node.stats.good}/${node.stats.images}</span>`
+                    : '';
+                nodeTocHtml += `<li class="level-${level}"><a href="#${headingId}">${headingText}${tocCount}</a>`;
                 // If this node has children with content, their TOCs should be nested.
                 if (childrenAccumulatedTocHtml) {
                     nodeTocHtml += `<ul>${childrenAccumulatedTocHtml}</ul>`;
@@ -320,17 +476,12 @@ document.addEventListener('DOMContentLoaded', () => {
 
                 const targetElement = document.querySelector(this.getAttribute('href'));
                 if (targetElement) {
-                    const headerHeight = parseFloat(getComputedStyle(document.documentElement).getPropertyValue('--header-height'));
-                    const extraOffset = 20; // Add a little extra margin
-                    const elementPosition = targetElement.getBoundingClientRect().top + window.pageYOffset;
-                    window.scrollTo({
-                        top: elementPosition - headerHeight - extraOffset,
-                        behavior: 'auto' // Ensure instant scroll
-                    });
+                    scrollToElement(targetElement);
                 }
             });
         });
 
+        applyDuplicateCollapsing();
         // Apply lazy loading
         applyLazyLoading();
         // Add event listeners for image selection
@@ -341,6 +492,184 @@ document.addEventListener('DOMContentLoaded', () => {
         window.setupImageViewer();
     };
 
+    // Expands an image's stored placeholder ('<w>x<h>:<base64 RGB>', a few colour cells in the
+    // image's aspect ratio) into a tiny bitmap the browser scales up smoothly, so an unloaded tile
+    // shows a blurred preview framed like the image instead of the generic placeholder
+    const DEFAULT_PLACEHOLDER_URL = '/static/images/placeholder.jpg';
+    const placeholderUrls = new Map();
+    const placeholderUrlOf = (image) => {
+        if (!image.placeholder) return DEFAULT_PLACEHOLDER_URL;
+        let url = placeholderUrls.get(image.placeholder);
+        if (url) return url;
+        try {
+            const [size, encoded] = image.placeholder.split(':');
+            const [width, height] = size.split('x').map(Number);
+            const rgb = atob(encoded);
+            if (!(width > 0 && height > 0) || rgb.length !== width * height * 3) return DEFAULT_PLACEHOLDER_URL;
+            // An uncompressed 24-bit BMP: rows bottom-up, BGR, padded to 4 bytes
+            const rowSize = Math.ceil(width * 3 / 4) * 4;
+            const bytes = new Uint8Array(54 + rowSize * height);
+            const view = new DataView(bytes.buffer);
+            bytes[0] = 0x42; bytes[1] = 0x4D; // 'BM'
+            view.setUint32(2, bytes.length, true);
+            view.setUint32(10, 54, true); // Pixel data offset
+            view.setUint32(14, 40, true); // BITMAPINFOHEADER
+            view.setInt32(18, width, true);
+            view.setInt32(22, height, true);
+            view.setUint16(26, 1, true); // Planes
+            view.setUint16(28, 24, true); // Bits per pixel
+            view.setUint32(34, rowSize * height, true);
+            for (let y = 0; y < height; y++) {
+                const row = 54 + (height - 1 - y) * rowSize;
+                for (let x = 0; x < width; x++) {
+                    const source = (y * width + x) * 3;
+                    bytes[row + x * 3] = rgb.charCodeAt(source + 2);
+                    bytes[row + x * 3 + 1] = rgb.charCodeAt(source + 1);
+                    bytes[row + x * 3 + 2] = rgb.charCodeAt(source);
+                }
+            }
+            url = `data:image/bmp;base64,${btoa(String.fromCharCode(...bytes))}`;
+        } catch (error) {
+            return DEFAULT_PLACEHOLDER_URL;
+        }
+        placeholderUrls.set(image.placeholder, url);
+        return url;
+    };
+
+    // Fetches the images entering the viewport in batches (POST /api/images/batch) instead of one
+    // request each. Frames are decoded as they stream in, so each image shows as soon as it arrives.
+    const imageBatcher = (() => {
+        const MAX_BATCH = 48; // Below the server's IMAGE_BATCH_MAX_FILES
+        const MAX_IN_FLIGHT = 4;
+        const MAX_CACHED_URLS = 1000;
+        const objectUrls = new Map(); // filename -> object URL, least recently used first
+        const waiting = new Map(); // filename -> images to fill, for queued and in-flight files
+        let queued = [];
+        let inFlight = 0;
+        let flushScheduled = false;
+
+        const show = (img, url) => {
+            img.src = url;
+            img.classList.remove('lazyload');
+        };
+
+        const cacheUrl = (filename, url) => {
+            objectUrls.set(filename, url);
+            if (objectUrls.size > MAX_CACHED_URLS) {
+                // Displayed images keep their decoded pixels; a re-render fetches them again
+                const [oldest, oldestUrl] = objectUrls.entries().next().value;
+                objectUrls.delete(oldest);
+                URL.revokeObjectURL(oldestUrl);
+            }
+        };
+
+        const settle = (filename, url) => {
+            (waiting.get(filename) || []).forEach(img => show(img, url || img.dataset.src));
+            waiting.delete(filename);
+        };
+
+        // Parses [4-byte header length][JSON header][body] frames off the streamed response.
+        // Chunks are only copied once, into the part they belong to.
+        const readFrames = async (response, onFrame) => {
+            const reader = response.body.getReader();
+            const chunks = [];
+            let available = 0;
+            const take = (length) => {
+                const out = new Uint8Array(length);
+                let filled = 0;
+                while (filled < length) {
+                    const chunk = chunks[0];
+                    const count = Math.min(chunk.length, length - filled);
+                    out.set(chunk.subarray(0, count), filled);
+                    filled += count;
+                    if (count === chunk.length) chunks.shift();
+                    else chunks[0] = chunk.subarray(count);
+                }
+                available -= length;
+                return out;
+            };
+            let header = null;
+            let needed = 4;
+            for (;;) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                chunks.push(value);
+                available += value.length;
+                while (available >= needed) {
+                    if (header === null) {
+                        needed = new DataView(take(4).buffer).getUint32(0);
+                        header = undefined; // Length read, JSON header next
+                    } else if (header === undefined) {
+                        header = JSON.parse(new TextDecoder().decode(take(needed)));
+                        needed = header.size;
+                    } else {
+                        onFrame(header, take(needed));
+                        header = null;
+                        needed = 4;
+                    }
+                }
+            }
+        };
+
+        const fetchBatch = async (batch) => {
+            inFlight++;
+            try {
+                const response = await fetch(`/gallery/${galleryName}/api/images/batch`, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ filenames: batch }),
+                });
+                if (!response.ok || !response.body) throw new Error(`HTTP ${response.status}`);
+                await readFrames(response, (header, body) => {
+                    if (header.error) {
+                        settle(header.filename, null); // The single-image route reports the error
+                        return;
+                    }
+                    const url = URL.createObjectURL(new Blob([body], { type: header.type }));
+                    cacheUrl(header.filename, url);
+                    settle(header.filename, url);
+                });
+            } catch (error) {
+                console.error('Error fetching image batch:', error);
+            } finally {
+                // Images the response did not deliver fall back to one request each
+                batch.forEach(filename => settle(filename, objectUrls.get(filename)));
+                inFlight--;
+                flush();
+            }
+        };
+
+        const flush = () => {
+            flushScheduled = false;
+            while (queued.length > 0 && inFlight < MAX_IN_FLIGHT) {
+                fetchBatch(queued.splice(0, MAX_BATCH));
+            }
+        };
+
+        return {
+            request(img, filename) {
+                const cached = objectUrls.get(filename);
+                if (cached) {
+                    objectUrls.delete(filename); // Refresh its recency
+                    objectUrls.set(filename, cached);
+                    show(img, cached);
+                    return;
+                }
+                if (waiting.has(filename)) { // Already queued or in flight
+                    waiting.get(filename).push(img);
+                    return;
+                }
+                waiting.set(filename, [img]);
+                queued.push(filename);
+                if (!flushScheduled) {
+                    // One task later, so all images of one observer callback (and scroll frame) share a batch
+                    flushScheduled = true;
+                    setTimeout(flush, 0);
+                }
+            },
+        };
+    })();
+
     // Lazy loading implementation
     const applyLazyLoading = () => {
         const lazyImages = document.querySelectorAll('img.lazyload');
@@ -348,8 +677,13 @@ document.addEventListener('DOMContentLoaded', () => {
             entries.forEach(entry => {
                 if (entry.isIntersecting) {
                     const img = entry.target;
-                    img.src = img.dataset.src;
-                    img.classList.remove('lazyload');
+                    const filename = img.closest('.image-item')?.dataset.filename;
+                    if (filename && window.fetch && window.ReadableStream) {
+                        imageBatcher.request(img, filename);
+                    } else {
+                        img.src = img.dataset.src;
+                        img.classList.remove('lazyload');
+                    }
                     observer.unobserve(img);
                 }
             });
@@ -360,24 +694,23 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     };
 
-    // Populate date filter dropdown
-    const populateDateFilter = (data) => {
-        const dates = new Set();
-        const extractDates = (node) => {
-            if (node.images) {
-                node.images.forEach(img => dates.add(img.modification_date));
-            }
-            if (node.children) {
-                node.children.forEach(child => extractDates(child));
+    // Populate date filter dropdown from the server-side date index (EXIF capture dates)
+    const populateDateFilter = async () => {
+        let dateCounts = {};
+        try {
+            const response = await fetch(`/gallery/${galleryName}/api/dates`);
+            if (response.ok) {
+                dateCounts = await response.json();
             }
-        };
-        extractDates(data);
+        } catch (error) {
+            console.error('Error fetching date index:', error);
+        }
 
         dateFilter.innerHTML = '<option value="all">All Dates</option>';
-        Array.from(dates).sort().forEach(date => {
+        Object.keys(dateCounts).sort().forEach(date => {
             const option = document.createElement('option');
             option.value = date;
-            option.textContent = date;
+            option.textContent = `${date} (${dateCounts[date]})`;
             dateFilter.appendChild(option);
         });
     };
@@ -386,6 +719,76 @@ document.addEventListener('DOMContentLoaded', () => {
         renderGallery(currentGalleryData, event.target.value);
     });
 
+    // Scrolls an element just below the fixed header
+    const scrollToElement = (targetElement) => {
+        const headerHeight = parseFloat(getComputedStyle(document.documentElement).getPropertyValue('--header-height'));
+        const extraOffset = 20; // Add a little extra margin
+        const elementPosition = targetElement.getBoundingClientRect().top + window.pageYOffset;
+        window.scrollTo({
+            top: elementPosition - headerHeight - extraOffset,
+            behavior: 'auto' // Ensure instant scroll
+        });
+    };
+
+    // Search over folder paths, comments and file names, answered by the server-side index
+    let searchTimer = null;
+    let searchRequest = 0; // Responses to superseded queries are dropped
+
+    // The rendered element of a search result: its image, or the first section at or below its folder
+    const findSearchTarget = (result) => {
+        if (result.kind === 'image') {
+            return galleryContainer.querySelector(`.image-item[data-filename="${CSS.escape(result.filename)}"]`);
+        }
+        const headings = Array.from(galleryContainer.querySelectorAll('.heading-checkbox'));
+        const heading = headings.find(checkbox => checkbox.dataset.path === result.path)
+            || headings.find(checkbox => checkbox.dataset.path.startsWith(`${result.path}/`));
+        return heading ? heading.closest('.gallery-section') : null;
+    };
+
+    const showSearchResults = (results) => {
+        searchResults.innerHTML = '';
+        results.forEach(result => {
+            const item = document.createElement('li');
+            const name = document.createElement('span');
+            name.textContent = result.kind === 'folder' ? `\u{1F4C1} ${result.name}` : result.name;
+            const path = document.createElement('span');
+            path.classList.add('search-path');
+            path.textContent = result.kind === 'folder' ? result.path : (result.path || '/');
+            item.append(name, path);
+            item.addEventListener('click', () => {
+                const target = findSearchTarget(result);
+                if (!target) {
+                    showMessage('Not shown with the current date filter.', 'info');
+                    return;
+                }
+                scrollToElement(target);
+                target.classList.add('search-hit');
+                setTimeout(() => target.classList.remove('search-hit'), 2000);
+            });
+            searchResults.appendChild(item);
+        });
+    };
+
+    searchInput.addEventListener('input', () => {
+        clearTimeout(searchTimer);
+        const query = searchInput.value.trim();
+        if (!query) {
+            searchRequest++;
+            searchResults.innerHTML = '';
+            return;
+        }
+        searchTimer = setTimeout(async () => {
+            const requestId = ++searchRequest;
+            try {
+                const response = await fetch(`/gallery/${galleryName}/api/search?q=${encodeURIComponent(query)}&limit=30`);
+                if (requestId !== searchRequest) return;
+                showSearchResults(response.ok ? (await response.json()).results : []);
+            } catch (error) {
+                console.error('Error searching gallery:', error);
+            }
+        }, 150);
+    });
+
     // Upload functionality
     fileElem.addEventListener('change', (e) => handleFiles(e.target.files), false);
 
@@ -403,44 +806,10 @@ document.addEventListener('DOMContentLoaded', () => {
         const formData = new FormData();
         formData.append('file', file);
 
-        // Show initial "Initiating" message
+        // Show initial "Initiating" message; the job's progress then arrives as job_update events
         showProgressBarToast('initiating');
 
-        let progressInterval = null;
-
-        const checkProgress = async () => {
-            try {
-                const response = await fetch(`/gallery/${galleryName}/upload_status`);
-                if (response.ok) {
-                    const data = await response.json();
-                    // When progress is reported as a number, start showing it.
-                    if (data.progress !== null && typeof data.progress === 'number') {
-                        if (data.progress >= 0) {
-                            showProgressBarToast(data.progress);
-                        }
-                        if (data.progress >= 100 || data.progress === -1) {
-                            clearInterval(progressInterval);
-                            if (data.progress === -1) {
-                                showMessage('Upload processing failed on the server.', 'error');
-                                if (progressBarToast) {
-                                    progressBarToast.classList.remove('show');
-                                    progressBarToast.parentNode.removeChild(progressBarToast);
-                                    progressBarToast = null;
-                                }
-                            }
-                        }
-                    }
-                    // If data.progress is null, we just keep showing the "Initiating" message
-                }
-            } catch (error) {
-                console.error('Error fetching upload status:', error);
-            }
-        };
-
         try {
-            // Start polling for progress
-            progressInterval = setInterval(checkProgress, 1000);
-
             const response = await fetch(`/gallery/${galleryName}/upload`, {
                 method: 'POST',
                 body: formData,
@@ -449,31 +818,13 @@ document.addEventListener('DOMContentLoaded', () => {
             if (!response.ok) {
                 const error = await response.json();
                 showMessage(`Upload failed: ${error.error}`, 'error');
-                if (progressBarToast) {
-                    progressBarToast.classList.remove('show');
-                    progressBarToast.parentNode.removeChild(progressBarToast);
-                    progressBarToast = null;
-                }
-                clearInterval(progressInterval); // Stop polling on failure
+                hideProgressBarToast();
             }
-
         } catch (error) {
             console.error('Error uploading file:', error);
             showMessage('An error occurred during upload.', 'error');
-            if (progressBarToast) {
-                progressBarToast.classList.remove('show');
-                progressBarToast.parentNode.removeChild(progressBarToast);
-                progressBarToast = null;
-            }
-            clearInterval(progressInterval); // Stop polling on error
+            hideProgressBarToast();
         } finally {
-            // A failsafe to clear the interval after the upload process should have reasonably completed
-            setTimeout(() => {
-                 if (progressInterval) {
-                    clearInterval(progressInterval);
-                 }
-            }, 300000); // 5 minutes failsafe
-            
             fileElem.value = '';
         }
     };
@@ -494,22 +845,11 @@ document.addEventListener('DOMContentLoaded', () => {
                     const [start, end] = [Math.min(startIndex, endIndex), Math.max(startIndex, endIndex)];
 
                     for (let i = start; i <= end; i++) {
-                        const imgFilename = allImages[i].dataset.filename;
-                        const imgCheckbox = allImages[i].querySelector('.checkbox');
-                        if (e.target.checked) {
-                            selectedImages.add(imgFilename);
-                            imgCheckbox.checked = true;
-                        } else {
-                            selectedImages.delete(imgFilename);
-                            imgCheckbox.checked = false;
-                        }
+                        setImageSelected(allImages[i], e.target.checked);
+                        allImages[i].querySelector('.checkbox').checked = e.target.checked;
                     }
                 } else {
-                    if (e.target.checked) {
-                        selectedImages.add(filename);
-                    } else {
-                        selectedImages.delete(filename);
-                    }
+                    setImageSelected(imageItem, e.target.checked);
                 }
                 lastSelectedImage = filename;
                 
@@ -535,17 +875,17 @@ document.addEventListener('DOMContentLoaded', () => {
                 const section = e.target.closest('.gallery-section');
                 const isChecked = e.target.checked;
 
-                // Get all image checkboxes within this section and its child sections
-                const imageCheckboxes = section.querySelectorAll('.image-item .checkbox');
-
-                imageCheckboxes.forEach(checkbox => {
+                // The folder is selected as a whole; its images are not enumerated
+                if (isChecked) {
+                    selectedFolders.add(e.target.dataset.path);
+                } else {
+                    selectedFolders.delete(e.target.dataset.path);
+                }
+                section.querySelectorAll('.image-item .checkbox').forEach(checkbox => {
                     const filename = checkbox.closest('.image-item').dataset.filename;
                     checkbox.checked = isChecked;
-                    if (isChecked) {
-                        selectedImages.add(filename);
-                    } else {
-                        selectedImages.delete(filename);
-                    }
+                    selectedImages.delete(filename);
+                    excludedImages.delete(filename);
                 });
                 updateConfirmDeletionButtonState();
                 updateStatusButtonsState(); // Update status buttons when selection changes
@@ -569,11 +909,11 @@ document.addEventListener('DOMContentLoaded', () => {
     };
 
     const updateConfirmDeletionButtonState = () => {
-        confirmDeletionBtn.disabled = selectedImages.size === 0;
+        confirmDeletionBtn.disabled = !hasSelection();
     };
 
     const updateStatusButtonsState = () => {
-        const isDisabled = selectedImages.size === 0;
+        const isDisabled = !hasSelection();
         statusGoodBtn.disabled = isDisabled;
         statusBadBtn.disabled = isDisabled;
         statusNeutralBtn.disabled = isDisabled;
@@ -584,42 +924,70 @@ document.addEventListener('DOMContentLoaded', () => {
     statusBadBtn.addEventListener('click', () => updateImageStatus('bad'));
     statusNeutralBtn.addEventListener('click', () => updateImageStatus('neutral'));
 
+    // Downloads the selection, or every good image, as a zip. A form submission (rather than fetch)
+    // lets the browser write the streamed archive straight to disk.
+    downloadBtn.addEventListener('click', () => {
+        const selection = hasSelection() ? buildSelection() : { folders: [''], status: 'good' };
+        const form = document.createElement('form');
+        form.method = 'POST';
+        form.action = `/gallery/${galleryName}/api/selection/download`;
+        const field = document.createElement('input');
+        field.type = 'hidden';
+        field.name = 'selection';
+        field.value = JSON.stringify(selection);
+        form.appendChild(field);
+        document.body.appendChild(form);
+        form.submit();
+        form.remove();
+    });
+
+    // Applies a status delta returned by the server to the rendered tree, instead of re-fetching it
+    const applyStatusDelta = (filenames, status) => {
+        const changed = new Set(filenames);
+        // Each entry carries the node's ancestors, whose aggregates move with its images
+        const stack = [[currentGalleryData, []]];
+        while (stack.length > 0) {
+            const [node, ancestors] = stack.pop();
+            const chain = [...ancestors, node];
+            (node.images || []).forEach(image => {
+                if (!changed.has(image.filename)) return;
+                const previous = image.status || 'neutral';
+                image.status = status;
+                chain.forEach(folder => {
+                    if (!folder.stats) return;
+                    if (previous in folder.stats) folder.stats[previous] -= 1;
+                    if (status in folder.stats) folder.stats[status] += 1;
+                });
+            });
+            (node.children || []).forEach(child => {
+                if (!subtreeIsEmpty(child, 'all')) stack.push([child, chain]);
+            });
+        }
+    };
+
     const updateImageStatus = async (status) => {
-        if (selectedImages.size === 0) {
+        if (!hasSelection()) {
             showMessage('No images selected to update status.', 'info');
             return;
         }
 
         try {
-            const response = await fetch(`/gallery/${galleryName}/update_status`, {
+            const response = await fetch(`/gallery/${galleryName}/api/selection/status`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                 },
-                body: JSON.stringify({ image_paths: Array.from(selectedImages), status: status }),
+                body: JSON.stringify({ selection: buildSelection(), status: status }),
             });
 
             if (response.ok) {
                 const result = await response.json();
-                showMessage(result.message, 'success');
-
-                // Uncheck all currently selected images and clear the selection
-                selectedImages.forEach(filename => {
-                    const imageItem = document.querySelector(`.image-item[data-filename="${filename}"]`);
-                    if (imageItem) {
-                        const checkbox = imageItem.querySelector('.checkbox');
-                        if (checkbox) {
-                            checkbox.checked = false;
-                        }
-                    }
-                });
-                selectedImages.clear();
-                lastSelectedImage = null; // Reset last selected image
-                updateConfirmDeletionButtonState(); // Update button states after clearing selection
-                updateStatusButtonsState(); // Update status buttons after clearing selection
+                showMessage(`${result.changed} of ${result.matched} selected images marked ${status}`, 'success');
 
-                // Re-fetch and render gallery to reflect the new status visually
-                fetchAndRenderGallery();
+                // Clear the selection and show the new statuses
+                clearSelection();
+                applyStatusDelta(result.filenames, status);
+                renderGallery(currentGalleryData, dateFilter.value);
             } else {
                 const error = await response.json();
                 showMessage(`Failed to update image status: ${error.error}`, 'error');
@@ -633,28 +1001,29 @@ document.addEventListener('DOMContentLoaded', () => {
 
     confirmDeletionBtn.addEventListener('click', async () => {
         if (confirmDeletionBtn.disabled) return;
-        if (selectedImages.size === 0) {
+        if (!hasSelection()) {
             showMessage('No images selected for deletion.', 'info');
             return;
         }
 
-        if (!confirm(`Are you sure you want to delete ${selectedImages.size} selected items?`)) {
+        const selectedCount = document.querySelectorAll('.image-item .checkbox:checked').length;
+        if (!confirm(`Are you sure you want to delete ${selectedCount} selected items?`)) {
             return;
         }
 
         try {
-            const response = await fetch(`/gallery/${galleryName}/delete`, {
+            const response = await fetch(`/gallery/${galleryName}/api/selection/delete`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                 },
-                body: JSON.stringify({ paths: Array.from(selectedImages) }),
+                body: JSON.stringify({ selection: buildSelection() }),
             });
 
             if (response.ok) {
                 const result = await response.json();
-                showMessage(result.message, 'success');
-                selectedImages.clear();
+                showMessage(`${result.deleted} images deleted`, 'success');
+                clearSelection();
                 fetchAndRenderGallery(); // Re-render gallery
             } else {
                 const error = await response.json();
@@ -728,6 +1097,7 @@ document.addEventListener('DOMContentLoaded', () => {
             const response = await fetch(`/gallery/${galleryName}/api/version/${selectedVersion}`);
             if (response.ok) {
                 const versionData = await response.json();
+                currentGalleryEtag = null; // The current version must be re-rendered after the preview
                 renderGallery(versionData); // Preview the selected version
             } else {
                 showMessage('Failed to load version data.', 'error');
@@ -776,6 +1146,8 @@ document.addEventListener('DOMContentLoaded', () => {
             return node; // Return the original node if no filter is applied
         }
 
+        if (subtreeIsEmpty(node, filterDate)) return null;
+
         // Filter this node's direct images
         const filteredImages = (node.images || []).filter(img => img.modification_date === filterDate);
 
@@ -878,13 +1250,18 @@ document.addEventListener('DOMContentLoaded', () => {
     // Initialize Socket.IO
     const socket = io({ transports: ['polling', 'websocket'] }); // Databricks環境での安定性向上のため、ポーlingを優先
 
+    let connectedBefore = false;
     socket.on('connect', () => {
         console.log('Connected to WebSocket');
+        // Job events are scoped to the gallery's room
+        socket.emit('join_gallery', { gallery_name: galleryName });
+        // Events sent while disconnected are lost, so catch up on the current state instead
+        fetchJobs();
+        if (connectedBefore) fetchAndRenderGallery();
+        connectedBefore = true;
     });
 
-    socket.on('upload_progress', (data) => {
-        showProgressBarToast(data.progress);
-    });
+    socket.on('job_update', applyJobUpdate);
 
     socket.on('gallery_updated', (data) => {
         console.log('Gallery updated via WebSocket:', data.message);
@@ -894,23 +1271,10 @@ document.addEventListener('DOMContentLoaded', () => {
         fetchAndRenderGallery(); // Re-fetch all data and re-render the gallery
     });
 
-    socket.on('upload_failed', (data) => {
-        console.error('Upload failed via WebSocket:', data.message);
-        showMessage(`Upload failed: ${data.message}`, 'error');
-        // Hide progress bar toast on failure
-        if (progressBarToast) {
-            progressBarToast.classList.remove('show');
-            progressBarToast.parentNode.removeChild(progressBarToast);
-            progressBarToast = null;
-            progressBarInner = null;
-        }
-    });
-
     // Initial fetch and render
     fetchAndRenderGallery();
     updateConfirmDeletionButtonState();
     updateStatusButtonsState(); // Initialize status button states
-    checkUploadStatusAndDisplayProgressBar();
 
     // Modify fetchAndRenderGallery to not rely on parsing HTML for data
     // Instead, it should fetch data from a dedicated API endpoint
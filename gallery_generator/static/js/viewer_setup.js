@@ -1,6 +1,81 @@
 document.addEventListener('DOMContentLoaded', () => {
     const galleryContainer = document.getElementById('gallery-container');
 
+    // How far around the viewed image to prefetch, and within what limits
+    const PREFETCH_NEIGHBOURS = 3; // On each side
+    const PREFETCH_CONCURRENCY = 2;
+    const PREFETCH_BUDGET_BYTES = 96 * 1024 * 1024;
+
+    // Fetches images the viewer is likely to show next into object URLs. Entries are kept
+    // least recently used first and evicted beyond the byte budget, except the ones around
+    // the image being viewed.
+    const prefetcher = (() => {
+        const entries = new Map(); // image URL -> { url, size }
+        const inFlight = new Set();
+        let queue = [];
+        let wanted = new Set();
+        let bytes = 0;
+
+        const evict = () => {
+            for (const [src, entry] of entries) {
+                if (bytes <= PREFETCH_BUDGET_BYTES) break;
+                if (wanted.has(src)) continue;
+                entries.delete(src);
+                bytes -= entry.size;
+                URL.revokeObjectURL(entry.url);
+            }
+        };
+
+        const pump = () => {
+            while (inFlight.size < PREFETCH_CONCURRENCY && queue.length > 0) {
+                const src = queue.shift();
+                if (entries.has(src) || inFlight.has(src)) continue;
+                inFlight.add(src);
+                fetch(src)
+                    .then(response => (response.ok ? response.blob() : null))
+                    .then(blob => {
+                        if (!blob || !wanted.has(src)) return; // Browsing moved on while it loaded
+                        entries.set(src, { url: URL.createObjectURL(blob), size: blob.size });
+                        bytes += blob.size;
+                        evict();
+                    })
+                    .catch(error => console.warn('Prefetch failed:', src, error))
+                    .finally(() => {
+                        inFlight.delete(src);
+                        pump();
+                    });
+            }
+        };
+
+        return {
+            // The URL to show an image from: its prefetched copy if there is one
+            urlFor(src) {
+                const entry = entries.get(src);
+                if (!entry) return src;
+                entries.delete(src); // Most recently used
+                entries.set(src, entry);
+                return entry.url;
+            },
+            // Prefetches `sources` in order, dropping whatever was queued for an earlier position
+            prefetch(sources) {
+                wanted = new Set(sources);
+                queue = sources.filter(src => !entries.has(src));
+                pump();
+            },
+        };
+    })();
+
+    // The image URLs around `index` in viewing order, nearest first
+    const neighboursOf = (images, index) => {
+        const sources = [];
+        for (let distance = 1; distance <= PREFETCH_NEIGHBOURS; distance++) {
+            [index + distance, index - distance].forEach(i => {
+                if (i >= 0 && i < images.length && images[i].dataset.src) sources.push(images[i].dataset.src);
+            });
+        }
+        return sources;
+    };
+
     // Function to initialize Viewer.js on a given element
     const initializeViewer = (element) => {
         if (element) {
@@ -18,10 +93,16 @@ document.addEventListener('DOMContentLoaded', () => {
                 transition: true,
                 fullscreen: true,
                 keyboard: true,
-                url: 'data-src', // Use data-src for lazy loaded images
+                // Full-size images come from data-src, so images still showing their placeholder
+                // in the grid can be viewed too; they load when viewed, or earlier when prefetched
+                url(image) {
+                    return prefetcher.urlFor(image.dataset.src || image.src);
+                },
                 filter(image) {
-                    // Only show images that are not placeholders and are part of the current view
-                    return image.classList.contains('lazyload') === false;
+                    return Boolean(image.dataset.src);
+                },
+                viewed(event) {
+                    prefetcher.prefetch(neighboursOf(viewer.images, event.detail.index));
                 },
             });
             return viewer;
@@ -29,15 +110,14 @@ document.addEventListener('DOMContentLoaded', () => {
         return null;
     };
 
-    // Re-initialize viewer when gallery content changes (e.g., after upload or filter)
-    // This function will be called from gallery.js after rendering the gallery
+    // Called from gallery.js after every render. The viewer persists across renders (including
+    // while it is open) and only re-reads its image list from the container.
     window.setupImageViewer = () => {
-        // Destroy existing viewer instance if any
         if (galleryContainer.viewer) {
-            galleryContainer.viewer.destroy();
+            galleryContainer.viewer.update();
+        } else {
+            galleryContainer.viewer = initializeViewer(galleryContainer);
         }
-        // Initialize new viewer instance
-        galleryContainer.viewer = initializeViewer(galleryContainer);
     };
 
     // Initial setup
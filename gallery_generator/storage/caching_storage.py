@@ -0,0 +1,269 @@
+import os
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from .storage import Storage
+from ..metrics import registry as default_registry
+
+logger = logging.getLogger(__name__)
+
+CACHE_REQUESTS = 'gallery_storage_cache_requests_total'
+
+# Documents that are rewritten in place (gallery_data.json, manifests, version
+# sidecars, the catalog). They go to the memory tier with a TTL when it is
+# enabled, and straight to the backend otherwise; everything else (original
+# images, written once under content-hashed names) goes to disk.
+MEMORY_SUFFIXES = ('.json', '.version')
+
+# Directories of documents written once under content-hashed names (the sharded
+# backend's shards). They never change, so they go to disk like images.
+IMMUTABLE_DIRECTORIES = ('shards',)
+
+
+class _DiskTier:
+    """Files cached in a local directory, evicted least-recently-used beyond `max_bytes`."""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # cache file name -> size
+        self._size = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # Keep what earlier processes cached, oldest access first
+        existing = []
+        for entry in os.scandir(directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                existing.append((stat.st_atime, entry.name, stat.st_size))
+        for _, name, size in sorted(existing):
+            self._entries[name] = size
+            self._size += size
+        self._evict()
+
+    @staticmethod
+    def _name(key: str) -> str:
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> bytes | None:
+        name = self._name(key)
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+        try:
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                return f.read()
+        except OSError:
+            self.discard(key) # Removed behind our back (e.g. by another process evicting)
+            return None
+
+    def contains(self, key: str) -> bool:
+        with self._lock:
+            return self._name(key) in self._entries
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        name = self._name(key)
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write {key} to the storage cache: {e}")
+            return
+        with self._lock:
+            self._size -= self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            self._size += len(data)
+        self._evict()
+
+    def discard(self, key: str):
+        name = self._name(key)
+        with self._lock:
+            self._size -= self._entries.pop(name, 0)
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while True:
+            with self._lock:
+                if self._size <= self.max_bytes or not self._entries:
+                    return
+                name, size = self._entries.popitem(last=False)
+                self._size -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+
+class _MemoryTier:
+    """Small documents kept in memory for `ttl` seconds, evicted least-recently-used beyond `max_bytes`."""
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict() # key -> (data, stored_at)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            data, stored_at = entry
+            if self.ttl and time.monotonic() - stored_at > self.ttl:
+                self._size -= len(self._entries.pop(key)[0])
+                return None
+            self._entries.move_to_end(key)
+            return data
+
+    def put(self, key: str, data: bytes):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[0])
+            if len(data) > self.max_bytes:
+                return
+            self._entries[key] = (data, time.monotonic())
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def discard(self, key: str):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[0])
+
+
+class _SingleFlight:
+    """Coalesces concurrent calls for the same key into one call whose result all callers share."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {} # key -> [event, result, exception]
+
+    def do(self, key: str, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = [threading.Event(), None, None]
+        if not leader:
+            call[0].wait()
+            if call[2] is not None:
+                raise call[2]
+            return call[1]
+        try:
+            call[1] = fn()
+            return call[1]
+        except Exception as e:
+            call[2] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call[0].set()
+
+
+class CachingStorage(Storage):
+    """
+    A read-through Storage decorator for slow (remote) backends with two tiers:
+
+    - a local-disk tier for files written once under content-hashed names,
+      i.e. original images and shards (see IMMUTABLE_DIRECTORIES), bounded
+      by `disk_max_bytes`;
+    - an optional in-memory tier for JSON documents (see MEMORY_SUFFIXES),
+      bounded by `memory_max_bytes`, whose entries expire after `memory_ttl`
+      seconds. It is off by default (`memory_ttl` 0): data managers read
+      these documents to modify and write them back, so a copy that another
+      process (e.g. a job worker) has since rewritten would overwrite its
+      changes. Enable it only when a single process writes the gallery data.
+
+    Concurrent misses for the same file are coalesced into one backend read,
+    `save` writes through to both the backend and the cache, and `delete`
+    invalidates. Writes and deletes made by other processes are not seen by
+    the disk tier, which is safe for immutable files only.
+    """
+
+    def __init__(self, inner: Storage, cache_dir: str, disk_max_bytes: int = 1024 ** 3,
+                 memory_max_bytes: int = 32 * 1024 * 1024, memory_ttl: float = 0, registry=None):
+        """
+        Args:
+            inner (Storage): The storage backend to wrap.
+            cache_dir (str): Local directory of the disk tier; kept across restarts.
+            disk_max_bytes (int): Size bound of the disk tier.
+            memory_max_bytes (int): Size bound of the memory tier.
+            memory_ttl (float): Seconds a JSON document is served from memory; 0 reads them from the backend.
+            registry (MetricsRegistry): Registry for hit/miss counters; defaults to the process-wide one.
+        """
+        self.inner = inner
+        self.disk = _DiskTier(cache_dir, disk_max_bytes)
+        self.memory = _MemoryTier(memory_max_bytes, memory_ttl) if memory_ttl > 0 else None
+        self._flight = _SingleFlight()
+        self.registry = registry or default_registry
+        self.registry.describe(CACHE_REQUESTS, 'counter', 'Storage cache lookups by tier and result.')
+
+    @staticmethod
+    def _key(file_path: str) -> str:
+        return os.path.normpath(file_path.replace('\\', '/')).lstrip('/')
+
+    def _tier(self, key: str):
+        """The tier caching `key`, or None for documents when the memory tier is off."""
+        if key.endswith(MEMORY_SUFFIXES) and not set(key.split('/')[:-1]) & set(IMMUTABLE_DIRECTORIES):
+            return self.memory
+        return self.disk
+
+    def save(self, file_path: str, data: bytes):
+        key = self._key(file_path)
+        self.inner.save(file_path, data)
+        tier = self._tier(key)
+        if tier is not None:
+            tier.put(key, data)
+
+    def load(self, file_path: str) -> bytes:
+        key = self._key(file_path)
+        tier = self._tier(key)
+        if tier is None:
+            return self.inner.load(file_path)
+        labels = {'tier': 'memory' if tier is self.memory else 'disk'}
+        data = tier.get(key)
+        if data is not None:
+            self.registry.inc(CACHE_REQUESTS, {**labels, 'result': 'hit'})
+            return data
+        self.registry.inc(CACHE_REQUESTS, {**labels, 'result': 'miss'})
+
+        def fetch():
+            fetched = self.inner.load(file_path)
+            tier.put(key, fetched)
+            return fetched
+        return self._flight.do(key, fetch)
+
+    def delete(self, file_path: str):
+        key = self._key(file_path)
+        tier = self._tier(key)
+        if tier is not None:
+            tier.discard(key)
+        self.inner.delete(file_path)
+
+    def list_files(self, directory_path: str) -> list[str]:
+        return self.inner.list_files(directory_path)
+
+    def exists(self, file_path: str) -> bool:
+        # A cached image still exists (it is only ever deleted through this storage or by
+        # another process, and then it is no longer referenced); anything else asks the backend
+        key = self._key(file_path)
+        if self._tier(key) is self.disk and self.disk.contains(key):
+            return True
+        return self.inner.exists(file_path)
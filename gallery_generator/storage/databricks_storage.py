@@ -1,9 +1,10 @@
 import os
+import logging
 import requests
 from dotenv import load_dotenv
 from .storage import Storage
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
 class DatabricksStorage(Storage):
     """
@@ -11,6 +12,8 @@ class DatabricksStorage(Storage):
     """
 
     def __init__(self):
+        # Credentials may come from a .env file; read when the backend is used, not on import
+        load_dotenv()
         self.instance = os.getenv("DATABRICKS_INSTANCE", "").rstrip('/')
         self.token = os.getenv("DATABRICKS_TOKEN")
         self.volume_path = f"/Volumes/{os.getenv('DATABRICKS_CATALOG')}/{os.getenv('DATABRICKS_SCHEMA')}/{os.getenv('DATABRICKS_VOLUME')}"
@@ -30,18 +33,17 @@ class DatabricksStorage(Storage):
         self.create_directories(os.path.dirname(file_path))
         
         api_url = self._get_api_url(file_path)
-        print(f"DEBUG: Attempting to save to API URL: {api_url}")
-        # print(f"DEBUG: Headers: {self.headers}") # Be careful with token in logs in production
+        logger.debug(f"Attempting to save to API URL: {api_url}")
         response = requests.put(
             api_url,
             headers=self.headers,
             data=data,
             params={"overwrite": "true"}
         )
-        print(f"DEBUG: Save response status code: {response.status_code}")
-        print(f"DEBUG: Save response text: {response.text}")
+        logger.debug(f"Save response status code: {response.status_code}")
+        logger.debug(f"Save response text: {response.text}")
         response.raise_for_status()
-        print(f"DEBUG: Save successful for {file_path}")
+        logger.debug(f"Save successful for {file_path}")
 
     def load(self, file_path: str) -> bytes:
         """
@@ -79,12 +81,12 @@ class DatabricksStorage(Storage):
         # which have a 'path' field.
         
         api_url = f"{self.instance}/api/2.0/fs/directories{full_volume_path}"
-        print(f"DEBUG: list_files API URL: {api_url}")
+        logger.debug(f"list_files API URL: {api_url}")
         response = requests.get(api_url, headers=self.headers)
-        print(f"DEBUG: list_files response status code: {response.status_code}")
+        logger.debug(f"list_files response status code: {response.status_code}")
         
         if response.status_code == 404:
-            print(f"DEBUG: Directory {directory_path} not found.")
+            logger.debug(f"Directory {directory_path} not found.")
             return [] # Directory not found, return empty list
         
         response.raise_for_status()
@@ -116,7 +118,7 @@ class DatabricksStorage(Storage):
                 # Extract filename from the full path
                 filename = os.path.basename(item['path'])
                 files_in_dir.append(filename)
-        print(f"DEBUG: Files found in {directory_path}: {files_in_dir}")
+        logger.debug(f"Files found in {directory_path}: {files_in_dir}")
         return files_in_dir
 
     def exists(self, file_path: str) -> bool:
@@ -156,26 +158,26 @@ class DatabricksStorage(Storage):
             dir_api_url = f"{self.instance}/api/2.0/fs/directories{self.volume_path}/{current_path}"
             
             # Check if directory exists before creating
-            print(f"DEBUG: Checking directory existence for: {dir_api_url}")
+            logger.debug(f"Checking directory existence for: {dir_api_url}")
             check_response = requests.get(dir_api_url, headers=self.headers)
-            print(f"DEBUG: Directory check response status code: {check_response.status_code}")
-            print(f"DEBUG: Directory check response text: {check_response.text}")
+            logger.debug(f"Directory check response status code: {check_response.status_code}")
+            logger.debug(f"Directory check response text: {check_response.text}")
 
             if check_response.status_code == 404:
-                print(f"DEBUG: Attempting to create directory: {dir_api_url}")
+                logger.debug(f"Attempting to create directory: {dir_api_url}")
                 try:
                     response = requests.put(dir_api_url, headers=self.headers)
-                    print(f"DEBUG: Create directory response status code: {response.status_code}")
-                    print(f"DEBUG: Create directory response text: {response.text}")
+                    logger.debug(f"Create directory response status code: {response.status_code}")
+                    logger.debug(f"Create directory response text: {response.text}")
                     response.raise_for_status()
-                    print(f"DEBUG: Directory {current_path} created successfully.")
+                    logger.debug(f"Directory {current_path} created successfully.")
                 except requests.exceptions.HTTPError as e:
-                    print(f"DEBUG: HTTPError during directory creation: {e}")
-                    print(f"DEBUG: Response status code: {e.response.status_code}")
-                    print(f"DEBUG: Response text: {e.response.text}")
+                    logger.debug(f"HTTPError during directory creation: {e}")
+                    logger.debug(f"Response status code: {e.response.status_code}")
+                    logger.debug(f"Response text: {e.response.text}")
                     # Ignore conflict errors if the directory was created by another process
                     # between our check and our put call (race condition).
                     if e.response.status_code != 409:
                         raise
             else:
-                print(f"DEBUG: Directory {current_path} already exists or other status: {check_response.status_code}")
+                logger.debug(f"Directory {current_path} already exists or other status: {check_response.status_code}")
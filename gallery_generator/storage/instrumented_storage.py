@@ -0,0 +1,81 @@
+import time
+from .storage import Storage
+from ..metrics import registry as default_registry
+
+CALLS = 'gallery_storage_calls_total'
+ERRORS = 'gallery_storage_errors_total'
+BYTES_WRITTEN = 'gallery_storage_bytes_written_total'
+BYTES_READ = 'gallery_storage_bytes_read_total'
+LATENCY = 'gallery_storage_latency_seconds'
+
+
+class InstrumentedStorage(Storage):
+    """
+    A Storage decorator that records call counts, errors, bytes written and
+    read, and latency histograms per operation and per gallery.
+
+    It is only put in front of a backend when STORAGE_METRICS_ENABLED is set,
+    so an uninstrumented deployment pays nothing.
+    """
+
+    def __init__(self, inner: Storage, backend: str, registry=None, per_gallery: bool = True):
+        """
+        Args:
+            inner (Storage): The storage backend to wrap.
+            backend (str): Backend label value, e.g. 'local' or 'databricks'.
+            registry (MetricsRegistry): Registry to record into; defaults to the process-wide one.
+            per_gallery (bool): Whether to label metrics with the gallery name.
+        """
+        self.inner = inner
+        self.backend = backend
+        self.registry = registry or default_registry
+        self.per_gallery = per_gallery
+        self.registry.describe(CALLS, 'counter', 'Storage calls by operation.')
+        self.registry.describe(ERRORS, 'counter', 'Storage calls that raised, by operation.')
+        self.registry.describe(BYTES_WRITTEN, 'counter', 'Bytes passed to save(), by operation.')
+        self.registry.describe(BYTES_READ, 'counter', 'Bytes returned by load(), by operation.')
+        self.registry.describe(LATENCY, 'histogram', 'Storage call latency in seconds.')
+
+    def _gallery_of(self, file_path: str) -> str:
+        # Paths are '<gallery>/...' or 'backups/<gallery>/...'
+        parts = [part for part in file_path.replace('\\', '/').split('/') if part]
+        if parts and parts[0] == 'backups':
+            parts = parts[1:]
+        return parts[0] if len(parts) > 1 else ''
+
+    def _labels(self, operation: str, file_path: str) -> dict:
+        labels = {'backend': self.backend, 'operation': operation}
+        if self.per_gallery:
+            labels['gallery'] = self._gallery_of(file_path)
+        return labels
+
+    def _call(self, operation: str, file_path: str, fn, *args):
+        labels = self._labels(operation, file_path)
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        except Exception:
+            self.registry.inc(ERRORS, labels)
+            raise
+        finally:
+            self.registry.observe(LATENCY, time.perf_counter() - start, labels)
+            self.registry.inc(CALLS, labels)
+
+    def save(self, file_path: str, data: bytes):
+        result = self._call('save', file_path, self.inner.save, file_path, data)
+        self.registry.inc(BYTES_WRITTEN, self._labels('save', file_path), len(data))
+        return result
+
+    def load(self, file_path: str) -> bytes:
+        data = self._call('load', file_path, self.inner.load, file_path)
+        self.registry.inc(BYTES_READ, self._labels('load', file_path), len(data))
+        return data
+
+    def delete(self, file_path: str):
+        return self._call('delete', file_path, self.inner.delete, file_path)
+
+    def list_files(self, directory_path: str) -> list[str]:
+        return self._call('list_files', directory_path, self.inner.list_files, directory_path)
+
+    def exists(self, file_path: str) -> bool:
+        return self._call('exists', file_path, self.inner.exists, file_path)
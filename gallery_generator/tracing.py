@@ -0,0 +1,197 @@
+"""
+Lightweight span tracing for HTTP requests and background jobs.
+
+A trace is started per request (see init_app) or per job (start_trace), and
+code marks its stages with `span('name')`. Spans with the same name are
+aggregated (count, total and max duration), so per-file spans inside a large
+upload stay cheap. When a trace ends it is written as one structured log line,
+and for HTTP requests the totals are also sent in a `Server-Timing` header.
+
+The current trace lives in a context variable. Threads do not inherit it, so
+work handed to a thread pool or background task is wrapped with `bind()`.
+Outside a trace (or with tracing disabled) `span()` costs one lookup.
+"""
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_current_trace = contextvars.ContextVar('gallery_trace', default=None)
+
+# Set by init_app from the TRACING_* config keys
+_enabled = True
+_log_threshold_ms = 500
+
+
+class Trace:
+    """Aggregated span timings of one request or job."""
+
+    def __init__(self, name: str, parent_id: str | None = None, **attrs):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.duration = None
+        self.stages = {} # name -> [count, total seconds, max seconds], in first-seen order
+        self._lock = threading.Lock()
+
+    def record(self, name: str, duration: float):
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                self.stages[name] = [1, duration, duration]
+            else:
+                stage[0] += 1
+                stage[1] += duration
+                stage[2] = max(stage[2], duration)
+
+    def finish(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.start
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            stages = {name: {'count': count, 'total_ms': round(total * 1000, 2), 'max_ms': round(longest * 1000, 2)}
+                      for name, (count, total, longest) in self.stages.items()}
+        elapsed = self.duration if self.duration is not None else time.perf_counter() - self.start
+        return {
+            'trace_id': self.trace_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'duration_ms': round(elapsed * 1000, 2),
+            **self.attrs,
+            'stages': stages
+        }
+
+    def server_timing(self) -> str:
+        """Formats the stage totals as a Server-Timing header value."""
+        with self._lock:
+            entries = [f"{name};dur={total * 1000:.1f}" for name, (_, total, _) in self.stages.items()]
+        elapsed = self.duration if self.duration is not None else time.perf_counter() - self.start
+        entries.append(f"total;dur={elapsed * 1000:.1f}")
+        return ', '.join(entries)
+
+
+def _log_trace(trace: Trace):
+    record = trace.to_dict()
+    level = logging.INFO if record['duration_ms'] >= _log_threshold_ms else logging.DEBUG
+    if logger.isEnabledFor(level):
+        logger.log(level, 'trace %s', json.dumps(record, ensure_ascii=False))
+
+
+def current_trace() -> Trace | None:
+    return _current_trace.get()
+
+
+def current_trace_id() -> str | None:
+    trace = _current_trace.get()
+    return trace.trace_id if trace else None
+
+
+@contextmanager
+def start_trace(name: str, parent_id: str | None = None, **attrs):
+    """
+    Runs the block as a new trace (e.g. one background job) and logs it on exit.
+    Yields None when tracing is disabled.
+    """
+    if not _enabled:
+        yield None
+        return
+    trace = Trace(name, parent_id=parent_id, **attrs)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        trace.finish()
+        _log_trace(trace)
+
+
+@contextmanager
+def span(name: str):
+    """Times the block as stage `name` of the current trace, if there is one."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.record(name, time.perf_counter() - start)
+
+
+def traced(name: str):
+    """Decorator form of span()."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind(fn):
+    """
+    Returns `fn` bound to the caller's context, so spans recorded in another
+    thread (executor workers, background tasks) land in the caller's trace.
+    The bound function may run concurrently; each call gets its own copy.
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return wrapper
+
+
+def init_app(app):
+    """Traces every request of `app` and adds a Server-Timing header to its responses."""
+    global _enabled, _log_threshold_ms
+    from flask import g, request
+
+    config = app.config['CONFIG']
+    _enabled = config.get('TRACING_ENABLED', True)
+    _log_threshold_ms = config.get('TRACING_LOG_THRESHOLD_MS', 500)
+    if not _enabled:
+        return
+
+    @app.before_request
+    def _start_request_trace():
+        rule = request.url_rule.rule if request.url_rule else request.path
+        trace = Trace(f"{request.method} {rule}", gallery=(request.view_args or {}).get('gallery_name'))
+        g._trace = trace
+        g._trace_token = _current_trace.set(trace)
+
+    @app.after_request
+    def _add_server_timing(response):
+        trace = g.get('_trace')
+        if trace is not None:
+            response.headers['Server-Timing'] = trace.server_timing()
+            response.headers['X-Trace-Id'] = trace.trace_id
+        return response
+
+    @app.teardown_request
+    def _finish_request_trace(exc):
+        trace = g.pop('_trace', None)
+        token = g.pop('_trace_token', None)
+        if trace is None:
+            return
+        if token is not None:
+            try:
+                _current_trace.reset(token)
+            except ValueError:
+                # Teardown can run in a different context than before_request
+                _current_trace.set(None)
+        trace.finish()
+        if exc is not None:
+            trace.attrs['error'] = str(exc)
+        _log_trace(trace)
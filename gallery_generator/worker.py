@@ -0,0 +1,86 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from gallery_generator.config_manager import config_manager
+from gallery_generator.services.job_service import JobService
+
+logger = logging.getLogger(__name__)
+
+
+def _worker_loop(poll_interval: float):
+    """Runs in each worker process: claims and runs jobs until terminated."""
+    from flask_socketio import SocketIO
+    from gallery_generator.app import create_app
+
+    app = create_app()
+    # Job workers are separate processes, so they can only reach browsers through
+    # a Socket.IO message queue (e.g. redis://) shared with the web workers.
+    message_queue = config_manager.get('SOCKETIO_MESSAGE_QUEUE')
+    socketio = SocketIO(message_queue=message_queue) if message_queue else None
+    job_service = JobService(app.job_queue, app.storage, app.data_manager, socketio=socketio,
+                             progress_interval=config_manager.get('JOB_PROGRESS_INTERVAL', 1.0),
+                             history_seconds=config_manager.get('JOB_HISTORY_SECONDS', 24 * 3600))
+
+    stopping = False
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    logger.info(f"Job worker {job_service.worker_id} started.")
+    last_prune = 0.0
+    while not stopping:
+        if job_service.drain(max_jobs=1) == 0:
+            # Keep the finished-job history bounded; every worker may do it, so not too often
+            if time.monotonic() - last_prune > app.job_queue.lease_seconds:
+                job_service.prune_history()
+                last_prune = time.monotonic()
+            time.sleep(poll_interval)
+    logger.info(f"Job worker {job_service.worker_id} stopped.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the gallery job worker pool.')
+    parser.add_argument('--workers', type=int, default=config_manager.get('JOB_WORKERS', 2),
+                        help='Number of worker processes.')
+    parser.add_argument('--poll-interval', type=float, default=config_manager.get('JOB_POLL_INTERVAL', 1.0),
+                        help='Seconds to wait when the queue is empty.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    def spawn():
+        process = multiprocessing.Process(target=_worker_loop, args=(args.poll_interval,))
+        process.start()
+        return process
+
+    processes = [spawn() for _ in range(args.workers)]
+    shutting_down = False
+
+    def shutdown(signum, frame):
+        nonlocal shutting_down
+        shutting_down = True
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    while not shutting_down:
+        # Replace crashed workers; the jobs they held are reclaimed once their lease expires.
+        for i, process in enumerate(processes):
+            if not process.is_alive() and not shutting_down:
+                logger.warning(f"Job worker process {process.pid} exited with {process.exitcode}; restarting.")
+                processes[i] = spawn()
+        time.sleep(1)
+    for process in processes:
+        process.join()
+
+
+if __name__ == '__main__':
+    main()
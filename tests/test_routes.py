@@ -1,27 +1,35 @@
 import pytest
 import shutil
+import subprocess
+import sys
 from gallery_generator.app import create_app
+from gallery_generator.profiling import MAX_CAPTURE_REQUESTS
 from gallery_generator.services.data_manager import DataManager
+import io
 import os
 import json
+import zipfile
 
-@pytest.fixture
-def client(tmp_path):
+GALLERY_NAME = "TestGallery"
+
+def _create_test_app(tmp_path, **config_overrides):
     # Reset the ConfigManager singleton before each test
     from gallery_generator.config_manager import ConfigManager
     ConfigManager._reset_instance()
 
     gallery_root = tmp_path / "gallery_data"
     gallery_root.mkdir()
-    backup_dir = tmp_path / "backups"
-    backup_dir.mkdir()
-    gallery_data_path = gallery_root / "gallery_data.json"
+    job_data = tmp_path / "job_data"
+    gallery_data_path = gallery_root / GALLERY_NAME / "gallery_data.json"
+    gallery_data_path.parent.mkdir()
 
     # Create a ConfigManager instance for the test
     test_config_manager = ConfigManager()
+    test_config_manager.config['storage_type'] = 'local'
     test_config_manager.config['GALLERY_ROOT'] = str(gallery_root)
-    test_config_manager.config['BACKUP_DIR'] = str(backup_dir)
-    test_config_manager.config['GALLERY_DATA_FILE'] = str(gallery_data_path)
+    test_config_manager.config['JOB_DB_PATH'] = str(job_data / "jobs.sqlite3")
+    test_config_manager.config['JOB_SPOOL_DIR'] = str(job_data / "spool")
+    test_config_manager.config.update(config_overrides)
 
     app = create_app(config_manager_instance=test_config_manager)
     app.config['TESTING'] = True
@@ -34,6 +42,7 @@ def client(tmp_path):
         "children": [
             {
                 "name": "TestFolder",
+                "full_path": "TestFolder",
                 "images": [
                     {
                         "filename": "test_image.jpg",
@@ -49,43 +58,284 @@ def client(tmp_path):
         json.dump(dummy_data, f, indent=4)
 
     # Create a dummy image file
-    test_folder = gallery_root / "TestFolder"
-    test_folder.mkdir()
-    with open(test_folder / "test_image.jpg", "w") as f:
+    with open(gallery_root / GALLERY_NAME / "test_image.jpg", "w") as f:
         f.write("dummy image data")
 
-    with app.test_client() as client:
+    return app
+
+@pytest.fixture
+def client(tmp_path):
+    with _create_test_app(tmp_path).test_client() as client:
         yield client
 
 def test_index_page(client):
     rv = client.get('/')
+    assert rv.status_code == 302
+    assert rv.headers['Location'].endswith('/create_gallery')
+
+    rv = client.get(f'/gallery/{GALLERY_NAME}')
     assert rv.status_code == 200
-    assert b"Photo Gallery" in rv.data
+    assert GALLERY_NAME.encode() in rv.data
 
     # Now test the API endpoint that gallery.js would call
-    api_rv = client.get('/api/gallery_data')
+    api_rv = client.get(f'/gallery/{GALLERY_NAME}/api/gallery_data')
     assert api_rv.status_code == 200
     data = json.loads(api_rv.data)
-    
+
     assert data['children'][0]['name'] == 'TestFolder'
     assert data['children'][0]['images'][0]['filename'] == 'test_image.jpg'
 
+    image_rv = client.get(f'/images/{GALLERY_NAME}/test_image.jpg')
+    assert image_rv.status_code == 200
+    assert image_rv.data == b"dummy image data"
+
 # You would add more tests here for other routes (upload, delete, comments, versions)
 
 def test_export_report(client):
     # Test HTML export
-    rv = client.post('/export_report', json={'format': 'html', 'gallery_data': {'name': 'root', 'children': []}} )
+    rv = client.post(f'/gallery/{GALLERY_NAME}/export_report', json={'format': 'html', 'gallery_data': {'name': 'root', 'children': []}} )
     assert rv.status_code == 200
     assert rv.mimetype == 'text/html'
-    assert 'attachment; filename=report.html' in rv.headers['Content-Disposition']
+    assert f'attachment; filename="{GALLERY_NAME}_' in rv.headers['Content-Disposition']
+    assert rv.headers['Content-Disposition'].endswith('.html"')
 
     # Test Markdown export
-    rv = client.post('/export_report', json={'format': 'markdown', 'gallery_data': {'name': 'root', 'children': []}} )
+    rv = client.post(f'/gallery/{GALLERY_NAME}/export_report', json={'format': 'markdown', 'gallery_data': {'name': 'root', 'children': []}} )
     assert rv.status_code == 200
     assert rv.mimetype == 'text/markdown'
-    assert 'attachment; filename=report.md' in rv.headers['Content-Disposition']
+    assert rv.headers['Content-Disposition'].endswith('.md"')
 
     # Test invalid format
-    rv = client.post('/export_report', json={'format': 'invalid', 'gallery_data': {'name': 'root', 'children': []}} )
+    rv = client.post(f'/gallery/{GALLERY_NAME}/export_report', json={'format': 'invalid', 'gallery_data': {'name': 'root', 'children': []}} )
     assert rv.status_code == 400
     assert b'Invalid format specified' in rv.data
+
+def test_server_timing_header(client):
+    rv = client.get(f'/gallery/{GALLERY_NAME}/api/gallery_data')
+    assert rv.status_code == 200
+    stages = [entry.split(';')[0] for entry in rv.headers['Server-Timing'].split(', ')]
+    assert stages[0] == 'json_load' and stages[-1] == 'total'
+
+def test_profiling_is_off_by_default(client):
+    assert client.get('/admin/profile/sample?seconds=0.1').status_code == 404
+
+def test_profile_next_requests(tmp_path):
+    import marshal
+    app = _create_test_app(tmp_path, PROFILING_ENABLED=True, ADMIN_TOKEN='secret')
+    client = app.test_client()
+    rule = '/gallery/<gallery_name>/api/gallery_data'
+    assert client.post('/admin/profile/requests', json={'rule': rule, 'count': 2}).status_code == 403
+
+    for count in ('abc', None, 0):
+        rv = client.post('/admin/profile/requests', json={'rule': rule, 'count': count}, headers={'X-Admin-Token': 'secret'})
+        assert rv.status_code == 400
+
+    rv = client.post('/admin/profile/requests', json={'rule': rule, 'count': 2}, headers={'X-Admin-Token': 'secret'})
+    assert rv.status_code == 202
+    capture_id = rv.get_json()['capture_id']
+    client.get(f'/gallery/{GALLERY_NAME}/api/gallery_data')
+    assert client.get(f'/admin/profile/requests/{capture_id}', headers={'X-Admin-Token': 'secret'}).status_code == 202
+    client.get(f'/gallery/{GALLERY_NAME}/api/gallery_data')
+
+    rv = client.get(f'/admin/profile/requests/{capture_id}', headers={'X-Admin-Token': 'secret'})
+    assert rv.status_code == 200
+    stats = marshal.loads(rv.data)
+    assert any(func[2] == 'get_gallery_data' and value[1] == 2 for func, value in stats.items())
+
+    rv = client.post('/admin/profile/requests', json={'rule': rule, 'count': 10 ** 6}, headers={'X-Admin-Token': 'secret'})
+    assert rv.get_json()['count'] == MAX_CAPTURE_REQUESTS
+
+def test_gallery_data_conditional_get(client):
+    rv = client.get(f'/gallery/{GALLERY_NAME}/api/gallery_data')
+    etag = rv.headers['ETag']
+    assert rv.headers['Cache-Control'] == 'no-cache'
+
+    rv = client.get(f'/gallery/{GALLERY_NAME}/api/gallery_data', headers={'If-None-Match': etag})
+    assert rv.status_code == 304
+
+    # A 304 carries the validator the client presented, here the one of a compressed copy
+    gzip_etag = etag[:-1] + '-gzip"'
+    rv = client.get(f'/gallery/{GALLERY_NAME}/api/gallery_data', headers={'If-None-Match': gzip_etag})
+    assert rv.status_code == 304
+    assert rv.headers['ETag'] == gzip_etag
+
+    # Saving changed data gives a new ETag
+    client.post(f'/gallery/{GALLERY_NAME}/update_comment', json={'path': 'TestFolder', 'comment': 'changed'})
+    rv = client.get(f'/gallery/{GALLERY_NAME}/api/gallery_data', headers={'If-None-Match': etag})
+    assert rv.status_code == 200
+    assert rv.headers['ETag'] != etag
+    assert rv.get_json()['children'][0]['comment'] == 'changed'
+
+    # Backups are immutable and served compressed when accepted
+    backup = client.get(f'/gallery/{GALLERY_NAME}/api/versions').get_json()[0]['filename']
+    rv = client.get(f'/gallery/{GALLERY_NAME}/api/version/{backup}', headers={'Accept-Encoding': 'gzip'})
+    assert 'immutable' in rv.headers['Cache-Control']
+    assert rv.headers.get('Content-Encoding') is None # Too small to be worth compressing
+
+def test_gallery_list_is_served_from_the_catalog(client):
+    data_manager = client.application.data_manager
+    client.post(f'/gallery/{GALLERY_NAME}/update_comment', json={'path': 'TestFolder', 'comment': 'changed'})
+    data_manager.save_gallery_data({'name': 'root', 'children': [], 'images': [
+        {'filename': 'a.jpg', 'status': 'good', 'size': 2048},
+        {'filename': 'b.jpg', 'status': 'neutral', 'size': 1024}
+    ]}, 'Bigger')
+
+    # Listing never loads the galleries themselves
+    data_manager.load_gallery_data = None
+    page = client.get('/api/galleries?sort=images&order=desc').get_json()
+    assert page['total'] == 2
+    assert [gallery['name'] for gallery in page['galleries']] == ['Bigger', GALLERY_NAME]
+    assert page['galleries'][0]['statuses'] == {'good': 1, 'neutral': 1}
+    assert page['galleries'][0]['bytes'] == 3072
+    assert page['galleries'][0]['version'] == data_manager.get_gallery_version('Bigger')
+
+    page = client.get('/api/galleries?limit=1&offset=1&sort=name').get_json()
+    assert [gallery['name'] for gallery in page['galleries']] == [GALLERY_NAME]
+    assert client.get('/api/galleries?sort=size').status_code == 400
+
+    rv = client.get('/galleries?q=big')
+    assert b'Bigger' in rv.data and GALLERY_NAME.encode() not in rv.data
+
+def test_import_is_lazy_and_config_path_comes_from_env(tmp_path):
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({'storage_type': 'local', 'GALLERY_ROOT': str(tmp_path / "gallery_data"),
+                                       'JOB_DB_PATH': str(tmp_path / "jobs.sqlite3"),
+                                       'JOB_SPOOL_DIR': str(tmp_path / "spool")}))
+    probe = (
+        "import sys, gallery_generator.app as app_module\n"
+        "heavy = ['numpy', 'gallery_generator.storage.databricks_storage', 'gallery_generator.services.sqlite_data_manager']\n"
+        "assert app_module._application is None\n"
+        "assert not [name for name in heavy if name in sys.modules], sys.modules.keys()\n"
+        "assert app_module.application is app_module.get_application()\n"
+        "print(app_module.application.storage.base_directory)\n"
+    )
+    result = subprocess.run([sys.executable, '-c', probe], cwd=tmp_path, capture_output=True, text=True,
+                            env={**os.environ, 'GALLERY_CONFIG': str(config_path),
+                                 'PYTHONPATH': os.path.dirname(os.path.dirname(os.path.abspath(__file__)))})
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == str(tmp_path / "gallery_data")
+
+def test_selection_status_endpoint(client):
+    rv = client.post(f'/gallery/{GALLERY_NAME}/api/selection/status',
+                     json={'selection': {'folders': ['TestFolder'], 'recursive': False}, 'status': 'good'})
+    assert rv.status_code == 200
+    assert rv.get_json()['filenames'] == ['test_image.jpg']
+    assert rv.get_json()['version'] == client.application.data_manager.get_gallery_version(GALLERY_NAME)
+
+    rv = client.post(f'/gallery/{GALLERY_NAME}/api/selection/status', json={'selection': {}, 'status': 'good'})
+    assert rv.status_code == 400
+
+def test_outline_carries_folder_aggregates(client):
+    client.post(f'/gallery/{GALLERY_NAME}/api/selection/status',
+                json={'selection': {'folders': ['TestFolder']}, 'status': 'good'})
+    rv = client.get(f'/gallery/{GALLERY_NAME}/api/outline')
+    assert rv.status_code == 200
+    folder = rv.get_json()['children'][0]
+    assert folder['name'] == 'TestFolder' and 'images' not in folder
+    assert folder['stats']['good'] == 1
+    assert (folder['stats']['first_date'], folder['stats']['last_date']) == ('2023-01-01', '2023-01-01')
+
+    rv = client.get(f'/gallery/{GALLERY_NAME}/api/outline', headers={'If-None-Match': rv.headers['ETag']})
+    assert rv.status_code == 304
+    assert client.get('/gallery/Missing/api/outline').status_code == 404
+
+
+def test_search_finds_folders_and_images(client):
+    rv = client.get(f'/gallery/{GALLERY_NAME}/api/search?q=test')
+    assert rv.status_code == 200
+    body = rv.get_json()
+    assert body['query'] == 'test' and body['total'] == 2
+    # An exact token ('test' of test_image.jpg) ranks above a prefix ('testfolder')
+    assert [(hit['kind'], hit['name']) for hit in body['results']] == [('image', 'test_image.jpg'), ('folder', 'TestFolder')]
+
+    rv = client.get(f'/gallery/{GALLERY_NAME}/api/search?q=test&kind=image')
+    assert [hit['filename'] for hit in rv.get_json()['results']] == ['test_image.jpg']
+    assert client.get(f'/gallery/{GALLERY_NAME}/api/search?q=test&kind=other').status_code == 400
+    assert client.get('/gallery/Missing/api/search?q=test').status_code == 404
+
+
+def test_ingest_is_confined_to_the_ingest_root(tmp_path, client):
+    assert client.post(f'/gallery/{GALLERY_NAME}/ingest', json={'path': ''}).status_code == 403
+
+    photos = tmp_path / "photos"
+    (photos / "Trip").mkdir(parents=True)
+    (tmp_path / "ingest_app").mkdir()
+    app = _create_test_app(tmp_path / "ingest_app", INGEST_ROOT=str(photos), JOB_EXECUTION='worker')
+    client = app.test_client()
+    assert client.post(f'/gallery/{GALLERY_NAME}/ingest', json={'path': '../'}).status_code == 400
+    assert client.post(f'/gallery/{GALLERY_NAME}/ingest', json={'path': 'Missing'}).status_code == 404
+
+    rv = client.post(f'/gallery/{GALLERY_NAME}/ingest', json={'path': 'Trip'})
+    assert rv.status_code == 202
+    job = app.job_queue.get(rv.get_json()['job_id'])
+    assert job['kind'] == 'ingest' and job['payload']['source_dir'] == str(photos / "Trip")
+
+
+def test_gallery_jobs_lists_live_and_recent_jobs(tmp_path):
+    app = _create_test_app(tmp_path, JOB_EXECUTION='worker')
+    finished = app.job_queue.enqueue('upload', GALLERY_NAME, {'zip_path': '/spool/a.zip'})
+    app.job_queue.claim('w1')
+    app.job_queue.complete(finished, {'gallery_name': GALLERY_NAME})
+    queued = app.job_queue.enqueue('ingest', GALLERY_NAME, {'source_dir': '/photos'})
+    app.job_queue.enqueue('upload', 'OtherGallery', {})
+
+    jobs = app.test_client().get(f'/gallery/{GALLERY_NAME}/api/jobs').get_json()['jobs']
+    assert [(job['id'], job['state']) for job in jobs] == [(queued, 'queued'), (finished, 'done')]
+    assert all('payload' not in job for job in jobs)
+
+
+def test_duplicates_reject_invalid_max_distance(client):
+    assert client.get(f'/gallery/{GALLERY_NAME}/api/duplicates?max_distance=3').status_code == 200
+    for value in ('abc', '64', '-1'):
+        assert client.get(f'/gallery/{GALLERY_NAME}/api/duplicates?max_distance={value}').status_code == 400
+    for value in ('3', 64, True, 2.5):
+        rv = client.post(f'/gallery/{GALLERY_NAME}/api/duplicates/status',
+                         json={'filename': 'test_image.jpg', 'status': 'good', 'max_distance': value})
+        assert rv.status_code == (200 if value == '3' else 400)
+
+
+def test_gallery_updates_go_to_the_gallery_room_without_the_tree(tmp_path):
+    app = _create_test_app(tmp_path)
+    watching = app.socketio.test_client(app)
+    elsewhere = app.socketio.test_client(app)
+    watching.emit('join_gallery', {'gallery_name': GALLERY_NAME})
+    elsewhere.emit('join_gallery', {'gallery_name': 'OtherGallery'})
+
+    rv = app.test_client().post(f'/gallery/{GALLERY_NAME}/update_status',
+                                json={'image_paths': ['TestFolder/test_image.jpg'], 'status': 'good'})
+    assert rv.status_code == 200
+    assert [(event['name'], event['args']) for event in watching.get_received()] == [
+        ('gallery_updated', [{'message': 'Image status updated to good'}])]
+    assert elsewhere.get_received() == []
+
+
+def test_download_streams_a_zip_of_the_selection(client):
+    rv = client.post(f'/gallery/{GALLERY_NAME}/api/selection/download', json={'selection': {'folders': ['']}})
+    assert rv.status_code == 200 and rv.mimetype == 'application/zip'
+    assert rv.is_streamed and 'Content-Length' not in rv.headers
+    with zipfile.ZipFile(io.BytesIO(rv.data)) as archive:
+        assert archive.namelist() == ['TestFolder/test_image.jpg']
+        assert archive.read('TestFolder/test_image.jpg') == b'dummy image data'
+
+    # As a form field, e.g. from a plain form submission; nothing is good yet
+    rv = client.post(f'/gallery/{GALLERY_NAME}/api/selection/download',
+                     data={'selection': json.dumps({'folders': [''], 'status': 'good'})})
+    with zipfile.ZipFile(io.BytesIO(rv.data)) as archive:
+        assert archive.namelist() == []
+    assert client.post(f'/gallery/{GALLERY_NAME}/api/selection/download', json={}).status_code == 400
+    assert client.post('/gallery/Missing/api/selection/download',
+                       json={'selection': {'folders': ['']}}).status_code == 404
+
+
+def test_image_batch_streams_frames(client):
+    from gallery_generator.services.image_batch import decode_frames
+    rv = client.post(f'/gallery/{GALLERY_NAME}/api/images/batch',
+                     json={'filenames': ['test_image.jpg', 'missing.jpg', 'test_image.jpg']})
+    assert rv.status_code == 200 and rv.mimetype == 'application/x-gallery-image-batch'
+    frames = {header['filename']: (header, body) for header, body in decode_frames(rv.data)}
+    assert len(frames) == 2 # Duplicates are read and sent once
+    assert frames['test_image.jpg'] == ({'filename': 'test_image.jpg', 'type': 'image/jpeg', 'size': 16}, b'dummy image data')
+    assert frames['missing.jpg'][0]['error'] == 'not_found'
+
+    for body in ({'filenames': []}, {'filenames': ['../gallery_data.json']}, {'filenames': ['x.jpg'] * 65}, {}):
+        assert client.post(f'/gallery/{GALLERY_NAME}/api/images/batch', json=body).status_code == 400
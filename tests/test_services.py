@@ -0,0 +1,730 @@
+import io
+import os
+import base64
+import time
+import hashlib
+import functools
+import sqlite3
+import zipfile
+from contextlib import closing
+import pytest
+from gallery_generator.config_manager import config_manager
+from gallery_generator.metrics import MetricsRegistry
+from gallery_generator.storage.local_storage import LocalStorage
+from gallery_generator.storage.instrumented_storage import InstrumentedStorage
+from gallery_generator.storage.caching_storage import CachingStorage
+from gallery_generator.services.data_manager import DataManager
+from gallery_generator.services.duplicate_service import DuplicateService
+from gallery_generator.services.job_queue import JobQueue, DONE, RUNNING
+from gallery_generator.services.job_service import JobService
+from gallery_generator.services.progress_reporter import ProgressReporter
+from gallery_generator.services.sqlite_data_manager import SqliteDataManager
+from gallery_generator.services.sharded_data_manager import ShardedDataManager
+from gallery_generator.services.selection import Selection
+from gallery_generator.services import node_stats
+from gallery_generator.services.upload_service import UploadService
+from gallery_generator.tracing import start_trace
+
+
+def _with_stats(tree):
+    # Legacy trees come back from every backend with their aggregates added
+    import copy
+    tree = copy.deepcopy(tree)
+    node_stats.compute(tree)
+    return tree
+
+
+def _image(filename, date='2024-05-01', status='neutral', **fields):
+    return {'filename': filename, 'modification_date': date, 'status': status, **fields}
+
+
+def _make_zip(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        for name, data in files.items():
+            zf.writestr(zipfile.ZipInfo(name, date_time=(2024, 5, 1, 12, 0, 0)), data)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return LocalStorage(str(tmp_path / "gallery_data"))
+
+
+@pytest.fixture
+def data_manager(storage):
+    return DataManager('', None, storage)
+
+
+@pytest.fixture(params=['json', 'sqlite', 'sharded'])
+def make_manager(request, tmp_path, storage):
+    """Builds data managers of one metadata backend, all over the same storage (and database)."""
+    def make():
+        if request.param == 'sqlite':
+            return SqliteDataManager('', None, storage, str(tmp_path / "metadata.sqlite3"))
+        if request.param == 'sharded':
+            return ShardedDataManager('', None, storage)
+        return DataManager('', None, storage)
+    return make
+
+
+@pytest.fixture
+def manager(make_manager):
+    return make_manager()
+
+
+@pytest.fixture
+def job_queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"), max_concurrent=2, max_per_gallery=1, lease_seconds=30)
+
+
+def test_job_queue_respects_per_gallery_limit(job_queue):
+    first = job_queue.enqueue('upload', 'g1', {})
+    job_queue.enqueue('upload', 'g1', {})
+    third = job_queue.enqueue('upload', 'g2', {})
+
+    assert job_queue.claim('w1')['id'] == first
+    # The second g1 job must wait; the g2 job can run alongside.
+    assert job_queue.claim('w2')['id'] == third
+    assert job_queue.claim('w3') is None
+
+
+def test_job_queue_reclaims_expired_lease(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), lease_seconds=0.01)
+    job_id = queue.enqueue('upload', 'g1', {})
+    assert queue.claim('crashed-worker')['id'] == job_id
+    time.sleep(0.02)
+
+    reclaimed = queue.claim('w2')
+    assert reclaimed['id'] == job_id
+    assert reclaimed['state'] == RUNNING
+    assert reclaimed['attempts'] == 2
+
+
+def test_upload_job_is_idempotent(tmp_path, storage, data_manager, job_queue):
+    zip_path = tmp_path / "upload.zip"
+    zip_bytes = _make_zip({'Trip/Day1/a.jpg': b'a', 'Trip/Day1/b.jpg': b'b'})
+    zip_path.write_bytes(zip_bytes)
+    job_service = JobService(job_queue, storage, data_manager)
+
+    job_id = job_queue.enqueue('upload', 'g1', {'zip_path': str(zip_path)})
+    assert job_service.drain() == 1
+    assert job_queue.get(job_id)['state'] == DONE
+    assert not zip_path.exists()
+
+    # Re-running the same upload (e.g. after a crash before completion) adds nothing twice.
+    zip_path.write_bytes(zip_bytes)
+    job_queue.enqueue('upload', 'g1', {'zip_path': str(zip_path)})
+    job_service.drain()
+
+    day1 = data_manager.load_gallery_data('g1')['children'][0]['children'][0]
+    assert day1['full_path'] == 'Trip/Day1'
+    assert len(day1['images']) == 2
+
+
+def test_sweep_resumes_jobs_left_by_a_crashed_worker(tmp_path, storage, data_manager):
+    import threading
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), lease_seconds=0.05)
+    zip_path = tmp_path / "upload.zip"
+    zip_path.write_bytes(_make_zip({'Trip/a.jpg': b'a'}))
+    job_id = queue.enqueue('upload', 'g1', {'zip_path': str(zip_path)})
+    queue.claim('crashed-worker')
+
+    stale_id = queue.enqueue('upload', 'g0', {})
+    queue.fail(stale_id, 'failed long ago')
+    with closing(sqlite3.connect(queue.db_path)) as conn, conn:
+        conn.execute('UPDATE jobs SET updated_at = 0 WHERE id = ?', (stale_id,))
+
+    stop = threading.Event()
+    job_service = JobService(queue, storage, data_manager, history_seconds=3600)
+    sweeper = threading.Thread(target=job_service.sweep, args=(0.02, stop))
+    sweeper.start()
+    try:
+        deadline = time.monotonic() + 5
+        while queue.get(job_id)['state'] != DONE and time.monotonic() < deadline:
+            time.sleep(0.02)
+    finally:
+        stop.set()
+        sweeper.join()
+    assert queue.get(job_id)['state'] == DONE
+    # The sweep also prunes the finished jobs beyond the history window
+    assert queue.get(stale_id) is None
+
+
+class _RecordingSocketIO:
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event, data, to=None):
+        self.events.append((event, data, to))
+
+
+def test_job_state_is_pushed_as_job_updates(tmp_path, storage, data_manager, job_queue):
+    zip_path = tmp_path / "upload.zip"
+    zip_path.write_bytes(_make_zip({'Trip/a.jpg': b'a', 'Trip/b.jpg': b'b'}))
+    socketio = _RecordingSocketIO()
+    job_service = JobService(job_queue, storage, data_manager, socketio=socketio, progress_interval=0)
+
+    job_id = job_queue.enqueue('upload', 'g1', {'zip_path': str(zip_path)})
+    job_service.publish(job_id)
+    job_service.drain()
+
+    updates = [(data['state'], data['progress']) for event, data, to in socketio.events if event == 'job_update']
+    assert updates[:2] == [('queued', None), ('running', None)]
+    assert ('running', 50) in updates
+    assert updates[-1] == ('done', 100)
+    job_updates = [(data, to) for event, data, to in socketio.events if event == 'job_update']
+    assert all(to == 'g1' and data['id'] == job_id and 'payload' not in data for data, to in job_updates)
+    # Progress goes out only as job updates
+    assert {event for event, _, _ in socketio.events} == {'job_update', 'gallery_updated'}
+    assert [(data, to) for event, data, to in socketio.events if event == 'gallery_updated'] == [
+        ({'message': 'Upload complete and gallery updated!'}, 'g1')]
+
+    # Recently finished jobs stay listed along with live ones
+    queued_id = job_queue.enqueue('upload', 'g1', {})
+    assert [job['id'] for job in job_queue.list_jobs('g1', finished_within=60)] == [queued_id, job_id]
+    assert [job['id'] for job in job_queue.list_jobs('g1', finished_within=0)] == [queued_id]
+
+
+@pytest.mark.parametrize('process_workers', [0, 2])
+def test_directory_ingest_processes_only_new_or_changed_files(tmp_path, storage, data_manager, job_queue,
+                                                              monkeypatch, process_workers):
+    monkeypatch.setitem(config_manager.config, 'INGEST_PROCESS_WORKERS', process_workers)
+    source = tmp_path / "photos"
+    (source / "Trip" / "Day1").mkdir(parents=True)
+    (source / "Trip" / "Day1" / "a.jpg").write_bytes(b'a')
+    (source / "Trip" / "b.png").write_bytes(b'bb')
+    (source / "Trip" / "notes.txt").write_bytes(b'x')
+    (source / ".cache").mkdir()
+    (source / ".cache" / "hidden.jpg").write_bytes(b'h')
+    socketio = _RecordingSocketIO()
+    job_service = JobService(job_queue, storage, data_manager, socketio=socketio)
+
+    def ingest():
+        job_id = job_queue.enqueue('ingest', 'g1', {'source_dir': str(source)})
+        job_service.drain()
+        job = job_queue.get(job_id)
+        assert job['state'] == DONE
+        return job['result']
+
+    assert ingest() == {'gallery_name': 'g1', 'ingested': 2, 'replaced': 0, 'unchanged': 0, 'missing': 0}
+    assert [(data, to) for event, data, to in socketio.events if event == 'gallery_updated'] == [
+        ({'message': 'Ingest complete: 2 new images'}, 'g1')]
+    trip = data_manager.load_gallery_data('g1')['children'][0]
+    assert trip['full_path'] == 'Trip' and trip['children'][0]['full_path'] == 'Trip/Day1'
+    filename = trip['children'][0]['images'][0]['filename']
+    assert filename == f"a_{hashlib.md5(b'a').hexdigest()}.jpg" and storage.load(f"g1/{filename}") == b'a'
+    data_manager.update_image_status([filename], 'good', 'g1')
+
+    # A rescan of an unchanged tree reads no file; a touched file is hashed but not processed again
+    import gallery_generator.services.upload_service as upload_service
+    with monkeypatch.context() as patch:
+        patch.setattr(upload_service, 'analyze_file', lambda *args: pytest.fail('unchanged file read'))
+        assert ingest()['ingested'] == 0
+    os.utime(source / "Trip" / "Day1" / "a.jpg", ns=(0, 10 ** 18))
+    assert ingest() == {'gallery_name': 'g1', 'ingested': 0, 'replaced': 0, 'unchanged': 2, 'missing': 0}
+    assert data_manager.load_gallery_data('g1')['children'][0]['children'][0]['images'][0]['status'] == 'good'
+
+    # A changed file replaces its earlier image; a removed one is forgotten, its image kept
+    (source / "Trip" / "Day1" / "a.jpg").write_bytes(b'a2')
+    (source / "Trip" / "b.png").unlink()
+    assert ingest() == {'gallery_name': 'g1', 'ingested': 1, 'replaced': 1, 'unchanged': 0, 'missing': 1}
+    trip = data_manager.load_gallery_data('g1')['children'][0]
+    assert [img['filename'] for img in trip['children'][0]['images']] == [f"a_{hashlib.md5(b'a2').hexdigest()}.jpg"]
+    assert len(trip['images']) == 1
+
+    # A file rewritten between analysis and its write is left for the next ingest
+    stale = UploadService(storage)._upload_source_file(
+        str(source / "Trip" / "Day1" / "a.jpg"), 'g1/stale.jpg', hashlib.md5(b'a').hexdigest())
+    assert stale is False and not storage.exists('g1/stale.jpg')
+
+
+@pytest.mark.parametrize('process_workers', [0, 2])
+def test_process_zip_file_cpu_stage(tmp_path, storage, monkeypatch, process_workers):
+    monkeypatch.setitem(config_manager.config, 'INGEST_PROCESS_WORKERS', process_workers)
+
+    zip_path = tmp_path / "upload.zip"
+    zip_path.write_bytes(_make_zip({'Trip/a.jpg': b'aaaa', 'Trip/b.png': b'bb', 'Trip/notes.txt': b'x'}))
+    with open(zip_path, 'rb') as stream:
+        gallery_data = UploadService(storage).process_zip_file(stream, 'g1')
+
+    images = sorted(gallery_data['children'][0]['images'], key=lambda img: img['size'])
+    assert [img['size'] for img in images] == [2, 4]
+    # With a process pool the workers return metadata only and the member is read again for the write
+    assert [storage.load(f"g1/{img['filename']}") for img in images] == [b'bb', b'aaaa']
+
+
+def _make_jpeg(exif_datetime=None, orientation=None, size=(40, 30)):
+    from PIL import Image
+    image = Image.new('RGB', size, (200, 100, 50))
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    if exif_datetime:
+        exif.get_ifd(0x8769)[0x9003] = exif_datetime
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+def test_ingest_uses_exif_capture_date(tmp_path, storage, data_manager):
+    zip_bytes = _make_zip({
+        'Trip/rotated.jpg': _make_jpeg('2019:07:14 09:30:00', orientation=6),
+        'Trip/plain.jpg': _make_jpeg(),
+    })
+    gallery_data = UploadService(storage).process_zip_file(io.BytesIO(zip_bytes), 'g1')
+    images = {img['filename'].split('_')[0]: img for img in gallery_data['children'][0]['images']}
+
+    rotated = images['rotated']
+    assert rotated['modification_date'] == '2019-07-14'
+    assert rotated['capture_date'] == '2019-07-14T09:30:00'
+    assert (rotated['width'], rotated['height'], rotated['orientation']) == (30, 40, 6)
+    assert len(rotated['phash']) == 16
+    # A few colour cells as displayed (portrait), base64 RGB
+    cells, pixels = rotated['placeholder'].split(':')
+    assert cells == '4x6' and base64.b64decode(pixels)[:3] == bytes([200, 100, 50])
+    assert images['plain']['placeholder'].startswith('6x4:')
+    # Without EXIF the zip entry's timestamp is the fallback
+    assert images['plain']['modification_date'] == '2024-05-01'
+    assert 'capture_date' not in images['plain']
+
+    data_manager.save_gallery_data(gallery_data, 'g1')
+    assert data_manager.load_date_index('g1') == {'2019-07-14': 1, '2024-05-01': 1}
+
+
+def test_backfill_adds_placeholders_to_older_images(storage, data_manager):
+    from gallery_generator.services.image_analysis import analyze_image_bytes
+    storage.save('g1/old_1.jpg', _make_jpeg(size=(60, 30)))
+    data_manager.save_gallery_data({'name': 'root', 'images': [], 'comment': '', 'children': [
+        {'name': 'Trip', 'images': [{'filename': 'old_1.jpg', 'modification_date': '2024-05-01', 'status': 'good'},
+                                    {'filename': 'lost_2.jpg', 'modification_date': '2024-05-01', 'status': 'neutral'}],
+         'comment': '', 'children': []}]}, 'g1')
+
+    assert data_manager.backfill_image_metadata('g1', analyze_image_bytes) == 1
+    old, lost = data_manager.load_gallery_data('g1')['children'][0]['images']
+    assert (old['width'], old['height'], old['status']) == (60, 30, 'good')
+    assert old['placeholder'].startswith('6x3:') and 'phash' not in old # Only the requested keys
+    assert 'placeholder' not in lost
+    assert data_manager.backfill_image_metadata('g1', analyze_image_bytes) == 0
+
+
+def test_duplicate_clusters_group_near_identical_images():
+    gallery_data = {'name': 'root', 'images': [], 'children': [
+        {'name': 'A', 'full_path': 'A', 'children': [], 'images': [
+            {'filename': 'burst1.jpg', 'phash': 'ffff0000ffff0000'},
+            {'filename': 'burst2.jpg', 'phash': 'ffff0000ffff0003'}, # 2 bits from burst1
+            {'filename': 'burst3.jpg', 'phash': 'ffff0000ffff003f'}, # 6 bits from burst1, 4 from burst2
+            {'filename': 'other.jpg', 'phash': '0000ffff0000ffff'},
+            {'filename': 'nohash.jpg'},
+        ]},
+    ]}
+    clusters = DuplicateService(max_distance=4).find_clusters(gallery_data)
+
+    assert len(clusters) == 1
+    assert clusters[0]['filenames'] == ['burst1.jpg', 'burst2.jpg', 'burst3.jpg']
+    assert DuplicateService(max_distance=4).find_cluster_of(gallery_data, 'other.jpg') == ['other.jpg']
+    # Transitive from the one image: burst3 is only reached through burst2
+    assert DuplicateService(max_distance=4).find_cluster_of(gallery_data, 'burst1.jpg') == clusters[0]['filenames']
+    assert DuplicateService(max_distance=4).find_cluster_of(gallery_data, 'nohash.jpg') == ['nohash.jpg']
+
+
+def test_progress_reporter_coalesces_updates():
+    snapshots = []
+    reporter = ProgressReporter('upload', 'g1', callback=snapshots.append, min_interval=3600)
+    reporter.start(total=10000, total_bytes=10000 * 100)
+    for _ in range(10000):
+        reporter.advance(nbytes=100)
+    reporter.finish()
+
+    # Only the start and the final update get through the time threshold
+    assert [s['progress'] for s in snapshots] == [0, 100]
+    assert snapshots[-1]['processed'] == 10000
+    assert snapshots[-1]['bytes'] == 10000 * 100
+
+
+def test_instrumented_storage_records_calls_and_errors(storage):
+    registry = MetricsRegistry()
+    instrumented = InstrumentedStorage(storage, 'local', registry=registry)
+    instrumented.save('g1/a.jpg', b'12345')
+    assert instrumented.load('g1/a.jpg') == b'12345'
+    assert instrumented.exists('g1/a.jpg')
+    assert not instrumented.exists('backups/g1/missing.json')
+    with pytest.raises(Exception):
+        instrumented.load('g1/missing.jpg')
+
+    text = registry.render_prometheus()
+    assert 'gallery_storage_calls_total{backend="local",gallery="g1",operation="exists"} 2' in text
+    assert 'gallery_storage_errors_total{backend="local",gallery="g1",operation="load"} 1' in text
+    assert 'gallery_storage_bytes_written_total{backend="local",gallery="g1",operation="save"} 5' in text
+    assert 'gallery_storage_bytes_read_total{backend="local",gallery="g1",operation="load"} 5' in text
+    assert 'gallery_storage_latency_seconds_count{backend="local",gallery="g1",operation="load"} 2' in text
+
+
+def test_trace_spans_propagate_into_thread_pool(tmp_path, storage):
+    uploads = UploadService(storage)
+    with start_trace('test') as trace:
+        uploads.process_zip_file(io.BytesIO(_make_zip({'a/1.jpg': _make_jpeg(), 'a/2.jpg': _make_jpeg()})), 'g1')
+
+    stages = trace.to_dict()['stages']
+    assert stages['storage_write']['count'] == 2
+    assert {'zip_scan', 'extract', 'analyze', 'tree_build'} <= stages.keys()
+
+
+def test_compressed_gallery_data_reads_legacy_files(storage):
+    import json
+    legacy = {"name": "root", "images": [], "comment": "", "children": [
+        {"name": "ä", "full_path": "ä", "images": [{"filename": "x.jpg", "status": "good"}], "comment": "", "children": []}]}
+    storage.save('g1/gallery_data.json', json.dumps(legacy, ensure_ascii=False, indent=4).encode('utf-8'))
+
+    config_manager.config['GALLERY_DATA_COMPRESSION'] = 'gzip'
+    try:
+        data_manager = DataManager('', config_manager, storage)
+        assert data_manager.load_gallery_data('g1') == _with_stats(legacy)
+        summary = data_manager.migrate_encoding('g1')
+    finally:
+        del config_manager.config['GALLERY_DATA_COMPRESSION']
+
+    assert summary['files'] == 1 and summary['bytes_after'] < summary['bytes_before']
+    assert storage.load('g1/gallery_data.json')[:2] == b'\x1f\x8b'
+    # Readable whatever the configured encoding is
+    assert DataManager('', None, storage).load_gallery_data('g1') == _with_stats(legacy)
+
+
+def test_sqlite_backend_round_trip_and_single_row_updates(tmp_path, storage):
+    import json
+    legacy = {"name": "root", "images": [], "comment": "", "children": [
+        {"name": "a", "full_path": "a", "images": [
+            {"filename": "1.jpg", "modification_date": "2024-05-01", "status": "neutral", "width": 40},
+            {"filename": "2.jpg", "modification_date": "2024-05-02", "status": "good"}],
+         "comment": "", "children": [
+            {"name": "b", "full_path": "a/b", "images": [], "comment": "deep", "children": []}]}]}
+    storage.save('g1/gallery_data.json', json.dumps(legacy).encode('utf-8'))
+
+    manager = SqliteDataManager('', None, storage, str(tmp_path / "metadata.sqlite3"), backup_interval=3600)
+    # Imported from gallery_data.json on first access, in the same shape
+    assert manager.load_gallery_data('g1') == _with_stats(legacy)
+    version = manager.get_gallery_version('g1')
+
+    # Two writers touching different rows no longer overwrite each other
+    other = SqliteDataManager('', None, storage, str(tmp_path / "metadata.sqlite3"))
+    assert manager.update_image_status(['a/1.jpg'], 'bad', 'g1')
+    assert other.update_comment('a/b', 'changed', 'g1')
+    data = manager.load_gallery_data('g1')
+    assert data['children'][0]['images'][0]['status'] == 'bad'
+    assert data['children'][0]['children'][0]['comment'] == 'changed'
+    assert manager.get_gallery_version('g1') != version
+    assert manager.load_date_index('g1') == {'2024-05-01': 1, '2024-05-02': 1}
+
+    merged = manager.merge_gallery_data({"name": "root", "images": [], "comment": "", "children": [
+        {"name": "a", "full_path": "a", "images": [{"filename": "1.jpg"}, {"filename": "3.jpg"}],
+         "comment": "", "children": []}]}, 'g1')
+    assert [image['filename'] for image in merged['children'][0]['images']] == ['1.jpg', '2.jpg', '3.jpg']
+    # Only one backup within the backup interval
+    assert len(manager.get_backup_versions('g1')) == 1
+
+    # A database recreated from an export does not reuse the old ETags
+    version = manager.get_gallery_version('g1')
+    assert manager.export_json('g1')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(tmp_path / f"metadata.sqlite3{suffix}"):
+            os.remove(tmp_path / f"metadata.sqlite3{suffix}")
+    recreated = SqliteDataManager('', None, storage, str(tmp_path / "metadata.sqlite3"))
+    assert recreated.load_gallery_data('g1') == merged
+    assert recreated.get_gallery_version('g1').split('-')[1] != version.split('-')[1]
+
+
+def test_sharded_backend_rewrites_only_the_edited_folder(storage):
+    import json
+    legacy = {"name": "root", "images": [], "comment": "", "children": [
+        {"name": name, "full_path": name, "comment": "", "children": [],
+         "images": [{"filename": f"{name}_{i}.jpg", "modification_date": "2024-05-01", "status": "neutral"}
+                    for i in range(3)]}
+        for name in ("a", "b", "c")]}
+    storage.save('g1/gallery_data.json', json.dumps(legacy).encode('utf-8'))
+
+    manager = ShardedDataManager('', None, storage)
+    assert manager.load_gallery_data('g1') == _with_stats(legacy)
+    shards_before = set(storage.list_files('g1/shards'))
+
+    assert manager.update_image_status(['b_1.jpg'], 'good', 'g1')
+    assert manager.load_section('g1', 'b')['images'][1]['status'] == 'good'
+    # Backups are manifests, and revert restores the earlier tree
+    backup = manager.get_backup_versions('g1')[0]['filename']
+    assert ShardedDataManager('', None, storage).read_backup(backup, 'g1') == _with_stats(legacy)
+    assert manager.revert_to_version(backup, 'g1')
+    assert manager.load_gallery_data('g1') == _with_stats(legacy)
+
+    assert manager.update_comment('c', 'note', 'g1')
+    assert manager.load_date_index('g1') == {'2024-05-01': 9}
+    # One new shard per edit; untouched folders and the filename index are reused
+    assert len(set(storage.list_files('g1/shards')) - shards_before) == 2
+
+    # Garbage collection waits for a save in progress, whose new shards are not referenced yet
+    import threading
+    with manager._lock_for('g1'):
+        collector = threading.Thread(target=manager.collect_garbage, args=('g1',))
+        collector.start()
+        collector.join(0.2)
+        assert collector.is_alive()
+    collector.join()
+    assert manager.load_gallery_data('g1')['children'][2]['comment'] == 'note'
+
+
+class _SlowCountingStorage(LocalStorage):
+    def __init__(self, base_directory):
+        super().__init__(base_directory)
+        self.loads = 0
+
+    def load(self, file_path):
+        self.loads += 1
+        time.sleep(0.05)
+        return super().load(file_path)
+
+
+def test_caching_storage_coalesces_misses_and_invalidates(tmp_path):
+    import threading
+    inner = _SlowCountingStorage(str(tmp_path / "remote"))
+    inner.save('g1/a.jpg', b'a' * 600)
+    inner.save('g1/b.jpg', b'b' * 600)
+    cache = CachingStorage(inner, str(tmp_path / "cache"), disk_max_bytes=1000, memory_ttl=60,
+                           registry=MetricsRegistry())
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.load('g1/a.jpg'))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [b'a' * 600] * 8 and inner.loads == 1
+    assert cache.load('g1/a.jpg') == b'a' * 600 and inner.loads == 1
+
+    # Only one of the two images fits the disk tier
+    cache.load('g1/b.jpg')
+    assert cache.disk._size <= 1000
+    cache.load('g1/a.jpg')
+    assert inner.loads == 3
+
+    # JSON documents are written through to memory and invalidated on delete
+    cache.save('g1/gallery_data.json', b'{}')
+    assert cache.load('g1/gallery_data.json') == b'{}' and inner.loads == 3
+    cache.delete('g1/gallery_data.json')
+    assert not cache.exists('g1/gallery_data.json')
+    with pytest.raises(FileNotFoundError):
+        cache.load('g1/gallery_data.json')
+
+
+def test_caching_storage_reads_documents_from_the_backend_by_default(tmp_path):
+    # A web worker and a job worker, each with its own cache over the same backend
+    inner = LocalStorage(str(tmp_path / "remote"))
+    web = DataManager('', None, CachingStorage(inner, str(tmp_path / "web_cache"), registry=MetricsRegistry()))
+    worker = DataManager('', None, CachingStorage(inner, str(tmp_path / "worker_cache"), registry=MetricsRegistry()))
+    web.save_gallery_data({'name': 'root', 'images': [{'filename': 'a.jpg', 'modification_date': '2024-05-01'}],
+                           'comment': '', 'children': []}, 'g1')
+    web.load_gallery_data('g1')
+
+    worker.merge_gallery_data({'name': 'root', 'images': [{'filename': 'b.jpg', 'modification_date': '2024-05-02'}],
+                               'comment': '', 'children': []}, 'g1')
+    assert web.update_image_status(['a.jpg'], 'good', 'g1')
+
+    images = {image['filename']: image.get('status') for image in worker.load_gallery_data('g1')['images']}
+    assert images.keys() == {'a.jpg', 'b.jpg'} and images['a.jpg'] == 'good'
+
+    # Shards are content-addressed, so they are still cached on disk
+    counting = _SlowCountingStorage(str(tmp_path / "remote"))
+    cache = CachingStorage(counting, str(tmp_path / "shard_cache"), registry=MetricsRegistry())
+    cache.save('g2/shards/0a1b.json', b'{}')
+    cache.save('g2/manifest.json', b'{}')
+    assert cache.load('g2/shards/0a1b.json') == b'{}' and counting.loads == 0
+    assert cache.load('g2/manifest.json') == b'{}' and counting.loads == 1
+
+
+def test_selection_status_and_delete_resolve_server_side(manager):
+    manager.save_gallery_data({'name': 'root', 'images': [_image('r.jpg')], 'comment': '', 'children': [
+        {'name': 'Trip', 'images': [_image('t1.jpg'), _image('t2.jpg', '2024-05-02'), _image('t3.jpg', status='bad')],
+         'comment': '', 'children': [{'name': 'Day 1', 'images': [_image('d1.jpg')], 'comment': '', 'children': []}]},
+        {'name': 'Other', 'images': [_image('o1.jpg')], 'comment': '', 'children': []}
+    ]}, 'g1')
+
+    # Neutral images shown directly under Trip on 2024-05-01, minus an excluded one, plus one by name
+    selection = Selection(folders=['Trip'], recursive=False, status='neutral', date='2024-05-01',
+                          filenames=['o1.jpg'], exclude=['t2.jpg'])
+    result = manager.update_status_by_selection(selection, 'good', 'g1')
+    assert result['matched'] == 2 and sorted(result['filenames']) == ['o1.jpg', 't1.jpg']
+    assert manager.update_status_by_selection(selection, 'good', 'g1')['filenames'] == [] # Now filtered out
+
+    statuses = {}
+    stack = [manager.load_gallery_data('g1')]
+    while stack:
+        node = stack.pop()
+        statuses.update({img['filename']: img['status'] for img in node.get('images', [])})
+        stack.extend(node.get('children', []))
+    assert statuses == {'r.jpg': 'neutral', 't1.jpg': 'good', 't2.jpg': 'neutral', 't3.jpg': 'bad',
+                        'd1.jpg': 'neutral', 'o1.jpg': 'good'}
+    assert manager.catalog.load()['g1']['statuses'] == {'neutral': 3, 'good': 2, 'bad': 1}
+
+    # Deleting a whole subtree also removes the folders it empties
+    result = manager.delete_by_selection(Selection(folders=['Trip']), 'g1')
+    assert sorted(result['filenames']) == ['d1.jpg', 't1.jpg', 't2.jpg', 't3.jpg']
+    data = manager.load_gallery_data('g1')
+    assert [child['name'] for child in data['children']] == ['Other']
+    assert [img['filename'] for img in data['images']] == ['r.jpg']
+
+    with pytest.raises(ValueError):
+        Selection.from_json({'status': 'good'})
+
+
+def test_node_aggregates_follow_status_merge_and_delete(manager):
+    image = functools.partial(_image, size=10)
+    manager.save_gallery_data({'name': 'root', 'images': [], 'comment': '', 'children': [
+        {'name': 'Trip', 'images': [image('t1.jpg'), image('t2.jpg', '2024-05-03', 'good')], 'comment': '',
+         'children': [{'name': 'Day 1', 'images': [image('d1.jpg', '2024-04-30', size=5)], 'comment': '', 'children': []}]},
+        {'name': 'Other', 'images': [image('o1.jpg', status='bad')], 'comment': '', 'children': []}
+    ]}, 'g1')
+
+    def assert_consistent():
+        # The maintained aggregates equal a full recomputation, and the outline carries them
+        data = manager.load_gallery_data('g1')
+        assert data == _with_stats(data)
+        outline = manager.load_outline('g1')
+        assert outline == node_stats.outline(data)
+        assert 'images' not in outline['children'][0]
+        return data
+
+    trip = assert_consistent()['children'][0]['stats']
+    assert trip == {'images': 3, 'good': 1, 'bad': 0, 'neutral': 2, 'bytes': 25,
+                    'first_date': '2024-04-30', 'last_date': '2024-05-03'}
+
+    manager.update_status_by_selection(Selection(folders=['Trip/Day 1']), 'good', 'g1')
+    manager.update_image_status(['o1.jpg'], 'neutral', 'g1')
+    assert assert_consistent()['stats']['good'] == 2
+
+    manager.merge_gallery_data({'name': 'root', 'images': [], 'comment': '', 'children': [
+        {'name': 'Trip', 'images': [], 'comment': '', 'children': [
+            {'name': 'Day 2', 'images': [image('d2.jpg', '2024-05-04', size=7)], 'comment': '', 'children': []}]}]}, 'g1')
+    assert assert_consistent()['children'][0]['stats']['last_date'] == '2024-05-04'
+
+    manager.delete_by_selection(Selection(folders=['Trip/Day 1'], filenames=['t2.jpg']), 'g1')
+    data = assert_consistent()
+    assert data['stats']['images'] == 3 and data['stats']['good'] == 0
+    assert data['children'][0]['stats']['first_date'] == '2024-05-01'
+
+
+def test_report_skips_subtrees_without_reportable_images():
+    from gallery_generator.services.report_service import ReportService
+    tree = {'name': 'root', 'images': [], 'children': [
+        {'name': 'a', 'images': [{'filename': 'a.jpg', 'status': 'neutral'}], 'children': []},
+        {'name': 'b', 'images': [{'filename': 'b.jpg', 'status': 'good'}], 'children': []}]}
+    node_stats.compute(tree)
+    report = ReportService(None)
+    assert [child['name'] for child in report.filter_report_data(tree, 'good_only')['children']] == ['b']
+    assert len(report.filter_report_data(tree, 'good_and_neutral')['children']) == 2
+    # The aggregates alone decide, without looking at the images
+    tree['children'][1]['stats']['good'] = 0
+    assert report.filter_report_data(tree['children'][1], 'good_only') is None
+
+
+def test_search_index_follows_changes_and_persists(make_manager, monkeypatch):
+    manager = make_manager()
+
+    def image(name):
+        # Stored under the name UploadService gives it
+        stem, ext = os.path.splitext(name)
+        return _image(f"{stem}_{hashlib.md5(name.encode()).hexdigest()}{ext}")
+    manager.save_gallery_data({'name': 'root', 'images': [image('cover.jpg')], 'comment': '', 'children': [
+        {'name': 'Summer Trip', 'images': [image('beach_sunset.jpg')], 'comment': 'Lisbon and Porto',
+         'children': [{'name': 'Day 1', 'images': [image('tram.jpg')], 'comment': '', 'children': []}]},
+        {'name': 'Winter', 'images': [image('snow_beach.jpg')], 'comment': '', 'children': []}
+    ]}, 'g1')
+
+    def found(query, **kwargs):
+        return [(hit['kind'], hit['path'], hit['name']) for hit in manager.search('g1', query, **kwargs)['results']]
+
+    # Tokens and prefixes over folder names, comments and original file names; a folder's own name ranks first
+    assert found('summ') == [('folder', 'Summer Trip', 'Summer Trip'), ('folder', 'Summer Trip/Day 1', 'Day 1')]
+    assert found('lisb') == [('folder', 'Summer Trip', 'Summer Trip')]
+    assert found('beach') == [('image', 'Summer Trip', 'beach_sunset.jpg'), ('image', 'Winter', 'snow_beach.jpg')]
+    assert found('beach sun') == [('image', 'Summer Trip', 'beach_sunset.jpg')]
+    assert found('trip', kind='image') == [] and found('jpg') == []
+    assert manager.search('missing', 'beach') is None
+
+    # Writes apply their changes to the persisted index without rebuilding it
+    manager.update_comment('Winter', 'Alps with Lisbon friends', 'g1')
+    manager.update_image_status([image('tram.jpg')['filename']], 'good', 'g1')
+    manager.merge_gallery_data({'name': 'root', 'images': [], 'comment': '', 'children': [
+        {'name': 'Winter', 'images': [image('ski_lift.jpg')], 'comment': '', 'children': []}]}, 'g1')
+    manager.delete_by_selection(Selection(folders=['Summer Trip/Day 1']), 'g1')
+
+    from gallery_generator.services.search_index import SearchIndex
+    with monkeypatch.context() as patch:
+        patch.setattr(SearchIndex, 'build', classmethod(lambda cls, *args: pytest.fail('index rebuilt')))
+        reloaded = make_manager() # A new process loads the persisted index
+        assert [hit['path'] for hit in reloaded.search('g1', 'lisbon')['results']] == ['Summer Trip', 'Winter']
+        assert [hit['name'] for hit in reloaded.search('g1', 'ski')['results']] == ['ski_lift.jpg']
+        assert reloaded.search('g1', 'tram')['total'] == 0 and reloaded.search('g1', 'day')['total'] == 0
+
+    # Changes the index did not see make it stale, and the next search rebuilds it
+    data = manager.load_gallery_data('g1')
+    data['children'][1]['name'] = 'Autumn'
+    manager.save_gallery_data(data, 'g1')
+    assert found('autumn') == [('folder', 'Autumn', 'Autumn')] and found('winter') == []
+
+
+def test_archive_streams_selection_with_folders_and_bounded_prefetch(storage, manager):
+    from gallery_generator.services.archive_service import ArchiveService, MISSING_LIST
+
+    def image(filename, status='good'):
+        storage.save(f"g1/{filename}", filename.encode())
+        return _image(filename, status=status)
+    day = [image(f"img{i}_{hashlib.md5(bytes([i])).hexdigest()}.jpg") for i in range(6)]
+    manager.save_gallery_data({'name': 'root', 'images': [image('cover.png', 'neutral')], 'comment': '', 'children': [
+        {'name': 'Trip', 'images': [image('notes.txt'), image('gone.jpg')], 'comment': '',
+         'children': [{'name': 'Day 1', 'images': day, 'comment': '', 'children': []}]}]}, 'g1')
+    storage.delete('g1/gone.jpg')
+
+    class CountingStorage:
+        loads = 0
+
+        def load(self, path):
+            CountingStorage.loads += 1
+            return storage.load(path)
+    service = ArchiveService(CountingStorage(), manager, prefetch=2)
+    chunks = service.stream_selection(Selection(folders=[''], status='good'), 'g1')
+    buffer = io.BytesIO(next(chunks))
+    assert CountingStorage.loads <= 3 # One being written, `prefetch` ahead
+    for chunk in chunks:
+        buffer.write(chunk)
+
+    with zipfile.ZipFile(buffer) as archive:
+        members = {info.filename: info for info in archive.infolist()}
+        assert sorted(members) == sorted(['Trip/notes.txt', MISSING_LIST] + [f"Trip/Day 1/img{i}.jpg" for i in range(6)])
+        assert archive.read('Trip/Day 1/img3.jpg') == day[3]['filename'].encode()
+        assert archive.read(MISSING_LIST) == b'Trip/gone.jpg\n'
+        assert members['Trip/Day 1/img0.jpg'].compress_type == zipfile.ZIP_STORED
+        assert members['Trip/notes.txt'].compress_type == zipfile.ZIP_DEFLATED
+        assert members['Trip/notes.txt'].date_time == (2024, 5, 1, 0, 0, 0)
+    assert service.stream_selection(Selection(folders=['']), 'missing') is None
+
+
+def test_image_batch_reads_in_parallel(storage):
+    import threading
+    from gallery_generator.services.image_batch import ImageBatchService, decode_frames
+    for i in range(8):
+        storage.save(f"g1/img{i}.jpg", bytes([i]) * 10)
+
+    class SlowStorage:
+        running = peak = 0
+        lock = threading.Lock()
+
+        def load(self, path):
+            with SlowStorage.lock:
+                SlowStorage.running += 1
+                SlowStorage.peak = max(SlowStorage.peak, SlowStorage.running)
+            time.sleep(0.05)
+            with SlowStorage.lock:
+                SlowStorage.running -= 1
+            return storage.load(path)
+
+    raw = b''.join(ImageBatchService(SlowStorage(), max_workers=8).stream('g1', [f"img{i}.jpg" for i in range(8)]))
+    assert SlowStorage.peak > 1 # Reads overlapped instead of running one after another
+    assert sorted((header['filename'], body) for header, body in decode_frames(raw)) == \
+        [(f"img{i}.jpg", bytes([i]) * 10) for i in range(8)]